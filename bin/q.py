@@ -48,7 +48,7 @@ import codecs
 import locale
 import time
 import re
-from six.moves import configparser, range, filter
+from six.moves import configparser, range, filter, filterfalse, zip_longest
 import traceback
 import csv
 import uuid
@@ -58,6 +58,13 @@ import io
 import json
 import datetime
 import hashlib
+import functools
+import itertools
+import bisect
+import mmap
+import random
+import threading
+from six.moves import queue
 
 if six.PY2:
     assert False, 'Python 2 is not longer supported by q'
@@ -249,6 +256,36 @@ class StdevSample(object):
         else:
             return math.sqrt(self.S / (self.k-1))
 
+# The following are used for continuing the stddev aggregates over separate batches of rows (see
+# StreamingAggregationExecutor). A state is stored as a "k:M:S" string
+
+def encode_stdev_state(k, M, S):
+    return '%d:%r:%r' % (k, M, S)
+
+def decode_stdev_state(state):
+    k, M, S = state.split(':')
+    return int(k), float(M), float(S)
+
+class StdevContinuedState(StdevPopulation):
+    # Starts from the state of the previous rows when it is provided, and then steps over the values of the next rows,
+    # so the state is the same as when all the rows are aggregated at once
+    def step(self, state, value):
+        if state is not None:
+            self.k, self.M, self.S = decode_stdev_state(state)
+        else:
+            StdevPopulation.step(self, value)
+
+    def finalize(self):
+        return encode_stdev_state(self.k, self.M, self.S)
+
+def stdev_population_of_state(state):
+    k, M, S = decode_stdev_state(state)
+    return math.sqrt(S / k) if k > 1 else None
+
+def stdev_sample_of_state(state):
+    k, M, S = decode_stdev_state(state)
+    return math.sqrt(S / (k - 1)) if k > 1 else None
+
 class FunctionType(object):
     REGULAR = 1
     AGG = 2
@@ -394,7 +431,9 @@ class Sqlite3DB(object):
         # TODO Is this needed anymore?
         self.sqlite_db_filename = sqlite_db_filename
         self.sqlite_db_url = sqlite_db_url
-        self.conn = sqlite3.connect(self.sqlite_db_url, uri=True)
+        # Inserts might be executed on a separate thread (see BackgroundInserter), but never concurrently with other
+        # statements
+        self.conn = sqlite3.connect(self.sqlite_db_url, uri=True, check_same_thread=False)
         self.last_temp_table_id = 10000
         self.cursor = self.conn.cursor()
         self.add_user_functions()
@@ -443,7 +482,12 @@ class Sqlite3DB(object):
                                content_signature text,
                                creation_time text,
                                source_type text,
-                               source text)""" % self.QCATALOG_TABLE_NAME).fetchall()
+                               source text,
+                               covered_size integer,
+                               covered_record_count integer,
+                               covered_prefix_hash text,
+                               source_file_stat text,
+                               content_fingerprint text)""" % self.QCATALOG_TABLE_NAME).fetchall()
         else:
             xprint("qcatalog table already exists. No need to create it")
 
@@ -514,6 +558,61 @@ class Sqlite3DB(object):
             raise Exception('Table contains an invalid entry - content signature key is not matching the actual content signature')
         return d
 
+    def update_qcatalog_content_signature(self, temp_table_name, content_signature):
+        content_signature_key = self.calculate_content_signature_key(content_signature)
+        xprint("db_id: %s Updating content signature of %s in qcatalog table. Calculated signature key %s" % (self.db_id, temp_table_name, content_signature_key))
+        self.execute_and_fetch('UPDATE %s SET content_signature_key = ?, content_signature = ? WHERE temp_table_name = ?' % self.QCATALOG_TABLE_NAME,
+                               (content_signature_key, json.dumps(content_signature), temp_table_name))
+        self.conn.commit()
+
+    def set_qcatalog_covered_file_prefix(self, temp_table_name, covered_file_prefix):
+        self.execute_and_fetch('UPDATE %s SET covered_size = ?, covered_record_count = ?, covered_prefix_hash = ? WHERE temp_table_name = ?' % self.QCATALOG_TABLE_NAME,
+                               (covered_file_prefix.size, covered_file_prefix.record_count, covered_file_prefix.prefix_hash, temp_table_name))
+        self.conn.commit()
+
+    def get_qcatalog_covered_file_prefix(self, temp_table_name):
+        # Qsql files which have been written by older versions don't have the covered prefix columns
+        qcatalog_column_names = [x[1] for x in self.get_sqlite_table_info(self.QCATALOG_TABLE_NAME)]
+        if 'covered_size' not in qcatalog_column_names:
+            return None
+        r = self.execute_and_fetch('SELECT covered_size, covered_record_count, covered_prefix_hash FROM %s WHERE temp_table_name = ?' % self.QCATALOG_TABLE_NAME,
+                                   (temp_table_name,))
+        if len(r.results) == 0 or r.results[0][0] is None:
+            return None
+        return CoveredFilePrefix(*r.results[0])
+
+    def set_qcatalog_source_file_stat(self, temp_table_name, source_file_stat):
+        self.execute_and_fetch('UPDATE %s SET source_file_stat = ? WHERE temp_table_name = ?' % self.QCATALOG_TABLE_NAME,
+                               (json.dumps(source_file_stat) if source_file_stat is not None else None, temp_table_name))
+        self.conn.commit()
+
+    def get_qcatalog_source_file_stat(self, temp_table_name):
+        # Qsql files which have been written by older versions don't have the source file stat column
+        qcatalog_column_names = [x[1] for x in self.get_sqlite_table_info(self.QCATALOG_TABLE_NAME)]
+        if 'source_file_stat' not in qcatalog_column_names:
+            return None
+        r = self.execute_and_fetch('SELECT source_file_stat FROM %s WHERE temp_table_name = ?' % self.QCATALOG_TABLE_NAME,
+                                   (temp_table_name,))
+        if len(r.results) == 0 or r.results[0][0] is None:
+            return None
+        return OrderedDict(json.loads(r.results[0][0]))
+
+    def set_qcatalog_content_fingerprint(self, temp_table_name, content_fingerprint):
+        self.execute_and_fetch('UPDATE %s SET content_fingerprint = ? WHERE temp_table_name = ?' % self.QCATALOG_TABLE_NAME,
+                               (json.dumps(content_fingerprint.to_dict()) if content_fingerprint is not None else None, temp_table_name))
+        self.conn.commit()
+
+    def get_qcatalog_content_fingerprint(self, temp_table_name):
+        # Qsql files which have been written by older versions don't have the content fingerprint column
+        qcatalog_column_names = [x[1] for x in self.get_sqlite_table_info(self.QCATALOG_TABLE_NAME)]
+        if 'content_fingerprint' not in qcatalog_column_names:
+            return None
+        r = self.execute_and_fetch('SELECT content_fingerprint FROM %s WHERE temp_table_name = ?' % self.QCATALOG_TABLE_NAME,
+                                   (temp_table_name,))
+        if len(r.results) == 0 or r.results[0][0] is None:
+            return None
+        return ContentFingerprint.from_dict(json.loads(r.results[0][0]))
+
     def get_all_from_qcatalog(self):
         xprint("getting from qcatalog using table name")
 
@@ -558,6 +657,11 @@ class Sqlite3DB(object):
     def is_numeric_type(self, column_type):
         return column_type in Sqlite3DB.NUMERIC_COLUMN_TYPES
 
+    def execute_and_get_row_count(self, q, params=None):
+        # Returns the number of rows changed by the statement
+        self.execute_and_fetch(q, params)
+        return self.cursor.rowcount
+
     def update_many(self, sql, params):
         try:
             sqlprint(sql, " params: " + str(params))
@@ -747,6 +851,14 @@ class CannotUnzipDataStreamException(Exception):
     def __init__(self):
         pass
 
+class CannotDecompressInputException(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str(self):
+        return repr(self.msg)
+
 class UniversalNewlinesExistException(Exception):
 
     def __init__(self):
@@ -848,7 +960,1042 @@ class MaximumSourceFilesExceededException(Exception):
 # Simplistic Sql "parsing" class... We'll eventually require a real SQL parser which will provide us with a parse tree
 #
 # A "qtable" is a filename which behaves like an SQL table...
+class SqlToken(object):
+    WORD = 'word'
+    QUOTED_IDENTIFIER = 'quoted_identifier'
+    STRING = 'string'
+    NUMBER = 'number'
+    PARAMETER = 'parameter'
+    OPERATOR = 'operator'
+    OTHER = 'other'
+
+    def __init__(self, token_type, text, start, end):
+        self.token_type = token_type
+        self.text = text
+        self.start = start
+        self.end = end
+
+    def is_word(self, *words):
+        return self.token_type == SqlToken.WORD and self.text.lower() in words
+
+    def is_operator(self, *operators):
+        return self.token_type == SqlToken.OPERATOR and self.text in operators
+
+    def get_identifier_name(self):
+        # Returns the name of the identifier, without any quoting
+        if self.token_type == SqlToken.WORD:
+            return self.text
+        if self.token_type == SqlToken.QUOTED_IDENTIFIER:
+            q = self.text[0]
+            if q == '[':
+                return self.text[1:-1]
+            return self.text[1:-1].replace(q + q, q)
+        return None
+
+    def get_string_value(self):
+        # Returns the value of a string literal, without its blob prefix and quoting
+        if self.token_type != SqlToken.STRING:
+            return None
+        text = self.text[1:] if self.text[0] in 'xX' else self.text
+        # Unterminated strings have no closing quote
+        text = text[1:-1] if len(text) > 1 and text.endswith("'") else text[1:]
+        return text.replace("''", "'")
+
+    def __str__(self):
+        return "SqlToken<%s,%s>" % (self.token_type, self.text)
+    __repr__ = __str__
+
+SQL_TOKEN_REGEX = re.compile(r"""
+     (?P<whitespace>\s+)
+    |(?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+    |(?P<string>[xX]?'(?:[^']|'')*'?)
+    |(?P<quoted_identifier>"(?:[^"]|"")*"?|`(?:[^`]|``)*`?|\[[^\]]*\]?)
+    |(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)
+    |(?P<word>\w+)
+    |(?P<parameter>[?:@$]\w*)
+    |(?P<operator>\|\||<<|>>|<=|>=|==|!=|<>|[-+*/%<>=~&|(),.;])
+    |(?P<other>.)
+    """, re.VERBOSE | re.DOTALL)
+
+def tokenize_sql(sql_text):
+    # A minimal tokenizer, just enough for understanding the structure of simple queries. Whitespace and
+    # comments are dropped
+    tokens = []
+    for m in SQL_TOKEN_REGEX.finditer(sql_text):
+        token_type = m.lastgroup
+        if token_type in ['whitespace', 'comment']:
+            continue
+        tokens.append(SqlToken(token_type, m.group(), m.start(), m.end()))
+    return tokens
+
+class PushedDownCondition(object):
+    # A condition of the form <column> <op> <literal> taken from the top-level conjunction of a WHERE clause
+    def __init__(self, column_name, op, literal_kind=None, literal_text=None):
+        self.column_name = column_name
+        # One of = != < <= > >= isnull notnull
+        self.op = op
+        # One of number, string, null
+        self.literal_kind = literal_kind
+        self.literal_text = literal_text
+
+    def __str__(self):
+        return "PushedDownCondition<%s %s %s:%s>" % (self.column_name, self.op, self.literal_kind, self.literal_text)
+    __repr__ = __str__
+
+class SimpleSelectQuery(object):
+    # The clauses of a single-table SELECT statement with no subqueries, joins or compound operators. Each clause is
+    # a list of tokens of the template sql (see Sql.get_template_sql). Queries which don't have this shape are not
+    # parsed at all
+    CLAUSE_ORDER = ['select', 'from', 'where', 'group', 'having', 'order', 'limit', 'offset']
+    COMPARISON_OPERATORS = {'=': '=', '==': '=', '!=': '!=', '<>': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+    BUILTIN_AGGREGATE_FUNCTION_NAMES = ['count', 'sum', 'total', 'avg', 'min', 'max', 'group_concat']
+    FLIPPED_OPERATORS = {'=': '=', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+    # sqlite's names for the rowid, which depends on which rows were inserted into the table and in which order
+    ROWID_COLUMN_NAMES = ['rowid', 'oid', '_rowid_']
+
+    def __init__(self, qtable_name, table_alias, clauses, clause_start_offsets):
+        self.qtable_name = qtable_name
+        self.table_alias = table_alias
+        self.clauses = clauses
+        # Offset of the keyword of each clause in the template sql
+        self.clause_start_offsets = clause_start_offsets
+
+    def __str__(self):
+        return "SimpleSelectQuery<qtable_name=%s,table_alias=%s,clauses=%s>" % (self.qtable_name, self.table_alias, list(self.clauses.keys()))
+    __repr__ = __str__
+
+    @staticmethod
+    def parse(tokens, placeholder_to_qtable_name):
+        if len(tokens) > 0 and tokens[-1].is_operator(';'):
+            tokens = tokens[:-1]
+        if len(tokens) == 0 or not tokens[0].is_word('select'):
+            return None
+
+        words = [t.text.lower() for t in tokens if t.token_type == SqlToken.WORD]
+        if words.count('select') != 1:
+            return None
+        if any(w in words for w in ['union', 'intersect', 'except', 'with', 'join', 'values', 'natural', 'window']):
+            return None
+
+        clauses = OrderedDict([('select', [])])
+        clause_start_offsets = {'select': tokens[0].start}
+        current_clause = 'select'
+        depth = 0
+        i = 1
+        while i < len(tokens):
+            t = tokens[i]
+            if depth == 0 and t.token_type == SqlToken.WORD:
+                w = t.text.lower()
+                new_clause = None
+                if w in ['group', 'order'] and i + 1 < len(tokens) and tokens[i + 1].is_word('by'):
+                    new_clause = w
+                    i += 1
+                elif w in ['from', 'where', 'having', 'limit'] or (w == 'offset' and current_clause == 'limit'):
+                    new_clause = w
+                if new_clause is not None:
+                    if new_clause in clauses:
+                        return None
+                    clauses[new_clause] = []
+                    clause_start_offsets[new_clause] = t.start
+                    current_clause = new_clause
+                    i += 1
+                    continue
+            if t.is_operator('(') or t.is_word('case'):
+                depth += 1
+            elif t.is_operator(')') or t.is_word('end'):
+                depth -= 1
+                if depth < 0:
+                    return None
+            elif t.is_operator(';'):
+                return None
+            clauses[current_clause].append(t)
+            i += 1
+
+        clause_names = list(clauses.keys())
+        if clause_names != [c for c in SimpleSelectQuery.CLAUSE_ORDER if c in clauses] or 'from' not in clauses:
+            return None
+        if any(len(clause_tokens) == 0 for clause_tokens in clauses.values()):
+            return None
+
+        from_tokens = clauses['from']
+        if from_tokens[0].text not in placeholder_to_qtable_name:
+            return None
+        if len(from_tokens) == 1:
+            table_alias = None
+        elif len(from_tokens) == 2:
+            table_alias = from_tokens[1].get_identifier_name()
+        elif len(from_tokens) == 3 and from_tokens[1].is_word('as'):
+            table_alias = from_tokens[2].get_identifier_name()
+        else:
+            return None
+        if len(from_tokens) > 1 and (table_alias is None or from_tokens[-1].is_word('indexed', 'not')):
+            return None
+
+        return SimpleSelectQuery(placeholder_to_qtable_name[from_tokens[0].text], table_alias, clauses, clause_start_offsets)
+
+    def has_clause(self, clause_name):
+        return clause_name in self.clauses
+
+    @staticmethod
+    def split_top_level(tokens, separator):
+        # Splits the tokens by a separator which is not nested inside parentheses or CASE expressions
+        parts = [[]]
+        depth = 0
+        for t in tokens:
+            if t.is_operator('(') or t.is_word('case'):
+                depth += 1
+            elif t.is_operator(')') or t.is_word('end'):
+                depth -= 1
+            elif depth == 0 and t.is_operator(separator):
+                parts.append([])
+                continue
+            parts[-1].append(t)
+        return parts
+
+    @staticmethod
+    def remove_alias(tokens):
+        # Returns the expression tokens of a result column, without its alias
+        if len(tokens) >= 3 and tokens[-2].is_word('as'):
+            return tokens[:-2]
+        if len(tokens) >= 2 and tokens[-1].token_type in [SqlToken.WORD, SqlToken.QUOTED_IDENTIFIER] and \
+                (tokens[-2].is_operator(')') or tokens[-2].token_type in [SqlToken.WORD, SqlToken.QUOTED_IDENTIFIER, SqlToken.NUMBER, SqlToken.STRING]):
+            return tokens[:-1]
+        return tokens
+
+    def get_result_column_aliases(self):
+        # Returns the lower-cased aliases of the result columns
+        aliases = set()
+        for item_tokens in SimpleSelectQuery.split_top_level(self.clauses['select'], ','):
+            if len(SimpleSelectQuery.remove_alias(item_tokens)) < len(item_tokens):
+                aliases.add(item_tokens[-1].get_identifier_name().lower())
+        return aliases
+
+    def get_where_conjuncts(self):
+        # Returns the token lists of the top-level AND-ed terms of the WHERE clause, or None if the WHERE clause is not
+        # a conjunction
+        if 'where' not in self.clauses:
+            return []
+        conjuncts = [[]]
+        depth = 0
+        inside_between = False
+        for t in self.clauses['where']:
+            if t.is_operator('(') or t.is_word('case'):
+                depth += 1
+            elif t.is_operator(')') or t.is_word('end'):
+                depth -= 1
+            elif depth == 0:
+                if t.is_word('or'):
+                    return None
+                if t.is_word('between'):
+                    inside_between = True
+                elif t.is_word('and'):
+                    if inside_between:
+                        inside_between = False
+                    else:
+                        conjuncts.append([])
+                        continue
+            conjuncts[-1].append(t)
+        return conjuncts
+
+    def _parse_column_reference(self, tokens):
+        if len(tokens) == 1:
+            return tokens[0].get_identifier_name()
+        if len(tokens) == 3 and tokens[1].is_operator('.') and self.table_alias is not None:
+            qualifier = tokens[0].get_identifier_name()
+            if qualifier is not None and qualifier.lower() == self.table_alias.lower():
+                return tokens[2].get_identifier_name()
+        return None
+
+    def _parse_literal(self, tokens):
+        if len(tokens) == 1:
+            t = tokens[0]
+            if t.token_type == SqlToken.NUMBER:
+                return 'number', t.text
+            if t.token_type == SqlToken.STRING and t.text.startswith("'") and len(t.text) >= 2 and t.text.endswith("'"):
+                return 'string', t.text[1:-1].replace("''", "'")
+            if t.is_word('null'):
+                return 'null', None
+        elif len(tokens) == 2 and tokens[0].is_operator('-', '+') and tokens[1].token_type == SqlToken.NUMBER:
+            return 'number', tokens[0].text + tokens[1].text
+        return None
+
+    def _parse_condition(self, tokens):
+        words = [t.text.lower() if t.token_type == SqlToken.WORD else None for t in tokens]
+
+        # IS NULL / IS NOT NULL and their shorthands
+        for suffix, op in [(['is', 'null'], 'isnull'), (['is', 'not', 'null'], 'notnull'), (['isnull'], 'isnull'),
+                           (['notnull'], 'notnull'), (['not', 'null'], 'notnull')]:
+            if len(tokens) > len(suffix) and words[-len(suffix):] == suffix:
+                column_name = self._parse_column_reference(tokens[:-len(suffix)])
+                if column_name is not None:
+                    return [PushedDownCondition(column_name, op)]
+
+        if 'between' in words and 'and' in words:
+            between_index = words.index('between')
+            and_index = words.index('and')
+            column_name = self._parse_column_reference(tokens[:between_index])
+            low = self._parse_literal(tokens[between_index + 1:and_index])
+            high = self._parse_literal(tokens[and_index + 1:])
+            if column_name is not None and low is not None and high is not None:
+                return [PushedDownCondition(column_name, '>=', *low), PushedDownCondition(column_name, '<=', *high)]
+            return []
+
+        for op_index, t in enumerate(tokens):
+            if t.token_type == SqlToken.OPERATOR and t.text in SimpleSelectQuery.COMPARISON_OPERATORS:
+                op = SimpleSelectQuery.COMPARISON_OPERATORS[t.text]
+                left, right = tokens[:op_index], tokens[op_index + 1:]
+                column_name, literal = self._parse_column_reference(left), self._parse_literal(right)
+                if column_name is None or literal is None:
+                    column_name, literal = self._parse_column_reference(right), self._parse_literal(left)
+                    op = SimpleSelectQuery.FLIPPED_OPERATORS[op]
+                if column_name is not None and literal is not None:
+                    return [PushedDownCondition(column_name, op, *literal)]
+                return []
+        return []
+
+    def references_rowid(self):
+        for clause_tokens in self.clauses.values():
+            for t in clause_tokens:
+                name = t.get_identifier_name()
+                if name is None and t.token_type == SqlToken.STRING:
+                    name = t.get_string_value()
+                if name is not None and name.lower() in SimpleSelectQuery.ROWID_COLUMN_NAMES:
+                    return True
+        return False
+
+    def get_pushed_down_conditions(self):
+        # Filtering rows while loading would change the rowids of the rows which are inserted
+        if self.references_rowid():
+            return []
+        conjuncts = self.get_where_conjuncts()
+        if conjuncts is None:
+            return []
+        conditions = []
+        for conjunct in conjuncts:
+            conditions += self._parse_condition(conjunct)
+        return conditions
+
+    def is_where_clause_fully_pushed_down(self):
+        if self.references_rowid() and 'where' in self.clauses:
+            return False
+        conjuncts = self.get_where_conjuncts()
+        if conjuncts is None:
+            return False
+        return all(len(self._parse_condition(conjunct)) > 0 for conjunct in conjuncts)
+
+    def is_count_only(self):
+        # True for queries which only count the rows of the table, e.g. select count(*) from <table>
+        if list(self.clauses.keys()) != ['select', 'from']:
+            return False
+        select_tokens = self.clauses['select']
+        if len(select_tokens) < 4 or not select_tokens[0].is_word('count') or [t.text for t in select_tokens[1:4]] != ['(', '*', ')']:
+            return False
+        alias_tokens = select_tokens[4:]
+        if len(alias_tokens) > 0 and alias_tokens[0].is_word('as'):
+            alias_tokens = alias_tokens[1:]
+        return len(alias_tokens) == 0 or (len(alias_tokens) == 1 and alias_tokens[0].get_identifier_name() is not None)
+
+    def _is_aggregating(self):
+        aggregate_function_names = set(SimpleSelectQuery.BUILTIN_AGGREGATE_FUNCTION_NAMES +
+                                       [udf.name.lower() for udf in user_functions if udf.func_type == FunctionType.AGG])
+        select_tokens = self.clauses['select']
+        for i, t in enumerate(select_tokens):
+            if t.is_word('over'):
+                return True
+            if t.token_type == SqlToken.WORD and t.text.lower() in aggregate_function_names and \
+                    i + 1 < len(select_tokens) and select_tokens[i + 1].is_operator('('):
+                return True
+        return False
+
+    def _parse_non_negative_integer(self, tokens):
+        if len(tokens) == 1 and tokens[0].token_type == SqlToken.NUMBER and INTEGER_VALUE_REGEX.match(tokens[0].text):
+            return int(tokens[0].text)
+        return None
+
+    def get_limit_and_offset(self):
+        # Returns (limit, offset) for a LIMIT clause with constant values, or None
+        if 'limit' not in self.clauses:
+            return None
+        limit_tokens = self.clauses['limit']
+        comma_indices = [i for i, t in enumerate(limit_tokens) if t.is_operator(',')]
+        if len(comma_indices) == 0:
+            limit = self._parse_non_negative_integer(limit_tokens)
+            offset = self._parse_non_negative_integer(self.clauses['offset']) if 'offset' in self.clauses else 0
+        elif len(comma_indices) == 1 and 'offset' not in self.clauses:
+            offset = self._parse_non_negative_integer(limit_tokens[:comma_indices[0]])
+            limit = self._parse_non_negative_integer(limit_tokens[comma_indices[0] + 1:])
+        else:
+            return None
+        if limit is None or offset is None:
+            return None
+        return limit, offset
+
+    def is_row_wise(self):
+        # True if each row of the table produces its own output rows, regardless of the other rows. Such queries
+        # can be evaluated on any split of the table into batches
+        if any(c not in ['select', 'from', 'where', 'limit', 'offset'] for c in self.clauses.keys()):
+            return False
+        if self.clauses['select'][0].is_word('distinct') or self._is_aggregating():
+            return False
+        return 'limit' not in self.clauses or self.get_limit_and_offset() is not None
+
+    def get_sql_without_limit(self, template_sql):
+        if 'limit' not in self.clauses:
+            return template_sql
+        return template_sql[:self.clause_start_offsets['limit']].rstrip()
+
+    def get_top_n(self):
+        # For queries which return the first rows of the table by an ORDER BY of plain columns, returns
+        # (list of (column name, is descending), number of rows needed). Returns None for all other queries
+        if any(c not in ['select', 'from', 'where', 'order', 'limit', 'offset'] for c in self.clauses.keys()) or 'order' not in self.clauses:
+            return None
+        if self.clauses['select'][0].is_word('distinct') or self._is_aggregating():
+            return None
+        # Only the top rows are inserted, so their rowids would not be the same as in the full table
+        if self.references_rowid():
+            return None
+        if not self.is_where_clause_fully_pushed_down():
+            return None
+        limit_and_offset = self.get_limit_and_offset()
+        if limit_and_offset is None or limit_and_offset[0] == 0:
+            return None
+
+        aliases = self.get_result_column_aliases()
+        ordering = []
+        for term_tokens in SimpleSelectQuery.split_top_level(self.clauses['order'], ','):
+            descending = False
+            if len(term_tokens) > 0 and term_tokens[-1].is_word('asc', 'desc'):
+                descending = term_tokens[-1].is_word('desc')
+                term_tokens = term_tokens[:-1]
+            column_name = self._parse_column_reference(term_tokens)
+            # Result column aliases take precedence over table columns in ORDER BY
+            if column_name is None or column_name.lower() in aliases:
+                return None
+            ordering.append((column_name, descending))
+        return ordering, sum(limit_and_offset)
+
+    def get_row_limit(self):
+        # Returns the number of rows matching the WHERE clause which are enough for computing the result of the
+        # query, or None if all rows are needed
+        if 'limit' not in self.clauses or any(c in self.clauses for c in ['group', 'having', 'order']):
+            return None
+        if self.references_rowid():
+            return None
+        if self.clauses['select'][0].is_word('distinct') or self._is_aggregating():
+            return None
+        if not self.is_where_clause_fully_pushed_down():
+            return None
+
+        limit_and_offset = self.get_limit_and_offset()
+        if limit_and_offset is None or sum(limit_and_offset) == 0:
+            return None
+        return sum(limit_and_offset)
+
+STRICT_NUMERIC_VALUE_REGEX = re.compile(r'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?\Z')
+INTEGER_VALUE_REGEX = re.compile(r'[+-]?[0-9]+\Z')
+# Beyond this precision, sqlite's own text to number conversion might differ from python's
+MAX_EXACT_SIGNIFICANT_DIGITS = 15
+
+def get_sqlite_numeric_comparison_key(v):
+    # Emulates sqlite's numeric affinity for a text value. Returns (1,number) for values that sqlite converts to numbers,
+    # (2,text) for values that are kept as text, and None when the result is not certain. In sqlite, numbers are
+    # always smaller than text values
+    if STRICT_NUMERIC_VALUE_REGEX.match(v):
+        mantissa = v.lstrip('+-').lower().split('e')[0]
+        if len(mantissa.replace('.', '').lstrip('0')) > MAX_EXACT_SIGNIFICANT_DIGITS:
+            return None
+        if INTEGER_VALUE_REGEX.match(v):
+            return (1, int(v))
+        return (1, float(v))
+    if STRICT_NUMERIC_VALUE_REGEX.match(v.strip()):
+        return None
+    return (2, v)
+
+class RowFilter(object):
+    # Evaluates pushed down WHERE conditions on a normalized row before it is inserted, emulating sqlite's affinity and
+    # comparison rules. A row is rejected only when it provably cannot match the query, all other rows are kept
+    MATCH = 'match'
+    NO_MATCH = 'no-match'
+    UNKNOWN = 'unknown'
+
+    def __init__(self, conditions, is_complete):
+        # List of (column index, op, column has numeric affinity, comparison key of the literal)
+        self.conditions = conditions
+        # True if all the pushed down conditions are evaluated by the filter
+        self.is_complete = is_complete
+
+    def __str__(self):
+        return "RowFilter<%s>" % str(self.conditions)
+    __repr__ = __str__
+
+    @staticmethod
+    def _get_literal_comparison_key(condition, is_numeric_column):
+        # Returns (is_pushable, key), where a key of None means a NULL literal
+        if condition.literal_kind == 'null':
+            return True, None
+        if is_numeric_column:
+            # Numeric affinity is applied to the literal
+            key = get_sqlite_numeric_comparison_key(condition.literal_text)
+            return key is not None, key
+        # Text affinity is applied to the literal
+        if condition.literal_kind == 'string':
+            return True, (2, condition.literal_text)
+        if INTEGER_VALUE_REGEX.match(condition.literal_text) and len(condition.literal_text) <= MAX_EXACT_SIGNIFICANT_DIGITS:
+            return True, (2, str(int(condition.literal_text)))
+        return False, None
+
+    @staticmethod
+    def create(pushed_down_conditions, column_names, column_types):
+        column_indices = dict([(column_name.lower(), i) for i, column_name in enumerate(column_names)])
+        conditions = []
+        for condition in pushed_down_conditions:
+            column_index = column_indices.get(condition.column_name.lower())
+            if column_index is None:
+                continue
+            is_numeric_column = column_types[column_index] in Sqlite3DB.NUMERIC_COLUMN_TYPES
+            if condition.op in ['isnull', 'notnull']:
+                conditions.append((column_index, condition.op, is_numeric_column, None))
+                continue
+            is_pushable, literal_key = RowFilter._get_literal_comparison_key(condition, is_numeric_column)
+            if is_pushable:
+                conditions.append((column_index, condition.op, is_numeric_column, literal_key))
+        if len(conditions) == 0:
+            return None
+        return RowFilter(conditions, len(conditions) == len(pushed_down_conditions))
+
+    def matches(self, col_vals):
+        return self.evaluate(col_vals) != RowFilter.NO_MATCH
+
+    def evaluate(self, col_vals):
+        result = RowFilter.MATCH
+        for column_index, op, is_numeric_column, literal_key in self.conditions:
+            v = col_vals[column_index]
+            if op == 'isnull':
+                if v is not None:
+                    return RowFilter.NO_MATCH
+                continue
+            if op == 'notnull':
+                if v is None:
+                    return RowFilter.NO_MATCH
+                continue
+            # Comparisons with NULL are never true
+            if v is None or literal_key is None:
+                return RowFilter.NO_MATCH
+            if is_numeric_column:
+                value_key = get_sqlite_numeric_comparison_key(v)
+                if value_key is None:
+                    result = RowFilter.UNKNOWN
+                    continue
+            else:
+                value_key = (2, v)
+            if op == '=':
+                r = value_key == literal_key
+            elif op == '!=':
+                r = value_key != literal_key
+            elif op == '<':
+                r = value_key < literal_key
+            elif op == '<=':
+                r = value_key <= literal_key
+            elif op == '>':
+                r = value_key > literal_key
+            else:
+                r = value_key >= literal_key
+            if not r:
+                return RowFilter.NO_MATCH
+        return result
+
+@functools.total_ordering
+class DescendingSortKey(object):
+    def __init__(self, key):
+        self.key = key
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+class TopNRowCollector(object):
+    # Keeps only the rows which might be among the first rows of an ORDER BY ... LIMIT query, so they can be inserted
+    # into the table instead of all rows. Sort keys emulate sqlite's ordering of values (see
+    # get_sqlite_numeric_comparison_key). Rows tied with the last needed row are kept, and so are rows whose sort key
+    # or WHERE clause result is uncertain, so sqlite makes all the final decisions
+    MIN_ROWS_BEFORE_PRUNING = 5000
+
+    def __init__(self, sort_columns, row_count):
+        # List of (column index, column has numeric affinity, is descending)
+        self.sort_columns = sort_columns
+        self.row_count = row_count
+        # Lists of (sort key, row number, row)
+        self.candidates = []
+        self.uncertain_rows = []
+        # Rows which are sorted after this key cannot be among the first rows
+        self.threshold_key = None
+        self.row_number = 0
+
+    def __str__(self):
+        return "TopNRowCollector<sort_columns=%s,row_count=%s>" % (self.sort_columns, self.row_count)
+    __repr__ = __str__
+
+    @staticmethod
+    def create(ordering, row_count, column_names, column_types):
+        column_indices = dict([(column_name.lower(), i) for i, column_name in enumerate(column_names)])
+        sort_columns = []
+        for column_name, descending in ordering:
+            column_index = column_indices.get(column_name.lower())
+            if column_index is None:
+                return None
+            sort_columns.append((column_index, column_types[column_index] in Sqlite3DB.NUMERIC_COLUMN_TYPES, descending))
+        return TopNRowCollector(sort_columns, row_count)
+
+    def _get_sort_key(self, col_vals):
+        key = []
+        for column_index, is_numeric_column, descending in self.sort_columns:
+            v = col_vals[column_index] if column_index < len(col_vals) else None
+            if v is None:
+                value_key = (0,)
+            elif is_numeric_column:
+                value_key = get_sqlite_numeric_comparison_key(v)
+                if value_key is None:
+                    return None
+            else:
+                value_key = (2, v)
+            key.append(DescendingSortKey(value_key) if descending else value_key)
+        return tuple(key)
+
+    def add(self, col_vals, is_certain_match):
+        self.row_number += 1
+        key = self._get_sort_key(col_vals)
+        if key is None or not is_certain_match:
+            self.uncertain_rows.append((None, self.row_number, col_vals))
+            return
+        if self.threshold_key is not None and key > self.threshold_key:
+            return
+        self.candidates.append((key, self.row_number, col_vals))
+        if len(self.candidates) >= 2 * self.row_count + TopNRowCollector.MIN_ROWS_BEFORE_PRUNING:
+            self._prune()
+
+    def _prune(self):
+        self.candidates.sort(key=lambda c: c[0])
+        self.threshold_key = self.candidates[self.row_count - 1][0]
+        kept_count = self.row_count
+        while kept_count < len(self.candidates) and not self.candidates[kept_count][0] > self.threshold_key:
+            kept_count += 1
+        del self.candidates[kept_count:]
+
+    def get_rows(self):
+        # Returns the kept rows in their original order
+        if len(self.candidates) > self.row_count:
+            self._prune()
+        return [row for _, _, row in sorted(self.candidates + self.uncertain_rows, key=lambda c: c[1])]
+
+class RowSampler(object):
+    # Selects a uniform random sample of the rows of a stream. A fraction keeps each row with that probability
+    # (Bernoulli sampling), and a row count keeps a fixed-size reservoir of rows (Li's algorithm L), so both skip most
+    # rows without drawing a random number for each one. Kept reservoir rows are returned in their original order
+    def __init__(self, sample, random_generator):
+        self.sample = sample
+        self.random_generator = random_generator
+        self.is_reservoir = not isinstance(sample, float)
+        self.row_number = 0
+        self.selected_row_count = 0
+        # Lists of (row number, row)
+        self.reservoir = []
+        self.weight = None
+        self.next_row_number = None
+        if not self.is_reservoir:
+            self._skip_rows()
+
+    def __str__(self):
+        return "RowSampler<sample=%s,is_reservoir=%s>" % (self.sample, self.is_reservoir)
+    __repr__ = __str__
+
+    def _random_log(self):
+        # random() can return 0.0, which has no logarithm
+        return math.log(1.0 - self.random_generator.random())
+
+    def _skip_rows(self):
+        if self.is_reservoir:
+            self.weight *= math.exp(self._random_log() / self.sample)
+            skipped_rows = int(math.floor(self._random_log() / math.log1p(-self.weight))) if self.weight < 1.0 else 0
+        else:
+            skipped_rows = int(math.floor(self._random_log() / math.log1p(-self.sample))) if self.sample < 1.0 else 0
+        self.next_row_number = self.row_number + skipped_rows + 1
+
+    def add(self, col_vals):
+        # Returns whether the row should be inserted right away. Reservoir rows are inserted after all rows are read
+        self.row_number += 1
+        if self.is_reservoir and self.row_number <= self.sample:
+            self.reservoir.append((self.row_number, col_vals))
+            if self.row_number == self.sample:
+                self.weight = 1.0
+                self._skip_rows()
+            return False
+        if self.row_number != self.next_row_number:
+            return False
+        self._skip_rows()
+        if not self.is_reservoir:
+            self.selected_row_count += 1
+            return True
+        self.reservoir[self.random_generator.randrange(self.sample)] = (self.row_number, col_vals)
+        return False
+
+    def get_rows(self):
+        return [row for _, row in sorted(self.reservoir, key=lambda r: r[0])]
+
+    def get_sampled_row_count(self):
+        return len(self.reservoir) if self.is_reservoir else self.selected_row_count
+
+def parse_sample_size(s):
+    # A sample size is either a fraction of the rows (0 < fraction <= 1) or a row count. Raises ValueError otherwise
+    s = s.strip()
+    if re.match(r'^[0-9]+$', s):
+        row_count = int(s)
+        if row_count < 1:
+            raise ValueError('Sample row count must be at least 1')
+        return row_count
+    fraction = float(s)
+    if not 0.0 < fraction <= 1.0:
+        raise ValueError('Sample fraction must be larger than 0 and at most 1')
+    return fraction
+
+def get_sample_size_description(sample):
+    if isinstance(sample, float):
+        return 'fraction %s' % sample
+    return '%s rows' % sample
+
+class StreamingQueryExecutor(object):
+    # Evaluates a row-wise query (see SimpleSelectQuery.is_row_wise) on each batch of rows right after it is inserted
+    # into the table, passes the results to an output writer, and deletes the batch. The table never holds more than
+    # one batch, so memory usage does not depend on the size of the input
+    def __init__(self, template_sql, qtable_placeholder, limit_and_offset, output_writer):
+        self.template_sql = template_sql
+        self.qtable_placeholder = qtable_placeholder
+        self.limit, self.offset = limit_and_offset if limit_and_offset is not None else (None, 0)
+        self.output_writer = output_writer
+
+        self.writes_output = True
+        self.started = False
+        self.column_names = None
+        self.skipped_row_count = 0
+        self.output_row_count = 0
+
+    def __str__(self):
+        return "StreamingQueryExecutor<template_sql=%s,limit=%s,offset=%s>" % (self.template_sql, self.limit, self.offset)
+    __repr__ = __str__
+
+    def is_done(self):
+        if self.output_writer.is_closed():
+            return True
+        return self.limit is not None and self.output_row_count >= self.limit
+
+    def process_batch(self, sqlite_db, table_name):
+        sql = self.template_sql.replace(self.qtable_placeholder, table_name)
+        db_results_obj = sqlite_db.execute_and_fetch(sql)
+        sqlite_db.execute_and_fetch('DELETE FROM %s' % table_name)
+
+        if not self.started:
+            self.started = True
+            self.column_names = db_results_obj.query_column_names
+            self.output_writer.start(self.column_names)
+
+        rows = db_results_obj.results
+        if self.skipped_row_count < self.offset:
+            skipped_rows = min(len(rows), self.offset - self.skipped_row_count)
+            self.skipped_row_count += skipped_rows
+            rows = rows[skipped_rows:]
+        if self.limit is not None:
+            rows = rows[:max(0, self.limit - self.output_row_count)]
+        if len(rows) > 0 and not self.output_writer.is_closed():
+            self.output_row_count += len(rows)
+            self.output_writer.write_rows(rows)
+
+    def get_results(self):
+        # The results have already been written
+        return None
+
+DEFAULT_MAX_IN_MEMORY_AGGREGATION_GROUPS = 1000000
+# Since sqlite 3.43, sums of floats are compensated, so a sum cannot be continued exactly from its previous result
+SQLITE_SUMS_CAN_BE_CONTINUED = sqlite3.sqlite_version_info < (3, 43, 0)
+
+class StreamingAggregationExecutor(object):
+    # Evaluates an aggregation query on each batch of rows right after it is inserted into the table, and deletes the
+    # batch. Only the aggregation state of each group is kept, in a state table, so memory usage depends on the number
+    # of groups and not on the number of rows. When there are too many groups, the state table is moved to a temporary
+    # file. The final results are computed from the state table
+    STATE_DB_ID = 'q_aggregation_spill'
+    BATCH_GROUPS_TABLE_NAME = 'q_aggregation_batch_groups'
+    CONTINUED_STATES_TABLE_NAME = 'q_aggregation_continued_states'
+
+    # Aggregate function name -> list of (value of each row, aggregate which continues a state over the previous state
+    # {seed} and the values {value} of the next rows), and the final expression in which {0}, {1}... are the states.
+    # Values are added to the previous sums in the order of the rows, so the sums are the same as when all the rows are
+    # aggregated at once
+    SUPPORTED_AGGREGATES = {
+        'count': ([('CASE WHEN ({arg}) IS NULL THEN 0 ELSE 1 END', 'sum(coalesce({seed},{value}))')], 'coalesce({0},0)'),
+        'sum': ([('{arg}', 'sum(coalesce({seed},{value}))')], '{0}'),
+        'total': ([('{arg}', 'total(coalesce({seed},{value}))')], '{0}'),
+        'min': ([('{arg}', 'min(coalesce({seed},{value}))')], '{0}'),
+        'max': ([('{arg}', 'max(coalesce({seed},{value}))')], '{0}'),
+        'avg': ([('{arg}', 'total(coalesce({seed},{value}))'), ('CASE WHEN ({arg}) IS NULL THEN 0 ELSE 1 END', 'sum(coalesce({seed},{value}))')],
+                'CASE WHEN {1} > 0 THEN {0} / {1} END'),
+        'stddev_pop': ([('{arg}', 'q_stddev_continued_state({seed},{value})')], 'q_stddev_population_of_state({0})'),
+        'stddev_sample': ([('{arg}', 'q_stddev_continued_state({seed},{value})')], 'q_stddev_sample_of_state({0})')
+    }
+    SUMMING_AGGREGATES = ['sum', 'total', 'avg']
+
+    def __init__(self, template_sql, qtable_placeholder, key_expressions, partial_aggregates, final_expressions,
+                 from_and_where_sql, limit_sql, max_in_memory_groups):
+        self.template_sql = template_sql
+        self.qtable_placeholder = qtable_placeholder
+        self.key_expressions = key_expressions
+        # List of (value expression, continuing aggregate template)
+        self.partial_aggregates = partial_aggregates
+        self.final_expressions = final_expressions
+        self.from_and_where_sql = from_and_where_sql
+        self.limit_sql = limit_sql
+        self.max_in_memory_groups = max_in_memory_groups
+
+        self.writes_output = False
+        self.started = False
+        self.sqlite_db = None
+        self.column_names = None
+        self.state_table_name = None
+        self.state_table_index = 0
+        self.group_count = 0
+        self.spill_filename = None
+
+    def __str__(self):
+        return "StreamingAggregationExecutor<keys=%s,partial_aggregates=%s,final_expressions=%s>" % (self.key_expressions, self.partial_aggregates, self.final_expressions)
+    __repr__ = __str__
+
+    @staticmethod
+    def _get_token_key(tokens):
+        return tuple([t.text.lower() if t.token_type == SqlToken.WORD else t.text for t in tokens])
+
+    @staticmethod
+    def create(simple_select_query, template_sql, qtable_placeholder, max_in_memory_groups):
+        # Returns an executor for the query, or None if it is not a supported aggregation query
+        clauses = simple_select_query.clauses
+        if any(c not in ['select', 'from', 'where', 'group', 'limit', 'offset'] for c in clauses.keys()):
+            return None
+        if clauses['select'][0].is_word('distinct') or any(t.is_word('over', 'distinct') for t in clauses['select']):
+            return None
+
+        all_aggregate_names = set(SimpleSelectQuery.BUILTIN_AGGREGATE_FUNCTION_NAMES +
+                                  [udf.name.lower() for udf in user_functions if udf.func_type == FunctionType.AGG])
+
+        def contains_aggregate(tokens):
+            return any(t.token_type == SqlToken.WORD and t.text.lower() in all_aggregate_names and i + 1 < len(tokens) and tokens[i + 1].is_operator('(')
+                       for i, t in enumerate(tokens))
+
+        key_token_lists = SimpleSelectQuery.split_top_level(clauses['group'], ',') if 'group' in clauses else []
+        for key_tokens in key_token_lists:
+            if len(key_tokens) == 0 or contains_aggregate(key_tokens):
+                return None
+            # Ordinals and result column aliases are resolved differently than expressions
+            if len(key_tokens) == 1 and key_tokens[0].token_type == SqlToken.NUMBER:
+                return None
+            if any(t.is_word('collate') for t in key_tokens):
+                return None
+        key_keys = [StreamingAggregationExecutor._get_token_key(key_tokens) for key_tokens in key_token_lists]
+
+        select_items = SimpleSelectQuery.split_top_level(clauses['select'], ',')
+        aliases = simple_select_query.get_result_column_aliases()
+        for key_tokens in key_token_lists:
+            if len(key_tokens) == 1 and key_tokens[0].get_identifier_name() is not None and key_tokens[0].get_identifier_name().lower() in aliases:
+                return None
+
+        partial_aggregates = []
+        final_expressions = []
+        has_aggregates = False
+        for item_tokens in select_items:
+            expression_tokens = SimpleSelectQuery.remove_alias(item_tokens)
+            if len(expression_tokens) == 0:
+                return None
+            expression_key = StreamingAggregationExecutor._get_token_key(expression_tokens)
+            if expression_key in key_keys:
+                final_expressions.append('k%d' % key_keys.index(expression_key))
+                continue
+
+            function_name = expression_tokens[0].text.lower() if expression_tokens[0].token_type == SqlToken.WORD else None
+            if function_name not in StreamingAggregationExecutor.SUPPORTED_AGGREGATES or len(expression_tokens) < 3 or \
+                    not expression_tokens[1].is_operator('(') or not expression_tokens[-1].is_operator(')'):
+                return None
+            argument_tokens = expression_tokens[2:-1]
+            if len(argument_tokens) == 0 or contains_aggregate(argument_tokens) or \
+                    len(SimpleSelectQuery.split_top_level(argument_tokens, ',')) != 1:
+                return None
+            if argument_tokens[0].is_operator('*') and (function_name != 'count' or len(argument_tokens) != 1):
+                return None
+            if function_name in StreamingAggregationExecutor.SUMMING_AGGREGATES and not SQLITE_SUMS_CAN_BE_CONTINUED:
+                return None
+            argument_sql = '1' if argument_tokens[0].is_operator('*') else template_sql[argument_tokens[0].start:argument_tokens[-1].end]
+
+            partials, final_template = StreamingAggregationExecutor.SUPPORTED_AGGREGATES[function_name]
+            state_names = []
+            for value_template, continuing_aggregate_template in partials:
+                state_names.append('p%d' % len(partial_aggregates))
+                partial_aggregates.append((value_template.format(arg=argument_sql), continuing_aggregate_template))
+            final_expressions.append(final_template.format(*state_names))
+            has_aggregates = True
+
+        if not has_aggregates:
+            return None
+
+        from_and_where_end = clauses['where'][-1].end if 'where' in clauses else clauses['from'][-1].end
+        from_and_where_sql = template_sql[simple_select_query.clause_start_offsets['from']:from_and_where_end]
+        limit_sql = ''
+        if 'limit' in clauses:
+            limit_end = clauses['offset'][-1].end if 'offset' in clauses else clauses['limit'][-1].end
+            limit_sql = template_sql[simple_select_query.clause_start_offsets['limit']:limit_end]
+
+        key_expressions = [template_sql[key_tokens[0].start:key_tokens[-1].end] for key_tokens in key_token_lists]
+        # Without a trailing semicolon, so the query can be wrapped
+        template_sql = template_sql[:list(clauses.values())[-1][-1].end]
+        return StreamingAggregationExecutor(template_sql, qtable_placeholder, key_expressions, partial_aggregates,
+                                            final_expressions, from_and_where_sql, limit_sql, max_in_memory_groups)
+
+    def is_done(self):
+        return False
+
+    def _get_key_column_names(self):
+        return ['k%d' % i for i in range(len(self.key_expressions))]
+
+    def _get_state_column_names(self):
+        return self._get_key_column_names() + ['p%d' % i for i in range(len(self.partial_aggregates))]
+
+    def _get_qualified_state_table_name(self, state_table_name):
+        if self.spill_filename is not None:
+            return '%s.%s' % (self.STATE_DB_ID, state_table_name)
+        return state_table_name
+
+    def _create_state_table(self):
+        state_table_name = 'q_aggregation_state_%s' % self.state_table_index
+        self.state_table_index += 1
+        self.sqlite_db.execute_and_fetch('CREATE TABLE %s (%s)' % (self._get_qualified_state_table_name(state_table_name), ",".join(self._get_state_column_names())))
+        if len(self.key_expressions) > 0:
+            # The states of the groups of each batch are looked up by their keys
+            self.sqlite_db.execute_and_fetch('CREATE INDEX %s ON %s (%s)' % (self._get_qualified_state_table_name(state_table_name + '_keys'), state_table_name,
+                                                                            ",".join(self._get_key_column_names())))
+        return state_table_name
+
+    def _start(self, sqlite_db, table_name):
+        self.sqlite_db = sqlite_db
+        sqlite_db.conn.create_aggregate('q_stddev_continued_state', 2, StdevContinuedState)
+        sqlite_db.conn.create_function('q_stddev_population_of_state', 1, stdev_population_of_state)
+        sqlite_db.conn.create_function('q_stddev_sample_of_state', 1, stdev_sample_of_state)
+
+        # The output column names are the ones of the original query
+        original_sql = self.template_sql.replace(self.qtable_placeholder, table_name)
+        self.column_names = sqlite_db.execute_and_fetch('SELECT * FROM (%s) LIMIT 0' % original_sql).query_column_names
+
+        self.state_table_name = self._create_state_table()
+        if len(self.key_expressions) > 0:
+            sqlite_db.execute_and_fetch('CREATE TABLE %s (%s)' % (self.BATCH_GROUPS_TABLE_NAME, ",".join(self._get_key_column_names())))
+        sqlite_db.execute_and_fetch('CREATE TABLE %s (%s)' % (self.CONTINUED_STATES_TABLE_NAME, ",".join(self._get_state_column_names())))
+        self.started = True
+
+    def _get_group_by_sql(self):
+        if len(self.key_expressions) == 0:
+            return ''
+        return ' GROUP BY %s' % ",".join(['k%d' % i for i in range(len(self.key_expressions))])
+
+    def process_batch(self, sqlite_db, table_name):
+        if not self.started:
+            self._start(sqlite_db, table_name)
+
+        key_column_names = self._get_key_column_names()
+        state_table_name = self._get_qualified_state_table_name(self.state_table_name)
+        from_and_where_sql = self.from_and_where_sql.replace(self.qtable_placeholder, table_name)
+        if len(key_column_names) > 0:
+            sqlite_db.execute_and_fetch('INSERT INTO %s SELECT DISTINCT %s %s' % (self.BATCH_GROUPS_TABLE_NAME, ",".join(self.key_expressions), from_and_where_sql))
+            previous_states_sql = '%s g JOIN %s s ON %s' % (self.BATCH_GROUPS_TABLE_NAME, state_table_name,
+                                                           " AND ".join(['s.%s IS g.%s' % (k, k) for k in key_column_names]))
+        else:
+            previous_states_sql = '%s s' % state_table_name
+
+        # The previous state of each group comes before the rows of the batch, and the rows of each group are aggregated
+        # in their order
+        previous_state_select_list = ['s.%s' % k for k in key_column_names] + \
+                                     ['s.p%d AS s%d,NULL AS v%d' % (i, i, i) for i in range(len(self.partial_aggregates))]
+        batch_select_list = ['%s AS k%d' % (e, i) for i, e in enumerate(self.key_expressions)] + \
+                            ['NULL AS s%d,%s AS v%d' % (i, v, i) for i, (v, _) in enumerate(self.partial_aggregates)]
+        continued_state_select_list = key_column_names + ['%s AS p%d' % (t.format(seed='s%d' % i, value='v%d' % i), i)
+                                                          for i, (_, t) in enumerate(self.partial_aggregates)]
+        continued_state_count = sqlite_db.execute_and_get_row_count('INSERT INTO %s SELECT %s FROM (SELECT %s FROM %s UNION ALL SELECT %s %s)%s' % (
+            self.CONTINUED_STATES_TABLE_NAME, ",".join(continued_state_select_list), ",".join(previous_state_select_list), previous_states_sql,
+            ",".join(batch_select_list), from_and_where_sql, self._get_group_by_sql()))
+
+        previous_state_count = sqlite_db.execute_and_get_row_count('DELETE FROM %s WHERE rowid IN (SELECT s.rowid FROM %s)' % (state_table_name, previous_states_sql))
+        sqlite_db.execute_and_fetch('INSERT INTO %s SELECT * FROM %s' % (state_table_name, self.CONTINUED_STATES_TABLE_NAME))
+        self.group_count += continued_state_count - previous_state_count
+        sqlite_db.execute_and_fetch('DELETE FROM %s' % self.CONTINUED_STATES_TABLE_NAME)
+        if len(key_column_names) > 0:
+            sqlite_db.execute_and_fetch('DELETE FROM %s' % self.BATCH_GROUPS_TABLE_NAME)
+        sqlite_db.execute_and_fetch('DELETE FROM %s' % table_name)
+
+        if self.spill_filename is None and self.group_count > self.max_in_memory_groups:
+            self._move_state_table_to_spill_database()
+
+    def _move_state_table_to_spill_database(self):
+        old_state_table_name = self._get_qualified_state_table_name(self.state_table_name)
+        self._attach_spill_database()
+        new_state_table_name = self._create_state_table()
+        self.sqlite_db.execute_and_fetch('INSERT INTO %s SELECT * FROM %s' % (self._get_qualified_state_table_name(new_state_table_name), old_state_table_name))
+        self.sqlite_db.execute_and_fetch('DROP TABLE %s' % old_state_table_name)
+        self.state_table_name = new_state_table_name
+        xprint("Moved aggregation state to %s. Group count is %s" % (self.spill_filename, self.group_count))
+
+    def _attach_spill_database(self):
+        import tempfile
+        fd, self.spill_filename = tempfile.mkstemp(prefix='q-aggregation-', suffix='.sqlite')
+        os.close(fd)
+        iprint("Aggregation state has too many groups, moving it to %s" % self.spill_filename)
+        self.sqlite_db.execute_and_fetch('ATTACH ? AS %s' % self.STATE_DB_ID, (self.spill_filename,))
+
+    def get_results(self):
+        try:
+            final_sql = 'SELECT %s FROM %s%s %s' % (",".join(self.final_expressions), self._get_qualified_state_table_name(self.state_table_name),
+                                                    self._get_group_by_sql(), self.limit_sql)
+            xprint("Final aggregation query: %s" % final_sql)
+            db_results_obj = self.sqlite_db.execute_and_fetch(final_sql)
+            return Sqlite3DBResults(self.column_names, db_results_obj.results)
+        finally:
+            self.sqlite_db.execute_and_fetch('DROP TABLE %s' % self._get_qualified_state_table_name(self.state_table_name))
+            self.sqlite_db.execute_and_fetch('DROP TABLE %s' % self.CONTINUED_STATES_TABLE_NAME)
+            if len(self.key_expressions) > 0:
+                self.sqlite_db.execute_and_fetch('DROP TABLE %s' % self.BATCH_GROUPS_TABLE_NAME)
+            self.sqlite_db.conn.commit()
+            if self.spill_filename is not None:
+                self.sqlite_db.execute_and_fetch('DETACH DATABASE %s' % self.STATE_DB_ID)
+                os.remove(self.spill_filename)
+
+class TableLoadHints(object):
+    # Information about the way a specific query uses a table, allowing the loader to skip work that cannot affect
+    # the results of the query. Used only when the loaded table is not going to be reused by other queries
+    def __init__(self, required_column_names=None, pushed_down_conditions=None, row_limit=None, count_only=False,
+                 streaming_query_executor=None, top_n=None):
+        # Lower-cased names of columns which might be referenced by the query. None means that all columns are needed
+        self.required_column_names = required_column_names
+        # WHERE conditions which all rows of the query must satisfy (see RowFilter)
+        self.pushed_down_conditions = pushed_down_conditions if pushed_down_conditions is not None else []
+        # Reading can stop after this number of rows matching the pushed down conditions. None means no limit
+        self.row_limit = row_limit
+        # Only the number of rows is needed, so rows are counted instead of being stored
+        self.count_only = count_only
+        # Evaluates the query on batches of rows while they are loaded, instead of storing all rows
+        self.streaming_query_executor = streaming_query_executor
+        # (ordering, row count) for queries which need only the first rows of an ordering (see SimpleSelectQuery.get_top_n)
+        self.top_n = top_n
+
+    def __str__(self):
+        return "TableLoadHints<%s>" % str(self.__dict__)
+    __repr__ = __str__
+
+
 class Sql(object):
+    QTABLE_PLACEHOLDER_PREFIX = '__q_table_reference_'
 
     def __init__(self, sql, data_streams):
         # Currently supports only standard SELECT statements
@@ -874,6 +2021,9 @@ class Sql(object):
 
         self.query_column_names = None
 
+        self.template_tokens = None
+        self.simple_select_query = None
+
         # Go over all sql parts
         idx = 0
         while idx < len(self.sql_parts):
@@ -958,6 +2108,111 @@ class Sql(object):
     def get_qtable_name_effective_table_names(self):
         return self.qtable_name_effective_table_names
 
+    def get_qtable_placeholder(self, qtable_name):
+        return '%s%s__' % (Sql.QTABLE_PLACEHOLDER_PREFIX, list(self.qtable_name_positions.keys()).index(qtable_name))
+
+    def get_template_sql(self):
+        # The query text, with each qtable reference replaced by a placeholder identifier, so it can be tokenized
+        template_sql = [x for x in self.sql_parts]
+        for qtable_name, positions in six.iteritems(self.qtable_name_positions):
+            for pos in positions:
+                template_sql[pos] = self.get_qtable_placeholder(qtable_name)
+        return " ".join(template_sql)
+
+    def get_template_tokens(self):
+        if self.template_tokens is None:
+            self.template_tokens = tokenize_sql(self.get_template_sql())
+        return self.template_tokens
+
+    def get_referenced_column_names(self):
+        # Returns a superset of the names of the columns which are referenced by the query (lower-cased), or None if
+        # the query might use all columns (e.g. when using * or NATURAL JOIN)
+        names = set()
+        prev_token = None
+        for token in self.get_template_tokens():
+            if token.is_word('natural'):
+                return None
+            if token.is_operator('*'):
+                if prev_token is None or prev_token.is_word('select', 'distinct', 'all') or prev_token.is_operator(',', '.'):
+                    return None
+            name = token.get_identifier_name()
+            if name is None and token.token_type == SqlToken.STRING:
+                # sqlite might treat a string literal as an identifier in some contexts, so it's kept for safety
+                name = token.get_string_value()
+            if name is not None and not name.startswith(Sql.QTABLE_PLACEHOLDER_PREFIX):
+                names.add(name.lower())
+            prev_token = token
+        return names
+
+    def get_simple_select_query(self):
+        if self.simple_select_query is None:
+            placeholder_to_qtable_name = dict([(self.get_qtable_placeholder(qtable_name), qtable_name) for qtable_name in self.qtable_name_positions.keys()])
+            self.simple_select_query = SimpleSelectQuery.parse(self.get_template_tokens(), placeholder_to_qtable_name)
+            xprint("Simple select query: %s" % self.simple_select_query)
+        return self.simple_select_query
+
+    def get_count_only_qtable_name(self):
+        # Returns the qtable name of a query which only counts its rows, or None for all other queries
+        simple_select_query = self.get_simple_select_query()
+        if simple_select_query is None or not simple_select_query.is_count_only():
+            return None
+        return simple_select_query.qtable_name
+
+    def create_streaming_query_executor(self, output_writer):
+        # Returns an executor for queries which can be evaluated on batches of rows, or None
+        simple_select_query = self.get_simple_select_query()
+        if simple_select_query is None or not simple_select_query.is_row_wise():
+            return None
+        # Each batch is deleted after it's evaluated, so the rowids of the next batch would start over
+        if simple_select_query.references_rowid():
+            return None
+        template_sql = simple_select_query.get_sql_without_limit(self.get_template_sql())
+        return StreamingQueryExecutor(template_sql, self.get_qtable_placeholder(simple_select_query.qtable_name),
+                                      simple_select_query.get_limit_and_offset(), output_writer)
+
+    def create_streaming_aggregation_executor(self, max_in_memory_groups):
+        # Returns an executor for aggregation queries over a data stream, or None. Data streams can be unbounded, so
+        # only the aggregation state is kept for them instead of all the rows
+        simple_select_query = self.get_simple_select_query()
+        if simple_select_query is None or len(self.qtable_name_positions) != 1 or not self.data_streams.is_data_stream(simple_select_query.qtable_name):
+            return None
+        if simple_select_query.has_clause('limit') and simple_select_query.get_limit_and_offset() is None:
+            return None
+        if simple_select_query.references_rowid():
+            return None
+        return StreamingAggregationExecutor.create(simple_select_query, self.get_template_sql(),
+                                                   self.get_qtable_placeholder(simple_select_query.qtable_name), max_in_memory_groups)
+
+    def create_table_load_hints(self, output_writer=None, max_in_memory_aggregation_groups=DEFAULT_MAX_IN_MEMORY_AGGREGATION_GROUPS):
+        required_column_names = self.get_referenced_column_names()
+        xprint("Column names which are referenced by the query: %s" % required_column_names)
+
+        simple_select_query = self.get_simple_select_query()
+        streaming_query_executor = self.create_streaming_query_executor(output_writer) if output_writer is not None else None
+        if streaming_query_executor is None and simple_select_query is not None and not simple_select_query.is_count_only():
+            streaming_query_executor = self.create_streaming_aggregation_executor(max_in_memory_aggregation_groups)
+        xprint("Streaming query executor: %s" % streaming_query_executor)
+
+        load_hints = OrderedDict()
+        for qtable_name in self.qtable_name_positions.keys():
+            if simple_select_query is not None and simple_select_query.qtable_name == qtable_name:
+                pushed_down_conditions = simple_select_query.get_pushed_down_conditions()
+                row_limit = simple_select_query.get_row_limit()
+                count_only = simple_select_query.is_count_only()
+                top_n = simple_select_query.get_top_n()
+            else:
+                pushed_down_conditions = []
+                row_limit = None
+                count_only = False
+                top_n = None
+            load_hints[qtable_name] = TableLoadHints(required_column_names=required_column_names,
+                                                     pushed_down_conditions=pushed_down_conditions,
+                                                     row_limit=row_limit,
+                                                     count_only=count_only,
+                                                     streaming_query_executor=streaming_query_executor,
+                                                     top_n=top_n)
+        return load_hints
+
     def execute_and_fetch(self, db):
         x = self.get_effective_sql()
         xprint("Final query: %s" % x)
@@ -979,12 +2234,23 @@ class Sql(object):
             xprint("Materialized filename %s to effective table name %s" % (qtable_name,effective_table_name))
 
 
+INT_VALUE_PATTERN = re.compile(r'\s*[+-]?[0-9]+\s*\Z')
+FLOAT_VALUE_PATTERN = re.compile(r'\s*[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?\s*\Z')
+DEFAULT_TYPE_INFERENCE_ROWS = 100
+# Makes the type inference sample of a file the same in each run
+TYPE_INFERENCE_SAMPLE_SEED = 0
+
 class TableColumnInferer(object):
 
     def __init__(self, input_params):
         self.inferred = False
         self.mode = input_params.parsing_mode
         self.rows = []
+        # Types are inferred from the first rows of the data, along with a uniform sample of all its rows if needed
+        # (see TableCreator._sample_rows_for_type_inference)
+        self.type_inference_rows = input_params.type_inference_rows
+        self.type_inference_sample_rows = input_params.type_inference_sample_rows
+        self.sampled_rows = []
         self.skip_header = input_params.skip_header
         self.header_row = None
         self.header_row_filename = None
@@ -993,7 +2259,7 @@ class TableColumnInferer(object):
         self.disable_column_type_detection = input_params.disable_column_type_detection
 
     def _generate_content_signature(self):
-        return OrderedDict({
+        m = OrderedDict({
             "inferred": self.inferred,
             "mode": self.mode,
             "rows": "\n".join([",".join(x) for x in self.rows]),
@@ -1003,6 +2269,12 @@ class TableColumnInferer(object):
             "input_delimiter": self.input_delimiter,
             "disable_column_type_detection": self.disable_column_type_detection
         })
+        # Added only when not using the defaults, so existing caches remain valid
+        if self.type_inference_rows != DEFAULT_TYPE_INFERENCE_ROWS:
+            m["type_inference_rows"] = self.type_inference_rows
+        if self.type_inference_sample_rows > 0:
+            m["type_inference_sample_rows"] = self.type_inference_sample_rows
+        return m
 
     def analyze(self, filename, col_vals):
         if self.inferred:
@@ -1014,7 +2286,7 @@ class TableColumnInferer(object):
         else:
             self.rows.append(col_vals)
 
-        if len(self.rows) < 100:
+        if len(self.rows) < self.type_inference_rows:
             return False
 
         self.do_analysis()
@@ -1053,24 +2325,35 @@ class TableColumnInferer(object):
         return str
 
     def determine_type_of_value_list(self, value_list):
-        type_list = [self.determine_type_of_value(v) for v in value_list]
-        all_types = set(type_list)
-        if len(set(type_list)) == 1:
-            # all the sample lines are of the same type
-            return type_list[0]
-        else:
-            # check for the number of types without nulls,
-            type_list_without_nulls = list(filter(
-                lambda x: x is not None, type_list))
-            # If all the sample lines are of the same type,
-            if len(set(type_list_without_nulls)) == 1:
-                # return it
-                return type_list_without_nulls[0]
-            else:
-                # If there are only two types, one float an one int, then choose a float type
-                if len(set(type_list_without_nulls)) == 2 and float in type_list_without_nulls and int in type_list_without_nulls:
-                    return float
+        # Classifies all the values at once. The common integer and float formats are matched in bulk using
+        # precompiled patterns, and only the remaining values are converted one by one (see determine_type_of_value)
+        if self.disable_column_type_detection or len(value_list) == 0:
+            return str
+
+        values = [v for v in value_list if v is not None]
+        types = set()
+        non_int_values = list(filterfalse(INT_VALUE_PATTERN.match, values))
+        if len(non_int_values) < len(values):
+            types.add(int)
+        other_values = list(filterfalse(FLOAT_VALUE_PATTERN.match, non_int_values))
+        if len(other_values) < len(non_int_values):
+            types.add(float)
+        for v in other_values:
+            value_type = self.determine_type_of_value(v)
+            if value_type == str:
                 return str
+            if value_type is not None:
+                types.add(value_type)
+
+        if len(types) == 0:
+            # Only nulls
+            return None
+        if len(types) == 1:
+            return types.pop()
+        # If there are only two types, one float an one int, then choose a float type
+        if types == set([int, float]):
+            return float
+        return str
 
     def do_analysis(self):
         if self.mode == 'strict':
@@ -1199,22 +2482,21 @@ class TableColumnInferer(object):
 
         self.infer_column_types()
 
+    def _get_column_value_lists(self, rows):
+        # Missing values of short rows are None
+        columns = list(zip_longest(*rows))
+        return [columns[column_number] if column_number < len(columns) else [None] * len(rows) for column_number in range(self.column_count)]
+
     def infer_column_types(self):
         assert self.column_count > -1
-        self.column_types = []
-        self.column_types2 = []
-        for column_number in range(self.column_count):
-            column_value_list = [
-                row[column_number] if column_number < len(row) else None for row in self.rows]
-            column_type = self.determine_type_of_value_list(column_value_list)
-            self.column_types.append(column_type)
-
-            column_value_list2 = [row[column_number] if column_number < len(
-                row) else None for row in self.rows[1:]]
-            column_type2 = self.determine_type_of_value_list(
-                column_value_list2)
-            self.column_types2.append(column_type2)
+        self.column_types = [self.determine_type_of_value_list(column_value_list)
+                             for column_value_list in self._get_column_value_lists(self.rows + self.sampled_rows)]
+        if self.skip_header:
+            return
 
+        # Types which change when skipping the first row indicate a header row
+        self.column_types2 = [self.determine_type_of_value_list(column_value_list)
+                              for column_value_list in self._get_column_value_lists(self.rows[1:])]
         comparison = map(
             lambda x: x[0] == x[1], zip(self.column_types, self.column_types2))
         if False in comparison and not self.skip_header:
@@ -1235,18 +2517,84 @@ class TableColumnInferer(object):
         return self.column_types
 
 
-def py3_encoded_csv_reader(encoding, f, dialect,row_data_only=False,**kwargs):
+# Lines are split in batches, so that checking whether they can be split is done by string methods over the whole batch
+SPLIT_TOKENIZER_BATCH_LINE_COUNT = 1000
+# csv.reader is faster than splitting for records with fewer columns
+SPLIT_TOKENIZER_MIN_COLUMN_COUNT = 20
+
+def generate_split_tokenized_records(lines, dialect_params, batch_line_count=SPLIT_TOKENIZER_BATCH_LINE_COUNT,
+                                     min_column_count=SPLIT_TOKENIZER_MIN_COLUMN_COUNT):
+    # Tokenizes lines exactly like csv.reader does with the given dialect, by splitting them by the delimiter. Lines can
+    # be split as long as they have no characters which need csv.reader's state machine (quote characters when quoting
+    # is used, escape characters, carriage returns and NULs) and they are not longer than the field size limit. From the
+    # first batch of lines which cannot be split, csv.reader tokenizes the rest of the lines, since a record might span
+    # multiple lines. When the first batch cannot be split, or when it has narrow records, csv.reader is used for all lines
+    lines = iter(lines)
+    delimiter = dialect_params['delimiter']
+    special_chars = ['\r', '\0']
+    if dialect_params['quoting'] != csv.QUOTE_NONE:
+        special_chars.append(dialect_params['quotechar'])
+    if dialect_params['escapechar'] is not None:
+        special_chars.append(dialect_params['escapechar'])
+    skip_initial_space = dialect_params['skipinitialspace']
+    # With skipinitialspace, spaces at the beginning of fields are not part of the values
+    skipped_spaces_delimiter_regex = re.compile(re.escape(delimiter) + ' *')
+    field_size_limit = csv.field_size_limit()
+
+    def split_line(line):
+        if line.endswith('\n'):
+            line = line[:-1]
+        if line == '':
+            return []
+        if skip_initial_space:
+            return skipped_spaces_delimiter_regex.split(line.lstrip(' '))
+        return line.split(delimiter)
+
+    def can_split_batch(batch):
+        # Returns whether the lines of the batch can be split, and whether they need split_line() for that. The records
+        # are created one line at a time, since keeping the records of the whole batch makes garbage collection slower
+        block = ''.join(batch)
+        if any(c in block for c in special_chars):
+            return False, None
+        if len(block) > field_size_limit and max(map(len, batch)) > field_size_limit:
+            return False, None
+        is_simple_block = block.endswith('\n') and '\n\n' not in block and not block.startswith('\n')
+        if skip_initial_space:
+            is_simple_block = is_simple_block and delimiter + ' ' not in block and '\n ' not in block and not block.startswith(' ')
+        return True, not is_simple_block
+
+    batch = list(itertools.islice(lines, batch_line_count))
+    can_split, needs_split_line = can_split_batch(batch)
+    if not can_split or (len(batch) > 0 and len(split_line(batch[0])) < min_column_count):
+        xprint("Tokenizing lines using csv.reader")
+        return csv.reader(itertools.chain(batch, lines), **dialect_params)
+    xprint("Tokenizing lines by splitting them by the delimiter")
+
+    def generate_records(batch, needs_split_line):
+        while len(batch) > 0:
+            if needs_split_line:
+                for line in batch:
+                    yield split_line(line)
+            else:
+                for line in batch:
+                    yield line[:-1].split(delimiter)
+            batch = list(itertools.islice(lines, batch_line_count))
+            can_split, needs_split_line = can_split_batch(batch)
+            if not can_split:
+                xprint("Tokenizing the rest of the lines using csv.reader")
+                for col_vals in csv.reader(itertools.chain(batch, lines), **dialect_params):
+                    yield col_vals
+                return
+    return generate_records(batch, needs_split_line)
+
+def py3_encoded_csv_reader(encoding, f, dialect,**kwargs):
     try:
         xprint("f is %s" % str(f))
         xprint("dialect is %s" % dialect)
-        csv_reader = csv.reader(f, dialect, **kwargs)
+        csv_reader = generate_split_tokenized_records(f, dict(get_dialect_params(dialect), **kwargs))
 
-        if row_data_only:
-            for row in csv_reader:
-                yield row
-        else:
-            for row in csv_reader:
-                yield (f.filename(),f.isfirstline(),row)
+        for row in csv_reader:
+            yield row
 
     except UnicodeDecodeError as e1:
         raise CouldNotParseInputException(e1)
@@ -1290,8 +2638,11 @@ class TableSourceType(object):
     DATA_STREAM = 'data-stream'
 
 def skip_BOM(f):
+    validate_BOM(lambda: f.buffer.read(3))
+
+def validate_BOM(read_BOM):
     try:
-        BOM = f.buffer.read(3)
+        BOM = read_BOM()
 
         if BOM != six.b('\xef\xbb\xbf'):
             # TODO Add test for this (propagates to try:except)
@@ -1300,7 +2651,291 @@ def skip_BOM(f):
         # TODO Add a test for this
         raise Exception('Tried to skip BOM for "utf-8-sig" encoding and failed. Error message is ' + str(e))
 
-def detect_qtable_name_source_info(qtable_name,data_streams,read_caching_enabled):
+MMAP_DECODING_BLOCK_SIZE = 4 * 1024 * 1024
+
+COMPRESSION_SIGNATURE_LENGTH = 10
+BZ2_SIGNATURE_REGEX = re.compile(six.b('^BZh[1-9](\x31\x41\x59\x26\x53\x59|\x17\x72\x45\x38\x50\x90)'))
+
+def detect_compression(header):
+    # Returns the compression format of data starting with the header bytes, or None for uncompressed data. bz2 data
+    # is recognized only by its full block signature, since its magic bytes are plain text
+    if header.startswith(six.b('\x1f\x8b')):
+        return 'gzip'
+    if header.startswith(six.b('\xfd7zXZ\x00')):
+        return 'xz'
+    if header.startswith(six.b('\x28\xb5\x2f\xfd')):
+        return 'zstd'
+    if BZ2_SIGNATURE_REGEX.match(header) is not None:
+        return 'bz2'
+    return None
+
+def get_file_compression(filename, input_params):
+    if os.path.isfile(filename):
+        with open(filename, 'rb') as f:
+            compression = detect_compression(f.read(COMPRESSION_SIGNATURE_LENGTH))
+        if compression is not None:
+            return compression
+    if input_params.gzipped_input or filename.endswith('.gz'):
+        return 'gzip'
+    return None
+
+def open_decompressing_stream(compression, f):
+    # Returns a binary stream of the decompressed data of f, which is either a filename or a binary stream. Closing it
+    # closes the file when a filename is provided, but never closes a provided stream
+    if compression == 'gzip':
+        import gzip
+        if isinstance(f, six.string_types):
+            return gzip.GzipFile(filename=f, mode='rb')
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if compression == 'bz2':
+        import bz2
+        return bz2.BZ2File(f, mode='rb')
+    if compression == 'xz':
+        import lzma
+        return lzma.LZMAFile(f, mode='rb')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise CannotDecompressInputException("Reading zstd compressed data requires the zstandard python module. Install it using 'pip install zstandard'")
+        if isinstance(f, six.string_types):
+            return zstandard.ZstdDecompressor().stream_reader(io.open(f, 'rb'), read_across_frames=True, closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(f, read_across_frames=True, closefd=False)
+    raise CannotDecompressInputException("Unknown compression format %s" % compression)
+
+def get_peekable_binary_stream(f):
+    # Returns the buffered binary stream underlying a text stream (e.g. sys.stdin), or None. Peeking into it does not
+    # consume any data from the text stream
+    for binary_f in [f, getattr(f, 'buffer', None), getattr(f, 'stream', None)]:
+        if binary_f is not None and hasattr(binary_f, 'peek') and 'b' in getattr(binary_f, 'mode', 'b'):
+            return binary_f
+    return None
+
+def get_files_size_hash(atomic_fns):
+    return ",".join(map(str,[os.stat(atomic_fn).st_size for atomic_fn in atomic_fns]))
+
+def get_files_last_modification_time_hash(atomic_fns):
+    x = ",".join(map(lambda x: ':%s:' % x,[os.stat(x).st_mtime_ns for x in atomic_fns]))
+    res = hashlib.sha1(six.b(x)).hexdigest() + '///' + x
+    xprint("Hash of last modification time is %s" % res)
+    return res
+
+def get_file_stat_signature(filename):
+    st = os.stat(filename)
+    return OrderedDict([('size', st.st_size), ('mtime_ns', st.st_mtime_ns), ('inode', st.st_ino)])
+
+def get_file_stat_signature_if_unchanged(filename, content_signature):
+    # Returns the stat signature of the file if the file has not changed since the content signature has been calculated,
+    # or None otherwise
+    file_stat_signature = get_file_stat_signature(filename)
+    if str(file_stat_signature['size']) != content_signature['original_file_size'] or \
+            get_files_last_modification_time_hash([filename]) != content_signature['last_modification_time']:
+        xprint("File %s has changed since its content signature has been calculated" % filename)
+        return None
+    return file_stat_signature
+
+def get_reading_options_content_signature(input_params):
+    # The part of the content signature of a delimited file table which depends only on the reading options
+    m = OrderedDict({
+        "_signature_version": "v1",
+        "skip_header": input_params.skip_header,
+        "gzipped": input_params.gzipped_input,
+        "with_universal_newlines": input_params.with_universal_newlines,
+        "encoding": input_params.input_encoding,
+        "mode": input_params.parsing_mode,
+        "expected_column_count": input_params.expected_column_count,
+        "input_delimiter": input_params.delimiter
+    })
+    # Range reads are different tables than the whole file
+    if input_params.byte_range is not None:
+        m["byte_range"] = list(input_params.byte_range)
+    if input_params.record_range is not None:
+        m["record_range"] = list(input_params.record_range)
+    return m
+
+def is_mmap_readable_file(filename, input_params):
+    if input_params.with_universal_newlines or get_file_compression(filename, input_params) is not None:
+        return False
+    return os.path.isfile(filename)
+
+def is_parallel_decompressible_file(filename, input_params):
+    if input_params.parallel_load <= 1 or not os.path.isfile(filename):
+        return False
+    return get_file_compression(filename, input_params) == 'gzip'
+
+def generate_mmap_file_lines(filename, encoding, block_size=MMAP_DECODING_BLOCK_SIZE, regions=None):
+    # Generates the lines of an uncompressed file exactly like a text-mode file opened with newline=None would, by
+    # decoding large blocks of a memory mapped file. When (start offset, end offset) regions are provided, only they
+    # are read, one after the other. Regions have to start and end at line boundaries
+    with io.open(filename, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if regions is None:
+            regions = [(0, size)]
+        if encoding == 'utf-8-sig' and regions[0][0] == 0:
+            f_BOM = f.read(3)
+            validate_BOM(lambda: f_BOM)
+            regions = [(3, regions[0][1])] + regions[1:]
+        regions = [(start_offset, min(end_offset, size)) for start_offset, end_offset in regions if start_offset < min(end_offset, size)]
+        if len(regions) == 0:
+            return
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        if hasattr(m, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            m.madvise(mmap.MADV_SEQUENTIAL)
+        blocks = (m[offset:min(offset + block_size, end_offset)]
+                  for start_offset, end_offset in regions for offset in range(start_offset, end_offset, block_size))
+        for line in generate_decoded_lines(blocks, encoding):
+            yield line
+    finally:
+        m.close()
+
+def generate_decoded_lines(blocks, encoding):
+    # Generates the lines of a sequence of byte blocks exactly like a text-mode file opened with newline=None would
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+    partial_line = ''
+    for block in blocks:
+        lines = (partial_line + decoder.decode(block)).split('\n')
+        partial_line = lines.pop()
+        for line in lines:
+            yield line + '\n'
+    lines = (partial_line + decoder.decode(six.b(''), final=True)).split('\n')
+    partial_line = lines.pop()
+    for line in lines:
+        yield line + '\n'
+    if partial_line != '':
+        yield partial_line
+
+READ_AHEAD_BLOCK_SIZE = 1024 * 1024
+
+class PipelineStats(object):
+    # The time (in seconds) in which each stage of a pipelined load has been stalled, waiting for another stage
+    def __init__(self):
+        self.reader_waiting_for_parser = 0.0
+        self.parser_waiting_for_reader = 0.0
+        self.parser_waiting_for_inserter = 0.0
+        self.inserter_waiting_for_parser = 0.0
+        self.read_block_count = 0
+        self.insert_batch_count = 0
+
+    def get_summary(self):
+        return "read-ahead thread waited %.3fs for the parser (%s blocks), parser waited %.3fs for data and %.3fs for inserts, " \
+               "insert thread waited %.3fs for the parser (%s batches)" % (
+            self.reader_waiting_for_parser, self.read_block_count, self.parser_waiting_for_reader, self.parser_waiting_for_inserter,
+            self.inserter_waiting_for_parser, self.insert_batch_count)
+
+    def __str__(self):
+        return "PipelineStats<%s>" % self.get_summary()
+    __repr__ = __str__
+
+class ReadAheadBlockReader(object):
+    # Reads (and decompresses) blocks of a binary file on a separate thread, ahead of the parser. zlib and file
+    # reads release the GIL, so reading overlaps with parsing
+    def __init__(self, f, queue_depth, pipeline_stats, block_size=READ_AHEAD_BLOCK_SIZE):
+        self.f = f
+        self.block_size = block_size
+        self.pipeline_stats = pipeline_stats
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._read_blocks, name='q-read-ahead')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _read_blocks(self):
+        try:
+            while not self.stopped.is_set():
+                block = self.f.read(self.block_size)
+                self._put(block)
+                if len(block) == 0:
+                    return
+                self.pipeline_stats.read_block_count += 1
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return
+        except queue.Full:
+            pass
+        t0 = time.time()
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.pipeline_stats.reader_waiting_for_parser += time.time() - t0
+
+    def generate_blocks(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                t0 = time.time()
+                item = self.queue.get()
+                self.pipeline_stats.parser_waiting_for_reader += time.time() - t0
+            if isinstance(item, Exception):
+                raise item
+            if len(item) == 0:
+                return
+            yield item
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.f.close()
+
+class BackgroundInserter(object):
+    # Runs the inserts of a table on a separate thread, so parsing continues while sqlite inserts the previous
+    # batches (sqlite releases the GIL while executing). Batches are inserted in their original order
+    def __init__(self, sqlite_db, queue_depth, pipeline_stats):
+        self.sqlite_db = sqlite_db
+        self.pipeline_stats = pipeline_stats
+        self.queue = queue.Queue(maxsize=queue_depth)
+        self.error = None
+        self.thread = threading.Thread(target=self._insert_batches, name='q-inserter')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _insert_batches(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                t0 = time.time()
+                item = self.queue.get()
+                self.pipeline_stats.inserter_waiting_for_parser += time.time() - t0
+            if item is None:
+                return
+            if self.error is None:
+                try:
+                    insert_row_stmt, rows = item
+                    self.sqlite_db.update_many(insert_row_stmt, rows)
+                    self.pipeline_stats.insert_batch_count += 1
+                except Exception as e:
+                    self.error = e
+
+    def _put(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            t0 = time.time()
+            self.queue.put(item)
+            self.pipeline_stats.parser_waiting_for_inserter += time.time() - t0
+
+    def insert(self, insert_row_stmt, rows):
+        if self.error is not None:
+            raise self.error
+        self._put((insert_row_stmt, rows))
+
+    def finish(self):
+        # Waits for all the batches to be inserted
+        self._put(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+def detect_qtable_name_source_info(qtable_name,data_streams,read_caching_enabled,cache_filename_suffix='',cache_dir=None):
     data_stream = data_streams.get_for_filename(qtable_name)
     xprint("Found data stream %s" % data_stream)
 
@@ -1322,7 +2957,10 @@ def detect_qtable_name_source_info(qtable_name,data_streams,read_caching_enabled
             return MaterializedStateType.QSQL_FILE, TableSourceType.QSQL_FILE, (qtable_name, None)
         if is_sqlite_file(qtable_name):
             return MaterializedStateType.SQLITE_FILE, TableSourceType.SQLITE_FILE, (qtable_name, None)
-        matching_qsql_file_candidate = qtable_name + '.qsql'
+        if cache_dir is not None:
+            # Caches are looked up in the cache directory after analyzing the file (see MaterializedDelimitedFileState)
+            return MaterializedStateType.DELIMITED_FILE, TableSourceType.DELIMITED_FILE, (qtable_name, None)
+        matching_qsql_file_candidate = qtable_name + cache_filename_suffix + '.qsql'
 
         table_source_type = TableSourceType.DELIMITED_FILE
         if is_qsql_file(matching_qsql_file_candidate):
@@ -1372,7 +3010,7 @@ def normalize_filename_to_table_name(filename):
         filename = filename[:-8]
     return filename.replace("-","_dash_").replace(".","_dot_").replace('?','_qm_').replace("/","_slash_").replace("\\","_backslash_").replace(":","_colon_").replace(" ","_space_").replace("+","_plus_")
 
-def validate_content_signature(original_filename, source_signature,other_filename, content_signature,scope=None,dump=False):
+def validate_content_signature(original_filename, source_signature,other_filename, content_signature,scope=None,dump=False,ignored_keys=()):
     if dump:
         xprint("Comparing: source value: %s target value: %s" % (source_signature,content_signature))
 
@@ -1380,6 +3018,8 @@ def validate_content_signature(original_filename, source_signature,other_filenam
     if scope is None:
         scope = []
     for k in source_signature:
+        if k in ignored_keys:
+            continue
         if type(source_signature[k]) == OrderedDict:
             validate_content_signature(original_filename, source_signature[k],other_filename, content_signature[k],scope + [k])
         else:
@@ -1391,6 +3031,249 @@ def validate_content_signature(original_filename, source_signature,other_filenam
                 else:
                     raise ContentSignatureDiffersException(original_filename, other_filename, original_filename,".".join(scope + [k]),source_signature[k],content_signature[k])
 
+APPEND_CHECK_BLOCK_SIZE = 64 * 1024
+
+class CoveredFilePrefix(object):
+    # The part of a delimited file which has been loaded into its cache - Its size, the number of data records in it and
+    # a hash of its content (see calculate_file_prefix_hash). When the file has only been appended to since, just the
+    # rest of it is loaded into the cache (see MaterializedQsqlState._load_appended_rows_if_needed)
+    def __init__(self, size, record_count, prefix_hash):
+        self.size = size
+        self.record_count = record_count
+        self.prefix_hash = prefix_hash
+
+    def __str__(self):
+        return "CoveredFilePrefix<size=%s,record_count=%s,prefix_hash=%s>" % (self.size, self.record_count, self.prefix_hash)
+    __repr__ = __str__
+
+CONTENT_FINGERPRINT_CHUNK_SIZE = 4 * 1024 * 1024
+CONTENT_FINGERPRINT_MAX_WORKERS = 8
+
+def calculate_chunk_hashes(filename, size, chunk_size, first_chunk_number=0):
+    # Hashes the fixed-size chunks of the first size bytes of the file (the last chunk might be shorter), starting at the
+    # given chunk. Chunks are hashed by multiple threads, since hashlib releases the GIL while hashing large buffers
+    import concurrent.futures
+    chunk_offsets = list(range(first_chunk_number * chunk_size, size, chunk_size))
+
+    def hash_chunk(offset):
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            return hashlib.sha1(f.read(min(chunk_size, size - offset))).hexdigest()
+
+    worker_count = min(os.cpu_count() or 1, CONTENT_FINGERPRINT_MAX_WORKERS, len(chunk_offsets))
+    if worker_count <= 1:
+        return [hash_chunk(offset) for offset in chunk_offsets]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=worker_count) as executor:
+        return list(executor.map(hash_chunk, chunk_offsets))
+
+def calculate_file_prefix_hash(filename, size):
+    # Hashes the whole prefix along with its size. The chunk hashes of the prefix are combined, so a large prefix is
+    # hashed by multiple threads
+    h = hashlib.sha1(six.b('%s:' % size))
+    for chunk_hash in calculate_chunk_hashes(filename, size, CONTENT_FINGERPRINT_CHUNK_SIZE):
+        h.update(six.b(chunk_hash))
+    return h.hexdigest()
+
+class ContentFingerprint(object):
+    # The hashes of the chunks of a file when it has been cached (see calculate_chunk_hashes). A file with the same
+    # fingerprint has the same content regardless of its modification time, and a larger file which starts with the same
+    # chunks has only been appended to
+    def __init__(self, size, chunk_size, chunk_hashes):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.chunk_hashes = chunk_hashes
+
+    @staticmethod
+    def calculate(filename, size, chunk_size=CONTENT_FINGERPRINT_CHUNK_SIZE):
+        return ContentFingerprint(size, chunk_size, calculate_chunk_hashes(filename, size, chunk_size))
+
+    def is_prefix_of(self, filename):
+        # Returns whether the file starts with the content this fingerprint has been calculated for
+        if os.stat(filename).st_size < self.size:
+            return False
+        return calculate_chunk_hashes(filename, self.size, self.chunk_size) == self.chunk_hashes
+
+    def extended_to(self, filename, size):
+        # Returns the fingerprint of the file after it has been appended to. Only the last partial chunk and the new
+        # chunks are hashed
+        full_chunk_count = self.size // self.chunk_size
+        return ContentFingerprint(size, self.chunk_size,
+                                  self.chunk_hashes[:full_chunk_count] + calculate_chunk_hashes(filename, size, self.chunk_size, full_chunk_count))
+
+    def to_dict(self):
+        return OrderedDict([('size', self.size), ('chunk_size', self.chunk_size), ('chunk_hashes', self.chunk_hashes)])
+
+    @staticmethod
+    def from_dict(d):
+        return ContentFingerprint(d['size'], d['chunk_size'], d['chunk_hashes'])
+
+    def __str__(self):
+        return "ContentFingerprint<size=%s,chunk_size=%s,chunk_count=%s>" % (self.size, self.chunk_size, len(self.chunk_hashes))
+    __repr__ = __str__
+
+def get_appended_rows_loading_ineligibility_reason(filename, input_params):
+    # Appended rows can be added to an existing cache only when the records of the file can be located by byte offsets,
+    # and when the column types depend only on the beginning of the file
+    if not is_byte_scannable_file(filename, input_params):
+        return 'file is compressed or its encoding is not byte scannable'
+    if input_params.with_universal_newlines:
+        return 'universal newlines are used'
+    if is_range_read(input_params):
+        return 'a range of the file is read'
+    if input_params.type_inference_sample_rows > 0:
+        return 'column types are inferred from a sample of the whole file'
+    return None
+
+def find_last_line_end(filename, start_offset, end_offset):
+    # Returns the offset after the last newline between the offsets, or start_offset if there is none
+    with open(filename, 'rb') as f:
+        offset = end_offset
+        while offset > start_offset:
+            block_start = max(start_offset, offset - APPEND_CHECK_BLOCK_SIZE)
+            f.seek(block_start)
+            newline_index = f.read(offset - block_start).rfind(six.b('\n'))
+            if newline_index >= 0:
+                return block_start + newline_index + 1
+            offset = block_start
+    return start_offset
+
+def parse_cache_size(s):
+    # A cache size is a byte count, optionally with a K/M/G/T suffix (e.g. 500M). Raises ValueError otherwise
+    m = re.match(r'^([0-9]+)([KMGT]?)B?$', s.strip().upper())
+    if m is None:
+        raise ValueError('Cache size must be a byte count, optionally with a K/M/G/T suffix')
+    return int(m.group(1)) * (1024 ** ' KMGT'.index(m.group(2) or ' '))
+
+class CacheDirectoryEntry(object):
+    def __init__(self, content_signature_key, filename, size, last_access_time):
+        self.content_signature_key = content_signature_key
+        self.filename = filename
+        self.size = size
+        self.last_access_time = last_access_time
+
+    def __str__(self):
+        return "CacheDirectoryEntry<key=%s,size=%s,last_access_time=%s>" % (self.content_signature_key, self.size, self.last_access_time)
+    __repr__ = __str__
+
+class CacheDirectory(object):
+    # A directory of caches of delimited files, named after the content signature keys of the tables, instead of cache
+    # files next to the source files. The modification time of a cache file is its last access time, and the least
+    # recently used caches are evicted when the total size of the caches exceeds max_size (None means no limit)
+    def __init__(self, path, max_size=None):
+        self.path = os.path.abspath(path)
+        self.max_size = max_size
+
+    def get_cache_filename(self, content_signature_key):
+        return os.path.join(self.path, '%s.qsql' % content_signature_key)
+
+    def find(self, content_signature_key):
+        # Returns the filename of the cache of the given key (marking it as accessed), or None if there is none
+        filename = self.get_cache_filename(content_signature_key)
+        if not is_qsql_file(filename):
+            return None
+        try:
+            os.utime(filename, None)
+        except OSError as e:
+            xprint("Could not update the last access time of cache %s: %s" % (filename, e))
+        return filename
+
+    def store(self, source_sqlite_db, content_signature_key):
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        # Written to a temporary file first, so concurrent readers never see a partial cache
+        temp_filename = os.path.join(self.path, '.%s.%s.qsql.tmp' % (content_signature_key, uuid4()))
+        try:
+            disk_db_conn = sqlite3.connect(temp_filename)
+            try:
+                with disk_db_conn:
+                    source_sqlite_db.conn.backup(disk_db_conn)
+            finally:
+                disk_db_conn.close()
+            filename = self.get_cache_filename(content_signature_key)
+            os.replace(temp_filename, filename)
+        except:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        xprint("Stored cache %s" % filename)
+        self.evict_if_needed()
+        return filename
+
+    def get_entries(self):
+        # Returns the entries of the directory, most recently used first
+        entries = []
+        if not os.path.isdir(self.path):
+            return entries
+        for filename in glob.glob(os.path.join(self.path, '*.qsql')):
+            try:
+                st = os.stat(filename)
+            except OSError:
+                # Evicted by another process
+                continue
+            entries.append(CacheDirectoryEntry(os.path.basename(filename)[:-len('.qsql')], filename, st.st_size, st.st_mtime))
+        return sorted(entries, key=lambda e: e.last_access_time, reverse=True)
+
+    def evict_if_needed(self):
+        if self.max_size is None:
+            return []
+        entries = self.get_entries()
+        total_size = sum(e.size for e in entries)
+        evicted_entries = []
+        while total_size > self.max_size and len(entries) > 0:
+            entry = entries.pop()
+            xprint("Evicting cache %s (total cache size %s, maximum size %s)" % (entry.filename, total_size, self.max_size))
+            try:
+                os.remove(entry.filename)
+            except OSError as e:
+                xprint("Could not evict cache %s: %s" % (entry.filename, e))
+            total_size -= entry.size
+            evicted_entries.append(entry)
+        return evicted_entries
+
+    def get_entry_sources(self, entry):
+        # Returns the sources of the tables in the cache
+        db = Sqlite3DB('cache_directory_entry', 'file:%s?immutable=1' % entry.filename, entry.filename, create_qcatalog=False)
+        try:
+            return [x['source'] for x in db.get_all_from_qcatalog() or []]
+        except sqlite3.Error:
+            return []
+        finally:
+            db.done()
+
+    def print_stats(self, f):
+        entries = self.get_entries()
+        print("Cache directory: %s" % self.path, file=f)
+        print("Cached tables: %s" % len(entries), file=f)
+        print("Total size: %s bytes (maximum size: %s)" % (sum(e.size for e in entries),
+              '%s bytes' % self.max_size if self.max_size is not None else 'unlimited'), file=f)
+        for entry in entries:
+            last_access_time = datetime.datetime.fromtimestamp(entry.last_access_time).isoformat(' ', 'seconds')
+            print("  %s  %12s bytes  %s  %s" % (last_access_time, entry.size, entry.content_signature_key,
+                  ",".join(self.get_entry_sources(entry))), file=f)
+
+def is_range_read(input_params):
+    return input_params.byte_range is not None or input_params.record_range is not None
+
+def get_range_read_cache_suffix(input_params):
+    # Caches of range reads are stored separately from the caches of whole files, and of other ranges
+    if input_params.byte_range is not None:
+        return '.bytes-%s-%s' % (input_params.byte_range[0], input_params.byte_range[1] if input_params.byte_range[1] is not None else '')
+    if input_params.record_range is not None:
+        return '.records-%s-%s' % (input_params.record_range[0], input_params.record_range[1] if input_params.record_range[1] is not None else '')
+    return ''
+
+def parse_range(s):
+    # Parses START:END into (start, end). A missing start is 0 and a missing end is None (up to the end). Raises
+    # ValueError for invalid ranges
+    if s.count(':') != 1:
+        raise ValueError('Range must be of the form START:END')
+    start_str, end_str = [x.strip() for x in s.split(':')]
+    start = int(start_str) if start_str != '' else 0
+    end = int(end_str) if end_str != '' else None
+    if start < 0 or (end is not None and end < start):
+        raise ValueError('Range start must be at least 0, and range end must not be smaller than its start')
+    return start, end
+
 class DelimitedFileReader(object):
     def __init__(self,atomic_fns, input_params, dialect, f = None,external_f_name = None):
         if f is not None:
@@ -1404,6 +3287,18 @@ class DelimitedFileReader(object):
         self.lines_read = 0
         self.file_number = -1
 
+        # Used for resuming the read of a multi-file table from another process (see ParallelDelimitedFileLoader)
+        self.current_file_name = None
+        self.current_file_lines_read = 0
+
+        # Files are read one after the other. Reading can be resumed after generate_rows() has been stopped
+        self.next_file_index = 0
+        self.current_file_lines = None
+        self.current_csv_reader = None
+
+        # Files which are not memory mapped are read ahead on a separate thread when the load is pipelined
+        self.pipeline_stats = PipelineStats() if input_params.pipelined_load else None
+
         self.skipped_bom = False
 
         self.is_open = f is not None
@@ -1414,88 +3309,1703 @@ class DelimitedFileReader(object):
     def get_lines_read(self):
         return self.lines_read
 
+    def get_unread_file_parts(self):
+        # Returns (filename, records to skip, header expected) for every file part which has not been read yet,
+        # in the original file order
+        current_file_name = self.current_file_name
+        if current_file_name is None:
+            return [(fn, 0, False) for fn in self.atomic_fns]
+
+        current_index = self.atomic_fns.index(current_file_name)
+        parts = [(current_file_name, self.current_file_lines_read, False)]
+        parts += [(fn, 0, self.input_params.skip_header) for fn in self.atomic_fns[current_index + 1:]]
+        return parts
+
     def get_size_hash(self):
         if self.atomic_fns is None or len(self.atomic_fns) == 0:
             return "data-stream-size"
         else:
-            return ",".join(map(str,[os.stat(atomic_fn).st_size for atomic_fn in self.atomic_fns]))
+            return get_files_size_hash(self.atomic_fns)
 
     def get_last_modification_time_hash(self):
         if self.atomic_fns is None or len(self.atomic_fns) == 0:
             return "data stream-lmt"
         else:
-            x = ",".join(map(lambda x: ':%s:' % x,[os.stat(x).st_mtime_ns for x in self.atomic_fns]))
-            res = hashlib.sha1(six.b(x)).hexdigest() + '///' + x
-            xprint("Hash of last modification time is %s" % res)
-            return res
+            return get_files_last_modification_time_hash(self.atomic_fns)
 
     def open_file(self):
         if self.external_f:
             xprint("External f has been provided. No need to open the file")
             return
 
-        # TODO Support universal newlines for gzipped and stdin data as well
+        # Files are actually opened one at a time while rows are generated
+        xprint("XX Opening file %s" % ",".join(self.atomic_fns))
+        self.next_file_index = 0
+        self.is_open = True
+
+    def _open_text_file(self, filename):
+        # TODO Support universal newlines for stdin data as well
+        if six.PY3:
+            if self.input_params.with_universal_newlines:
+                f = io.open(filename, 'rU', newline=None, encoding=self.input_params.input_encoding)
+            else:
+                f = io.open(filename, 'r', newline=None, encoding=self.input_params.input_encoding)
+        else:
+            if self.input_params.with_universal_newlines:
+                file_opening_mode = 'rbU'
+            else:
+                file_opening_mode = 'rb'
+            f = open(filename, file_opening_mode)
+
+        if self.input_params.input_encoding == 'utf-8-sig' and not self.skipped_bom:
+            skip_BOM(f)
+
+        return f
+
+    def _generate_text_file_lines(self, filename):
+        f = self._open_text_file(filename)
+        try:
+            for line in f:
+                yield line
+        finally:
+            f.close()
+
+    def _generate_read_ahead_lines(self, raw_f, compression):
+        # Reads (and decompresses) the binary stream on a separate thread. Compressed data is always read this way, so
+        # decompression overlaps parsing
+        f = raw_f
+        try:
+            if compression is not None:
+                f = open_decompressing_stream(compression, raw_f)
+            if self.input_params.input_encoding == 'utf-8-sig' and not self.skipped_bom:
+                validate_BOM(lambda: f.read(3))
+        except:
+            if f is not raw_f:
+                f.close()
+            raw_f.close()
+            raise
+
+        pipeline_stats = self.pipeline_stats if self.pipeline_stats is not None else PipelineStats()
+        block_reader = ReadAheadBlockReader(f, self.input_params.read_ahead_queue_depth, pipeline_stats)
+        try:
+            for line in generate_decoded_lines(block_reader.generate_blocks(), self.input_params.input_encoding):
+                yield line
+        finally:
+            block_reader.close()
+            raw_f.close()
+
+    def _generate_external_stream_lines(self):
+        # Data streams are decompressed when their data is compressed. Only streams with an underlying binary stream
+        # can be checked
+        binary_f = get_peekable_binary_stream(self.f)
+        if binary_f is None:
+            if self.input_params.gzipped_input:
+                raise CannotUnzipDataStreamException()
+            return self.f
+        compression = detect_compression(binary_f.peek(COMPRESSION_SIGNATURE_LENGTH)[:COMPRESSION_SIGNATURE_LENGTH])
+        if compression is None and self.input_params.gzipped_input:
+            compression = 'gzip'
+        if compression is None:
+            return self.f
+        xprint("Data stream %s is %s compressed" % (self.external_f_name, compression))
+        self.current_file_lines = self._generate_read_ahead_lines(binary_f, compression)
+        return self.current_file_lines
+
+    def _generate_parallel_gzip_file_lines(self, decompressor):
+        decompressed_blocks = decompressor.generate_blocks()
+        try:
+            blocks = decompressed_blocks
+            if self.input_params.input_encoding == 'utf-8-sig' and not self.skipped_bom:
+                first_block = next(blocks, six.b(''))
+                validate_BOM(lambda: first_block[:3])
+                blocks = itertools.chain([first_block[3:]], blocks)
+            for line in generate_decoded_lines(blocks, self.input_params.input_encoding):
+                yield line
+        finally:
+            decompressed_blocks.close()
+
+    def _create_range_read_plan(self, filename):
+        # Returns the (start offset, end offset) regions of the file which contain the header and the records of a byte or
+        # record range (None when the whole file needs to be read), and the numbers of records to skip and to read after
+        # the header (see _generate_record_range)
+        header_record_count = 1 if self.input_params.skip_header else 0
+        dialect_params = get_dialect_params(self.dialect)
+        is_seekable = is_byte_scannable_file(filename, self.input_params) and not self.input_params.with_universal_newlines
+
+        if self.input_params.byte_range is not None:
+            if not is_seekable:
+                raise RangeReadException("Byte ranges can only be read from uncompressed files, without universal newlines (%s)" % filename)
+            boundary_finder = RecordBoundaryFinder(filename, self.input_params, dialect_params)
+            start_offset, end_offset = self.input_params.byte_range
+            start_offset = boundary_finder.find(start_offset)
+            end_offset = max(start_offset, boundary_finder.find(end_offset) if end_offset is not None else boundary_finder.file_size)
+            regions = [(start_offset, end_offset)]
+            if header_record_count > 0 and start_offset > 0:
+                regions.insert(0, (0, boundary_finder.find(1)))
+            xprint("Reading regions %s of %s for byte range %s" % (regions, filename, self.input_params.byte_range))
+            return regions, 0, None
+
+        first_record, end_record = self.input_params.record_range
+        record_count = end_record - first_record if end_record is not None else None
+        record_offset_index = RecordOffsetIndex.load(filename, self.input_params, dialect_params) if is_seekable else None
+        if record_offset_index is None:
+            return None, first_record, record_count
+
+        # Reading starts at the indexed record preceding the range
+        offsets = record_offset_index.offsets
+        interval = record_offset_index.interval
+        block_number = min((first_record + header_record_count) // interval, len(offsets) - 1)
+        records_to_skip = first_record + header_record_count - block_number * interval - (header_record_count if block_number == 0 else 0)
+        end_offset = os.stat(filename).st_size
+        if end_record is not None:
+            end_block_number = (end_record + header_record_count + interval - 1) // interval
+            if end_block_number < len(offsets):
+                end_offset = offsets[end_block_number]
+        regions = [(offsets[block_number], end_offset)]
+        if header_record_count > 0 and block_number > 0:
+            regions.insert(0, (0, RecordBoundaryFinder(filename, self.input_params, dialect_params).find(1)))
+        xprint("Reading regions %s of %s for record range %s using its record index" % (regions, filename, self.input_params.record_range))
+        return regions, records_to_skip, record_count
+
+    def _generate_record_range(self, csv_reader, records_to_skip, record_count):
+        # Generates the header (when there is one), and then record_count records (or all of them) after skipping
+        # records_to_skip records
+        if self.input_params.skip_header:
+            header = next(csv_reader, None)
+            if header is None:
+                return
+            yield header
+        for _ in range(records_to_skip):
+            if next(csv_reader, None) is None:
+                return
+        for col_vals in itertools.islice(csv_reader, record_count):
+            yield col_vals
+
+    def _should_build_gzip_index(self, filename, compression):
+        if not self.input_params.build_gzip_index or compression != 'gzip' or not os.path.isfile(filename):
+            return False
+        return get_zlib_library() is not None and GzipIndex.load(filename) is None
+
+    def _open_next_file(self):
+        # Returns False when there are no more files to read
+        if self.next_file_index >= len(self.atomic_fns):
+            return False
+        filename = self.atomic_fns[self.next_file_index]
+        self.next_file_index += 1
+        xprint("Opening file %s" % filename)
+        range_read_plan = None
+        if is_range_read(self.input_params):
+            if len(self.atomic_fns) > 1:
+                raise RangeReadException("Ranges can only be read from a single file, but there are %s files (%s)" % (len(self.atomic_fns), ",".join(self.atomic_fns)))
+            range_read_plan = self._create_range_read_plan(filename)
+        compression = get_file_compression(filename, self.input_params)
+        parallel_gzip_decompressor = None
+        if is_parallel_decompressible_file(filename, self.input_params):
+            parallel_gzip_decompressor = ParallelGzipDecompressor.create(filename, self.input_params.parallel_load)
+        if range_read_plan is not None and range_read_plan[0] is not None:
+            self.current_file_lines = generate_mmap_file_lines(filename, self.input_params.input_encoding, regions=range_read_plan[0])
+        elif is_mmap_readable_file(filename, self.input_params):
+            self.current_file_lines = generate_mmap_file_lines(filename, self.input_params.input_encoding)
+        elif parallel_gzip_decompressor is not None:
+            self.current_file_lines = self._generate_parallel_gzip_file_lines(parallel_gzip_decompressor)
+        elif self._should_build_gzip_index(filename, compression):
+            xprint("Building gzip index of %s" % filename)
+            self.current_file_lines = self._generate_read_ahead_lines(GzipIndexBuilder(filename), None)
+        elif compression is not None or (self.pipeline_stats is not None and not self.input_params.with_universal_newlines):
+            xprint("File %s compression: %s" % (filename, compression))
+            self.current_file_lines = self._generate_read_ahead_lines(io.open(filename, 'rb'), compression)
+        else:
+            self.current_file_lines = self._generate_text_file_lines(filename)
+        self.current_csv_reader = encoded_csv_reader(self.input_params.input_encoding, self.current_file_lines, dialect=self.dialect)
+        if range_read_plan is not None:
+            self.current_csv_reader = self._generate_record_range(self.current_csv_reader, range_read_plan[1], range_read_plan[2])
+        self.current_file_name = filename
+        self.current_file_lines_read = 0
+        return True
+
+    def _close_current_file(self):
+        if self.current_file_lines is not None:
+            self.current_file_lines.close()
+        self.current_file_lines = None
+        self.current_csv_reader = None
+
+    def close_file(self):
+        if not self.is_open:
+            # TODO Convert to assertion
+            raise Exception("Bug - file should already be open: %s" % ",".join(self.atomic_fns))
+
+        if self.external_f:
+            self._close_current_file()
+            self.f.close()
+        else:
+            self._close_current_file()
+        xprint("XX Closed file %s" % ",".join(self.atomic_fns))
+
+    def generate_rows(self):
+        try:
+            # TODO Some order with regard to separating data-streams for actual files
+            if self.external_f:
+                if self.current_csv_reader is None:
+                    if self.input_params.byte_range is not None:
+                        raise RangeReadException("Byte ranges cannot be read from data streams (%s)" % self.external_f_name)
+                    self.current_csv_reader = encoded_csv_reader(self.input_params.input_encoding, self._generate_external_stream_lines(), dialect=self.dialect)
+                    if self.input_params.record_range is not None:
+                        first_record, end_record = self.input_params.record_range
+                        self.current_csv_reader = self._generate_record_range(self.current_csv_reader, first_record,
+                                                                              end_record - first_record if end_record is not None else None)
+                for col_vals in self.current_csv_reader:
+                    self.lines_read += 1
+                    yield self.external_f_name,0, self.lines_read == 0, col_vals
+            else:
+                while self.current_csv_reader is not None or self._open_next_file():
+                    file_name = self.current_file_name
+                    for col_vals in self.current_csv_reader:
+                        is_first_line = self.current_file_lines_read == 0
+                        if is_first_line:
+                            self.file_number = self.file_number + 1
+                        self.lines_read += 1
+                        self.current_file_lines_read += 1
+                        yield file_name,self.file_number,is_first_line,col_vals
+                    self._close_current_file()
+        except ColumnMaxLengthLimitExceededException as e:
+            msg = "Column length is larger than the maximum. Offending file is '%s' - Line is %s, counting from 1 (encoding %s). The line number is the raw line number of the file, ignoring whether there's a header or not" % (",".join(self.atomic_fns),self.lines_read + 1,self.input_params.input_encoding)
+            raise ColumnMaxLengthLimitExceededException(msg)
+        except UniversalNewlinesExistException as e2:
+            # No need to translate the exception, but we want it to be explicitly defined here for clarity
+            raise UniversalNewlinesExistException()
+
+PARALLEL_LOAD_MIN_CHUNK_SIZE = 256 * 1024
+PARALLEL_LOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+RECORD_SCAN_BLOCK_SIZE = 8 * 1024 * 1024
+
+def is_ascii_compatible_encoding(encoding):
+    # Byte-level record boundary detection is only possible when newlines, quotes and escape characters
+    # are encoded as single ASCII bytes which can never be part of another character
+    try:
+        name = codecs.lookup(encoding).name
+    except LookupError:
+        return False
+    return name in ['utf-8', 'utf-8-sig', 'ascii'] or name.startswith('iso8859-') or name.startswith('cp125')
+
+def get_dialect_params(dialect_id):
+    d = csv.get_dialect(dialect_id)
+    return {
+        'delimiter': d.delimiter,
+        'quotechar': d.quotechar,
+        'escapechar': d.escapechar,
+        'doublequote': d.doublequote,
+        'skipinitialspace': d.skipinitialspace,
+        'quoting': d.quoting,
+        'lineterminator': d.lineterminator,
+        'strict': d.strict
+    }
+
+def get_dialect_special_bytes(dialect_params):
+    # Bytes which can make a newline not be a record boundary
+    special_bytes = []
+    if dialect_params['quoting'] != csv.QUOTE_NONE and dialect_params['quotechar'] is not None:
+        special_bytes.append(dialect_params['quotechar'].encode('ascii'))
+    if dialect_params['escapechar'] is not None:
+        special_bytes.append(dialect_params['escapechar'].encode('ascii'))
+    return special_bytes
+
+def is_byte_scannable_file(filename, input_params):
+    if get_file_compression(filename, input_params) is not None:
+        return False
+    if not is_ascii_compatible_encoding(input_params.input_encoding):
+        return False
+    return os.path.isfile(filename)
+
+class RecordBoundaryScanner(object):
+    # Finds the byte offsets of record boundaries in an uncompressed delimited file. If the file contains no quote
+    # or escape characters, every newline is a record boundary and boundaries are found using plain byte searches.
+    # Otherwise the file is scanned using the csv module itself, so quoted fields with embedded newlines are never split
+    def __init__(self, filename, dialect_params, block_size=RECORD_SCAN_BLOCK_SIZE):
+        self.filename = filename
+        self.dialect_params = dialect_params
+        self.block_size = block_size
+        self.file_size = os.stat(filename).st_size
+
+        self.requires_csv_scan = None
+        self.has_lone_carriage_returns = None
+
+    def detect_special_bytes(self):
+        special_bytes = get_dialect_special_bytes(self.dialect_params)
+
+        found_special_bytes = False
+        cr_count = 0
+        crlf_count = 0
+        prev_block_ended_with_cr = False
+        with open(self.filename, 'rb') as f:
+            while True:
+                block = f.read(self.block_size)
+                if not block:
+                    break
+                if not found_special_bytes:
+                    found_special_bytes = any(b in block for b in special_bytes)
+                cr_count += block.count(b'\r')
+                crlf_count += block.count(b'\r\n')
+                if prev_block_ended_with_cr and block.startswith(b'\n'):
+                    crlf_count += 1
+                prev_block_ended_with_cr = block.endswith(b'\r')
+
+        self.requires_csv_scan = found_special_bytes
+        self.has_lone_carriage_returns = cr_count != crlf_count
+        xprint("Scanned %s for special bytes: requires_csv_scan=%s has_lone_carriage_returns=%s" % (self.filename,self.requires_csv_scan,self.has_lone_carriage_returns))
+
+    def iterate_record_end_offsets(self, start_offset):
+        assert self.requires_csv_scan is not None, "detect_special_bytes() must be called first"
+        f = open(self.filename, 'rb')
+        try:
+            f.seek(start_offset)
+            if not self.requires_csv_scan:
+                offset = start_offset
+                for line in f:
+                    offset += len(line)
+                    yield offset
+            else:
+                current_offset = [start_offset]
+
+                def lines():
+                    for line in f:
+                        current_offset[0] += len(line)
+                        # latin-1 maps each byte to one character, so the csv parser sees the exact byte structure
+                        yield line.decode('iso8859-1')
+
+                for _ in csv.reader(lines(), **self.dialect_params):
+                    yield current_offset[0]
+        finally:
+            f.close()
+
+    def next_record_boundary(self, offset, start_offset=0):
+        # Returns the first record boundary at or after offset. start_offset has to be a record boundary
+        if offset <= start_offset:
+            return start_offset
+        for end_offset in self.iterate_record_end_offsets(start_offset):
+            if end_offset >= offset:
+                return end_offset
+        return self.file_size
+
+    def record_start_offset(self, record_index):
+        if record_index == 0:
+            return 0
+        for i, end_offset in enumerate(self.iterate_record_end_offsets(0)):
+            if i + 1 == record_index:
+                return end_offset
+        return self.file_size
+
+    def _find_next_record_start(self, f, offset):
+        # Returns the offset right after the first newline at or after offset
+        f.seek(offset)
+        while True:
+            block = f.read(self.block_size)
+            if not block:
+                return self.file_size
+            pos = block.find(b'\n')
+            if pos != -1:
+                return offset + pos + 1
+            offset += len(block)
+
+    def chunk_ranges(self, start_offset, chunk_count):
+        remaining = self.file_size - start_offset
+        targets = [start_offset + (remaining * i) // chunk_count for i in range(1, chunk_count)]
+
+        boundaries = [start_offset]
+        if self.requires_csv_scan:
+            pending_targets = list(reversed(targets))
+            for end_offset in self.iterate_record_end_offsets(start_offset):
+                if len(pending_targets) == 0:
+                    break
+                if end_offset >= pending_targets[-1]:
+                    while len(pending_targets) > 0 and end_offset >= pending_targets[-1]:
+                        pending_targets.pop()
+                    if end_offset < self.file_size:
+                        boundaries.append(end_offset)
+        else:
+            with open(self.filename, 'rb') as f:
+                for target in targets:
+                    if target <= boundaries[-1]:
+                        continue
+                    boundary = self._find_next_record_start(f, target - 1)
+                    if boundary > boundaries[-1] and boundary < self.file_size:
+                        boundaries.append(boundary)
+
+        boundaries.append(self.file_size)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+RECORD_INDEX_INTERVAL = 10000
+RECORD_INDEX_FILENAME_SUFFIX = '.qidx'
+RECORD_INDEX_VERSION = 1
+
+class RangeReadException(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+class RecordIndexException(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+class RecordOffsetIndex(object):
+    # The byte offsets of every interval-th record of an uncompressed delimited file (quote-aware, see
+    # RecordBoundaryScanner) and its total record count. Stored in a sidecar file next to the delimited file, and used
+    # only while the file has the same size and modification time, and is read with the same encoding and dialect
+    def __init__(self, size_hash, last_modification_time_hash, encoding, dialect_params, interval, record_count, offsets):
+        self.size_hash = size_hash
+        self.last_modification_time_hash = last_modification_time_hash
+        self.encoding = encoding
+        self.dialect_params = dialect_params
+        self.interval = interval
+        self.record_count = record_count
+        # offsets[i] is the offset of record i * interval
+        self.offsets = offsets
+
+    @staticmethod
+    def get_index_filename(filename):
+        return filename + RECORD_INDEX_FILENAME_SUFFIX
+
+    @staticmethod
+    def build(filename, input_params, dialect_params, interval=None):
+        if interval is None:
+            interval = RECORD_INDEX_INTERVAL
+        if input_params.with_universal_newlines or not is_byte_scannable_file(filename, input_params):
+            raise RecordIndexException("Cannot index %s. Only regular uncompressed files with an ASCII compatible encoding can be indexed" % filename)
+
+        # Records are parsed only as bytes, so decoding is validated separately
+        decoder = codecs.getincrementaldecoder(input_params.input_encoding)()
+        try:
+            with open(filename, 'rb') as f:
+                while True:
+                    block = f.read(RECORD_SCAN_BLOCK_SIZE)
+                    decoder.decode(block, final=len(block) == 0)
+                    if len(block) == 0:
+                        break
+        except UnicodeDecodeError as e:
+            raise RecordIndexException("Cannot index %s, since it cannot be decoded using encoding %s: %s" % (filename, input_params.input_encoding, str(e)))
+
+        scanner = RecordBoundaryScanner(filename, dialect_params)
+        scanner.detect_special_bytes()
+        if scanner.has_lone_carriage_returns:
+            raise RecordIndexException("Cannot index %s, since it contains carriage returns which are not followed by a newline" % filename)
+
+        size_hash = get_files_size_hash([filename])
+        last_modification_time_hash = get_files_last_modification_time_hash([filename])
+        offsets = [0]
+        record_count = 0
+        try:
+            for end_offset in scanner.iterate_record_end_offsets(0):
+                record_count += 1
+                if record_count % interval == 0:
+                    offsets.append(end_offset)
+        except csv.Error as e:
+            raise RecordIndexException("Cannot index %s, since its records cannot be parsed: %s" % (filename, str(e)))
+        # Only offsets of existing records are kept
+        offsets = offsets[:(record_count + interval - 1) // interval]
+        return RecordOffsetIndex(size_hash, last_modification_time_hash, input_params.input_encoding, dialect_params, interval, record_count, offsets)
+
+    def save(self, filename):
+        index_filename = RecordOffsetIndex.get_index_filename(filename)
+        d = {
+            'version': RECORD_INDEX_VERSION,
+            'size_hash': self.size_hash,
+            'last_modification_time_hash': self.last_modification_time_hash,
+            'encoding': self.encoding,
+            'dialect_params': self.dialect_params,
+            'interval': self.interval,
+            'record_count': self.record_count,
+            'offsets': self.offsets
+        }
+        tmp_filename = '%s.%s.tmp' % (index_filename, os.getpid())
+        with io.open(tmp_filename, 'w', encoding='utf-8') as f:
+            f.write(six.text_type(json.dumps(d)))
+        os.replace(tmp_filename, index_filename)
+        xprint("Saved record index %s with %s offsets" % (index_filename, len(self.offsets)))
+
+    @staticmethod
+    def load(filename, input_params, dialect_params):
+        # Returns None when there is no valid index for the file
+        index_filename = RecordOffsetIndex.get_index_filename(filename)
+        if not os.path.isfile(index_filename):
+            return None
+        try:
+            with io.open(index_filename, 'r', encoding='utf-8') as f:
+                d = json.load(f)
+            if d['version'] != RECORD_INDEX_VERSION:
+                return None
+            if d['size_hash'] != get_files_size_hash([filename]) or d['last_modification_time_hash'] != get_files_last_modification_time_hash([filename]):
+                xprint("Ignoring stale record index %s" % index_filename)
+                return None
+            if codecs.lookup(d['encoding']).name != codecs.lookup(input_params.input_encoding).name or d['dialect_params'] != dialect_params:
+                xprint("Ignoring record index %s, which has been built for another encoding or dialect" % index_filename)
+                return None
+            return RecordOffsetIndex(d['size_hash'], d['last_modification_time_hash'], d['encoding'], d['dialect_params'],
+                                     d['interval'], d['record_count'], d['offsets'])
+        except (ValueError, KeyError, TypeError, LookupError) as e:
+            xprint("Ignoring invalid record index %s: %s" % (index_filename, str(e)))
+            return None
+
+class RecordBoundaryFinder(object):
+    # Finds the record boundaries of an uncompressed file which are closest to arbitrary byte offsets. A newline is a
+    # record boundary when no quote or escape character precedes it within the maximum column length, since a quoted
+    # value containing it would be too long. Otherwise records are parsed from the closest preceding offset of the
+    # file's record index (see RecordOffsetIndex), or from the beginning of the file if it has no index
+    def __init__(self, filename, input_params, dialect_params):
+        self.filename = filename
+        self.input_params = input_params
+        self.dialect_params = dialect_params
+        self.special_bytes = get_dialect_special_bytes(dialect_params)
+        self.file_size = os.stat(filename).st_size
+
+        # Initialized only when records need to be parsed
+        self.scanner = None
+        self.record_offset_index = None
+
+    def _find_next_newline(self, f, offset):
+        f.seek(offset)
+        while True:
+            block = f.read(READ_AHEAD_BLOCK_SIZE)
+            if not block:
+                return None
+            pos = block.find(b'\n')
+            if pos != -1:
+                return offset + pos
+            offset += len(block)
+
+    def find(self, offset):
+        # Returns the first record boundary at or after offset
+        if offset <= 0:
+            return 0
+        if offset >= self.file_size:
+            return self.file_size
+        with open(self.filename, 'rb') as f:
+            newline_offset = self._find_next_newline(f, offset - 1)
+            if newline_offset is None:
+                return self.file_size
+            lookback_offset = max(0, newline_offset - self.input_params.max_column_length_limit)
+            f.seek(lookback_offset)
+            lookback = f.read(newline_offset - lookback_offset)
+        if not any(b in lookback for b in self.special_bytes):
+            return newline_offset + 1
+        return self._find_by_parsing(offset)
+
+    def _find_by_parsing(self, offset):
+        if self.scanner is None:
+            self.scanner = RecordBoundaryScanner(self.filename, self.dialect_params)
+            self.record_offset_index = RecordOffsetIndex.load(self.filename, self.input_params, self.dialect_params)
+            if self.record_offset_index is not None:
+                # Indexed files never contain lone carriage returns
+                self.scanner.requires_csv_scan = True
+            else:
+                xprint("Parsing %s from its beginning to find record boundaries. A record index would avoid that" % self.filename)
+                self.scanner.detect_special_bytes()
+                if self.scanner.has_lone_carriage_returns:
+                    raise RangeReadException("Record boundaries of file %s cannot be found, since it contains lone carriage returns" % self.filename)
+
+        start_offset = 0
+        if self.record_offset_index is not None:
+            offsets = self.record_offset_index.offsets
+            start_offset = offsets[bisect.bisect_right(offsets, offset) - 1]
+        return self.scanner.next_record_boundary(offset, start_offset)
+
+class ParallelLoadFallbackException(Exception):
+
+    def __init__(self, msg):
+        self.msg = msg
+
+    def __str__(self):
+        return repr(self.msg)
+
+def create_row_normalizer(mode, column_count, numeric_column_indices, input_delimiter, projected_column_indices,
+                          on_column_count_mismatch):
+    # Returns a function which normalizes a parsed row before it is inserted: numeric columns get NULL instead of an
+    # empty string, and in relaxed mode missing columns are filled with NULLs and extra columns are merged into the
+    # last one. When projected_column_indices is provided, only these columns are returned. The function is
+    # specialized once per table, since it is called for every row. The row list itself might be modified
+    #
+    # on_column_count_mismatch(actual_col_count) is called in strict mode and is expected to raise an exception
+    if mode not in ['strict', 'relaxed']:
+        raise Exception('Unknown parsing mode %s' % mode)
+    numeric_column_indices = tuple(numeric_column_indices)
+
+    if projected_column_indices is None:
+        def nullify_empty_numeric_values(col_vals):
+            for i in numeric_column_indices:
+                if col_vals[i] == '':
+                    col_vals[i] = None
+            return col_vals
+
+        if mode == 'strict':
+            def normalize_row(col_vals):
+                if len(col_vals) != column_count:
+                    on_column_count_mismatch(len(col_vals))
+                return nullify_empty_numeric_values(col_vals)
+            return normalize_row
+
+        def normalize_row(col_vals):
+            actual_col_count = len(col_vals)
+            if actual_col_count < column_count:
+                col_vals.extend([None] * (column_count - actual_col_count))
+            elif actual_col_count > column_count:
+                col_vals = col_vals[:column_count - 1] + [input_delimiter.join(col_vals[column_count - 1:])]
+            return nullify_empty_numeric_values(col_vals)
+        return normalize_row
+
+    projected_column_indices = tuple(projected_column_indices)
+    numeric_column_index_set = set(numeric_column_indices)
+    projected_columns = [(i, i in numeric_column_index_set) for i in projected_column_indices]
+    # Positions of numeric columns in the projected row
+    projected_numeric_positions = tuple([p for p, (i, is_numeric) in enumerate(projected_columns) if is_numeric])
+
+    def project_row_with_mismatched_column_count(col_vals):
+        actual_col_count = len(col_vals)
+        # in relaxed mode, we merge all extra columns to the last column value
+        merged_column_index = column_count - 1 if mode == 'relaxed' and actual_col_count > column_count else None
+        new_vals = []
+        for i, is_numeric in projected_columns:
+            if i >= actual_col_count:
+                v = None
+            elif i == merged_column_index:
+                v = input_delimiter.join(col_vals[i:])
+            else:
+                v = col_vals[i]
+                if is_numeric and v == '':
+                    v = None
+            new_vals.append(v)
+        return new_vals
+
+    def normalize_and_project_row(col_vals):
+        if len(col_vals) != column_count:
+            if mode == 'strict':
+                on_column_count_mismatch(len(col_vals))
+            return project_row_with_mismatched_column_count(col_vals)
+        new_vals = [col_vals[i] for i in projected_column_indices]
+        for p in projected_numeric_positions:
+            if new_vals[p] == '':
+                new_vals[p] = None
+        return new_vals
+    return normalize_and_project_row
+
+def open_delimited_file_for_parallel_load(filename, encoding, compression):
+    # Same opening semantics as DelimitedFileReader.open_file, used when a worker reads an entire file
+    if compression is not None:
+        f = io.TextIOWrapper(open_decompressing_stream(compression, filename), encoding=encoding, newline=None)
+    else:
+        f = io.open(filename, 'r', newline=None, encoding=encoding)
+
+    if encoding == 'utf-8-sig':
+        skip_BOM(f)
+    return f
+
+def load_delimited_file_part_into_sqlite(task):
+    # Runs inside a worker process. Parses either a byte range [start_offset,end_offset) of a file, or an entire file
+    # when end_offset is None, and writes the records into a table inside a private sqlite file. The parent copies
+    # this table into the target table afterwards
+    record_count = 0
+    header = None
+    try:
+        csv.field_size_limit(task['max_column_length_limit'])
+
+        if task['gzip_index_point'] is None and task['end_offset'] is None:
+            f = open_delimited_file_for_parallel_load(task['filename'], task['encoding'], task['compression'])
+        else:
+            if task['gzip_index_point'] is not None:
+                data = read_gzip_index_region(task['filename'], task['gzip_index_point'], task['end_offset'])
+                # Regions are aligned to newlines, which have to be record boundaries
+                for special_byte in get_dialect_special_bytes(task['dialect_params']):
+                    if special_byte in data:
+                        raise ParallelLoadFallbackException('Gzip region contains %s, so newlines might not be record boundaries' % repr(special_byte))
+                if data.count(six.b('\r')) != data.count(six.b('\r\n')):
+                    raise ParallelLoadFallbackException('Gzip region contains lone carriage returns')
+            else:
+                with open(task['filename'], 'rb') as raw_f:
+                    raw_f.seek(task['start_offset'])
+                    data = raw_f.read(task['end_offset'] - task['start_offset'])
+
+            encoding = task['encoding']
+            if task['start_offset'] > 0 and codecs.lookup(encoding).name == 'utf-8-sig':
+                # The BOM exists only at the beginning of the file
+                encoding = 'utf-8'
+            f = io.StringIO(data.decode(encoding), newline=None)
+            del data
+
+        try:
+            csv_reader = generate_split_tokenized_records(f, task['dialect_params'])
+
+            # Records which have already been read by the parent during analysis
+            for _ in range(task['skip_records']):
+                if next(csv_reader, None) is None:
+                    break
+
+            if task['header_expected']:
+                header = next(csv_reader, None)
+                if header is not None:
+                    record_count += 1
+
+            column_count = task['column_count']
+            row_filter = task['row_filter']
+
+            def on_column_count_mismatch(actual_col_count):
+                # Reported back to the parent, which then reloads serially in order to provide the exact same error
+                # as a serial load
+                raise ParallelLoadFallbackException('Column count mismatch (%s instead of %s)' % (actual_col_count, column_count))
+
+            normalize_row = create_row_normalizer(task['mode'], column_count, task['numeric_column_indices'], task['input_delimiter'],
+                                                  task['projected_column_indices'], on_column_count_mismatch)
+
+            def normalized_rows():
+                nonlocal record_count
+                for col_vals in csv_reader:
+                    record_count += 1
+                    col_vals = normalize_row(col_vals)
+                    if row_filter is not None and not row_filter.matches(col_vals):
+                        continue
+                    yield col_vals
+
+            conn = sqlite3.connect(task['db_filename'])
+            try:
+                conn.execute('PRAGMA journal_mode=OFF')
+                conn.execute('PRAGMA synchronous=OFF')
+                conn.execute(task['create_table_stmt'])
+                conn.executemany(task['insert_row_stmt'], normalized_rows())
+                conn.commit()
+            finally:
+                conn.close()
+        finally:
+            f.close()
+        return {'record_count': record_count, 'header': header, 'error': None}
+    except Exception as e:
+        return {'record_count': record_count, 'header': header, 'error': '%s: %s' % (type(e).__name__, str(e))}
+
+PARALLEL_GZIP_PART_SIZE = 8 * 1024 * 1024
+GZIP_MEMBER_SEARCH_WINDOW_SIZE = 256 * 1024
+GZIP_MEMBER_PROBE_SIZE = 64 * 1024
+GZIP_MEMBER_MAGIC = six.b('\x1f\x8b\x08')
+
+def is_gzip_member_start(data):
+    # The reserved header flags must be zero, and the beginning of the member must be decompressible
+    import zlib
+    if len(data) < 10 or six.indexbytes(data, 3) & 0xe0 != 0:
+        return False
+    try:
+        zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data[:GZIP_MEMBER_PROBE_SIZE], GZIP_MEMBER_PROBE_SIZE)
+    except zlib.error:
+        return False
+    return True
+
+def find_gzip_member_start(f, offset, end_offset):
+    # Returns the offset of the first gzip member which starts between the offsets, or None. The range is searched
+    # one window at a time, so members of any size are found
+    window_start = offset
+    while window_start < end_offset:
+        window_size = min(GZIP_MEMBER_SEARCH_WINDOW_SIZE, end_offset - window_start)
+        f.seek(window_start)
+        window = f.read(window_size + GZIP_MEMBER_PROBE_SIZE)
+        i = window.find(GZIP_MEMBER_MAGIC)
+        while i != -1 and i < window_size:
+            if is_gzip_member_start(window[i:i + GZIP_MEMBER_PROBE_SIZE]):
+                return window_start + i
+            i = window.find(GZIP_MEMBER_MAGIC, i + 1)
+        window_start += window_size
+    return None
+
+def decompress_gzip_members(task):
+    # Runs inside a worker process. Decompresses the byte range [start_offset,end_offset) of a gzip file, which must
+    # consist of complete gzip members
+    import zlib
+    try:
+        with open(task['filename'], 'rb') as f:
+            f.seek(task['start_offset'])
+            data = f.read(task['end_offset'] - task['start_offset'])
+        blocks = []
+        while len(data) > 0:
+            d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            blocks.append(d.decompress(data))
+            if not d.eof:
+                raise Exception('Last member ends after the end of the part')
+            data = d.unused_data
+        return {'data': six.b('').join(blocks), 'error': None}
+    except Exception as e:
+        return {'data': None, 'error': '%s: %s' % (type(e).__name__, str(e))}
+
+class ParallelGzipDecompressor(object):
+    # Decompresses multi-member gzip files (e.g. concatenated gzip files or BGZF files) using worker processes. The
+    # file is split into parts at member boundaries, and the decompressed parts are provided in their original order.
+    # Member boundaries are only guessed by searching for member headers, but a part is used only if it decompresses
+    # into complete members which end exactly at its end. Otherwise the rest of the file is decompressed serially
+    def __init__(self, filename, worker_count, part_size):
+        self.filename = filename
+        self.worker_count = worker_count
+        self.part_size = part_size
+        self.part_offsets = None
+
+    @staticmethod
+    def create(filename, worker_count, part_size=None):
+        # Returns None when the file cannot be split into more than one part (e.g. it has a single member)
+        d = ParallelGzipDecompressor(filename, worker_count, part_size if part_size is not None else PARALLEL_GZIP_PART_SIZE)
+        d.part_offsets = d._find_part_offsets()
+        if len(d.part_offsets) < 3:
+            return None
+        return d
+
+    def _find_part_offsets(self):
+        file_size = os.stat(self.filename).st_size
+        offsets = [0]
+        with open(self.filename, 'rb') as f:
+            if f.read(3) != GZIP_MEMBER_MAGIC:
+                return [0, file_size]
+            offset = self.part_size
+            while offset < file_size - self.part_size // 2:
+                # The rest of the file is searched, since members might be larger than the part size
+                member_start = find_gzip_member_start(f, offset, file_size)
+                if member_start is None:
+                    break
+                offsets.append(member_start)
+                offset = member_start + self.part_size
+        offsets.append(file_size)
+        return offsets
+
+    def _generate_serially_decompressed_blocks(self, start_offset):
+        import gzip
+        with open(self.filename, 'rb') as f:
+            f.seek(start_offset)
+            with gzip.GzipFile(fileobj=f, mode='rb') as gz_f:
+                while True:
+                    block = gz_f.read(self.part_size)
+                    if len(block) == 0:
+                        return
+                    yield block
+
+    def generate_blocks(self):
+        import concurrent.futures
+        tasks = [{'filename': self.filename, 'start_offset': s, 'end_offset': e} for s, e in zip(self.part_offsets[:-1], self.part_offsets[1:])]
+        iprint("Decompressing %s in parallel: %s parts using %s workers" % (self.filename, len(tasks), self.worker_count))
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.worker_count)
+        try:
+            # Only a bounded number of decompressed parts is kept in memory
+            pending = []
+            next_task_index = 0
+            for task in tasks:
+                while next_task_index < len(tasks) and len(pending) <= self.worker_count:
+                    pending.append(executor.submit(decompress_gzip_members, tasks[next_task_index]))
+                    next_task_index += 1
+                result = pending.pop(0).result()
+                if result['error'] is not None:
+                    # Previous parts ended with complete members, so this part starts at a member boundary
+                    xprint("Decompressing the rest of %s serially, starting at offset %s. %s" % (self.filename, task['start_offset'], result['error']))
+                    for block in self._generate_serially_decompressed_blocks(task['start_offset']):
+                        yield block
+                    return
+                yield result['data']
+        finally:
+            # Parts which have not started yet are not decompressed (shutdown(cancel_futures=True) requires python 3.9)
+            for f in pending:
+                f.cancel()
+            executor.shutdown(wait=True)
+
+GZIP_INDEX_SPAN = 8 * 1024 * 1024
+GZIP_INDEX_WINDOW_SIZE = 32 * 1024
+GZIP_INDEX_INPUT_BLOCK_SIZE = 256 * 1024
+GZIP_INDEX_FILENAME_SUFFIX = '.qgzidx'
+GZIP_INDEX_VERSION = 1
+
+ZLIB_Z_OK = 0
+ZLIB_Z_STREAM_END = 1
+ZLIB_Z_NEED_DICT = 2
+ZLIB_Z_BUF_ERROR = -5
+ZLIB_Z_NO_FLUSH = 0
+ZLIB_Z_BLOCK = 5
+
+zlib_library = None
+
+def get_zlib_library():
+    # Gzip indices use zlib's inflate directly (through ctypes), since the zlib module can neither stop at deflate
+    # block boundaries nor start decompressing in the middle of a byte. Returns None when zlib cannot be loaded
+    global zlib_library
+    if zlib_library is None:
+        try:
+            import ctypes
+            import ctypes.util
+
+            class ZStream(ctypes.Structure):
+                _fields_ = [('next_in', ctypes.c_void_p), ('avail_in', ctypes.c_uint), ('total_in', ctypes.c_ulong),
+                            ('next_out', ctypes.c_void_p), ('avail_out', ctypes.c_uint), ('total_out', ctypes.c_ulong),
+                            ('msg', ctypes.c_char_p), ('state', ctypes.c_void_p),
+                            ('zalloc', ctypes.c_void_p), ('zfree', ctypes.c_void_p), ('opaque', ctypes.c_void_p),
+                            ('data_type', ctypes.c_int), ('adler', ctypes.c_ulong), ('reserved', ctypes.c_ulong)]
+
+            lib = ctypes.CDLL(ctypes.util.find_library('z') or 'libz.so.1')
+            lib.zlibVersion.restype = ctypes.c_char_p
+            lib.inflateInit2_.argtypes = [ctypes.POINTER(ZStream), ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
+            lib.inflate.argtypes = [ctypes.POINTER(ZStream), ctypes.c_int]
+            lib.inflatePrime.argtypes = [ctypes.POINTER(ZStream), ctypes.c_int, ctypes.c_int]
+            lib.inflateSetDictionary.argtypes = [ctypes.POINTER(ZStream), ctypes.c_char_p, ctypes.c_uint]
+            lib.inflateEnd.argtypes = [ctypes.POINTER(ZStream)]
+            lib.z_stream_type = ZStream
+            zlib_library = lib
+        except (ImportError, OSError, AttributeError) as e:
+            xprint("Could not load zlib, gzip indices are disabled: %s" % str(e))
+            zlib_library = False
+    return zlib_library or None
+
+class ZlibInflateStream(object):
+    # A zlib inflate stream. window_bits is 47 for gzip data and -15 for raw deflate data
+    def __init__(self, window_bits, output_buffer_size):
+        import ctypes
+        self.ctypes = ctypes
+        self.lib = get_zlib_library()
+        self.strm = self.lib.z_stream_type()
+        self.input_data = None
+        self.output_buffer = ctypes.create_string_buffer(output_buffer_size)
+        self.output_buffer_size = output_buffer_size
+        self._check(self.lib.inflateInit2_(ctypes.byref(self.strm), window_bits, self.lib.zlibVersion(), ctypes.sizeof(self.strm)))
+
+    def _check(self, ret):
+        if ret < 0 and ret != ZLIB_Z_BUF_ERROR:
+            import zlib
+            raise zlib.error('Error %s while decompressing data: %s' % (ret, self.strm.msg))
+        return ret
+
+    def set_input(self, data):
+        # The data is kept referenced while zlib reads it
+        self.input_data = data
+        self.strm.next_in = self.ctypes.cast(self.ctypes.c_char_p(data), self.ctypes.c_void_p).value
+        self.strm.avail_in = len(data)
+
+    def prime(self, bits, value):
+        self._check(self.lib.inflatePrime(self.ctypes.byref(self.strm), bits, value))
+
+    def set_dictionary(self, window):
+        self._check(self.lib.inflateSetDictionary(self.ctypes.byref(self.strm), window, len(window)))
+
+    def inflate(self, flush):
+        # Writes into the output buffer, starting at its first free byte (reset when it is full). Returns the zlib
+        # return code and the new output
+        if self.strm.avail_out == 0:
+            self.strm.next_out = self.ctypes.addressof(self.output_buffer)
+            self.strm.avail_out = self.output_buffer_size
+        output_start = self.output_buffer_size - self.strm.avail_out
+        ret = self._check(self.lib.inflate(self.ctypes.byref(self.strm), flush))
+        output_end = self.output_buffer_size - self.strm.avail_out
+        return ret, self.output_buffer.raw[output_start:output_end] if output_end > output_start else six.b('')
+
+    def get_window(self, size):
+        # The last size bytes of output, when the output buffer is used as a circular window
+        used = self.output_buffer_size - self.strm.avail_out
+        raw = self.output_buffer.raw
+        return (raw[used:] + raw[:used])[-size:] if size > 0 else six.b('')
+
+    def close(self):
+        if self.strm is not None:
+            self.lib.inflateEnd(self.ctypes.byref(self.strm))
+            self.strm = None
+
+class GzipIndex(object):
+    # An access point index of a single member gzip file, like the one in zlib's zran example. Each access point is
+    # the position of a deflate block in the compressed and uncompressed data, along with the 32KB of uncompressed
+    # data preceding it, so decompression can start at the access point. Stored in a sidecar file next to the gzip
+    # file, and used only while the gzip file's size and modification time are unchanged
+    def __init__(self, file_size, mtime_ns, uncompressed_size, points):
+        self.file_size = file_size
+        self.mtime_ns = mtime_ns
+        self.uncompressed_size = uncompressed_size
+        # dicts of out_offset, in_offset, bits and window, ordered by offset
+        self.points = points
+
+    @staticmethod
+    def get_index_filename(filename):
+        return filename + GZIP_INDEX_FILENAME_SUFFIX
+
+    def save(self, filename):
+        import base64
+        import zlib
+        index_filename = GzipIndex.get_index_filename(filename)
+        d = {
+            'version': GZIP_INDEX_VERSION,
+            'file_size': self.file_size,
+            'mtime_ns': self.mtime_ns,
+            'uncompressed_size': self.uncompressed_size,
+            'points': [[p['out_offset'], p['in_offset'], p['bits'], base64.b64encode(zlib.compress(p['window'])).decode('ascii')] for p in self.points]
+        }
+        tmp_filename = '%s.%s.tmp' % (index_filename, os.getpid())
+        with io.open(tmp_filename, 'w', encoding='ascii') as f:
+            json.dump(d, f)
+        os.replace(tmp_filename, index_filename)
+        xprint("Saved gzip index %s with %s access points" % (index_filename, len(self.points)))
+
+    @staticmethod
+    def load(filename):
+        # Returns None when there is no valid index for the file
+        import base64
+        import zlib
+        index_filename = GzipIndex.get_index_filename(filename)
+        if not os.path.isfile(index_filename) or get_zlib_library() is None:
+            return None
+        try:
+            with io.open(index_filename, 'r', encoding='ascii') as f:
+                d = json.load(f)
+            st = os.stat(filename)
+            if d['version'] != GZIP_INDEX_VERSION or d['file_size'] != st.st_size or d['mtime_ns'] != st.st_mtime_ns:
+                xprint("Ignoring stale gzip index %s" % index_filename)
+                return None
+            points = [{'out_offset': out_offset, 'in_offset': in_offset, 'bits': bits, 'window': zlib.decompress(base64.b64decode(window))}
+                      for out_offset, in_offset, bits, window in d['points']]
+            return GzipIndex(d['file_size'], d['mtime_ns'], d['uncompressed_size'], points)
+        except (ValueError, KeyError, TypeError, zlib.error) as e:
+            xprint("Ignoring invalid gzip index %s: %s" % (index_filename, str(e)))
+            return None
+
+class GzipIndexBuilder(object):
+    # A binary stream of the decompressed data of a gzip file, which builds and saves the file's index while being
+    # read. An access point is added every span bytes of output. Multi member files are not indexed
+    def __init__(self, filename, span=None):
+        self.filename = filename
+        self.span = span if span is not None else GZIP_INDEX_SPAN
+        self.f = io.open(filename, 'rb')
+        st = os.fstat(self.f.fileno())
+        self.file_size = st.st_size
+        self.mtime_ns = st.st_mtime_ns
+        self.points = []
+        self.gzip_index = None
+        self.output = self._generate_output()
+        self.pending = six.b('')
+
+    def _generate_output(self):
+        inflater = ZlibInflateStream(47, GZIP_INDEX_WINDOW_SIZE)
+        try:
+            total_in = 0
+            total_out = 0
+            last_point_out = 0
+            input_ended = False
+            while True:
+                if inflater.strm.avail_in == 0 and not input_ended:
+                    data = self.f.read(GZIP_INDEX_INPUT_BLOCK_SIZE)
+                    input_ended = len(data) == 0
+                    inflater.set_input(data)
+                avail_in = inflater.strm.avail_in
+                ret, output = inflater.inflate(ZLIB_Z_BLOCK)
+                total_in += avail_in - inflater.strm.avail_in
+                total_out += len(output)
+                if len(output) > 0:
+                    yield output
+                if ret == ZLIB_Z_STREAM_END:
+                    break
+                if ret == ZLIB_Z_NEED_DICT or (ret == ZLIB_Z_BUF_ERROR and input_ended):
+                    raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+                # Bit 7 marks the end of a deflate block, and bit 6 marks the last block
+                data_type = inflater.strm.data_type
+                if data_type & 128 and not data_type & 64 and (total_out == 0 or total_out - last_point_out > self.span):
+                    self.points.append({'out_offset': total_out, 'in_offset': total_in, 'bits': data_type & 7,
+                                        'window': inflater.get_window(min(total_out, GZIP_INDEX_WINDOW_SIZE))})
+                    last_point_out = total_out
+        finally:
+            inflater.close()
+
+        self.f.seek(total_in)
+        if len(self.f.read(1)) == 0:
+            self.gzip_index = GzipIndex(self.file_size, self.mtime_ns, total_out, self.points)
+            self.gzip_index.save(self.filename)
+            return
+
+        xprint("Not indexing %s, since it has more than one member" % self.filename)
+        import gzip
+        self.f.seek(total_in)
+        with gzip.GzipFile(fileobj=self.f, mode='rb') as gz_f:
+            while True:
+                block = gz_f.read(GZIP_INDEX_INPUT_BLOCK_SIZE)
+                if len(block) == 0:
+                    return
+                yield block
+
+    def read(self, size=-1):
+        chunks = [self.pending]
+        available = len(self.pending)
+        for output in self.output:
+            chunks.append(output)
+            available += len(output)
+            if size >= 0 and available >= size:
+                break
+        data = six.b('').join(chunks)
+        if size < 0:
+            self.pending = six.b('')
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
+    def close(self):
+        self.output.close()
+        self.f.close()
+
+def generate_gzip_index_point_blocks(filename, point, block_size=GZIP_INDEX_INPUT_BLOCK_SIZE):
+    # Generates the decompressed data of an indexed gzip file, starting at the access point
+    inflater = ZlibInflateStream(-15, block_size)
+    try:
+        with io.open(filename, 'rb') as f:
+            if point['bits'] > 0:
+                f.seek(point['in_offset'] - 1)
+                inflater.prime(point['bits'], six.indexbytes(f.read(1), 0) >> (8 - point['bits']))
+            else:
+                f.seek(point['in_offset'])
+            if len(point['window']) > 0:
+                inflater.set_dictionary(point['window'])
+            input_ended = False
+            while True:
+                if inflater.strm.avail_in == 0 and not input_ended:
+                    data = f.read(block_size)
+                    input_ended = len(data) == 0
+                    inflater.set_input(data)
+                ret, output = inflater.inflate(ZLIB_Z_NO_FLUSH)
+                if len(output) > 0:
+                    yield output
+                if ret == ZLIB_Z_STREAM_END:
+                    return
+                if ret == ZLIB_Z_BUF_ERROR and input_ended:
+                    raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+    finally:
+        inflater.close()
+
+def read_gzip_index_region(filename, point, end_offset):
+    # Returns the lines of an indexed gzip file which start in the range [out_offset of the point, end_offset), or
+    # until the end of the file when end_offset is None. The line which contains the point belongs to the previous
+    # region, unless it starts at the point
+    position = point['out_offset']
+    skipping_partial_line = position > 0 and point['window'][-1:] != six.b('\n')
+    chunks = []
+    blocks = generate_gzip_index_point_blocks(filename, point)
+    try:
+        for block in blocks:
+            if skipping_partial_line:
+                i = block.find(six.b('\n'))
+                if i == -1:
+                    position += len(block)
+                    continue
+                block = block[i + 1:]
+                position += i + 1
+                skipping_partial_line = False
+                if end_offset is not None and position >= end_offset:
+                    return six.b('')
+            if end_offset is not None and position + len(block) >= end_offset:
+                i = block.find(six.b('\n'), max(0, end_offset - 1 - position))
+                if i != -1:
+                    chunks.append(block[:i + 1])
+                    break
+            chunks.append(block)
+            position += len(block)
+    finally:
+        blocks.close()
+    return six.b('').join(chunks)
+
+class ParallelDelimitedFileLoader(object):
+    CHUNK_TABLE_NAME = 'parallel_load_chunk'
+    CHUNK_DB_ID = 'parallel_load_chunk_db'
+
+    def __init__(self, worker_count, input_params, dialect_id):
+        self.worker_count = worker_count
+        self.input_params = input_params
+        self.dialect_id = dialect_id
+        self.dialect_params = get_dialect_params(dialect_id)
+
+    def _get_ineligibility_reason(self, table_creator):
+        atomic_fns = table_creator.delimited_file_reader.atomic_fns
+        if atomic_fns is None or len(atomic_fns) == 0:
+            return 'data streams cannot be loaded in parallel'
+        if is_range_read(self.input_params):
+            return 'a range of the file is read'
+        if self.input_params.with_universal_newlines:
+            return 'universal newlines are used'
+        if not table_creator.table_created or table_creator.column_inferer.get_column_count() == 0:
+            return 'table has no columns'
+        if table_creator.sample is not None:
+            return 'rows are sampled'
+        if table_creator.row_limit is not None:
+            return 'only the first rows are needed'
+        if table_creator.count_only:
+            return 'rows are only counted'
+        if table_creator.streaming_query_executor is not None:
+            return 'query results are streamed'
+        if table_creator.top_n_collector is not None:
+            return 'only the top rows are needed'
+        return None
+
+    def _split_indexed_gzip_file_part(self, filename, skip_records, header_expected, target_chunk_size):
+        # Gzip files with an index are split at its access points, at least target_chunk_size compressed bytes apart.
+        # Offsets are of the uncompressed data, and workers align them to lines. Workers fall back to a serial load
+        # when a newline might not be a record boundary
+        if not is_ascii_compatible_encoding(self.input_params.input_encoding) or get_file_compression(filename, self.input_params) != 'gzip':
+            return None
+        gzip_index = GzipIndex.load(filename)
+        if gzip_index is None:
+            return None
+
+        points = []
+        for point in gzip_index.points:
+            if len(points) == 0 or point['in_offset'] - points[-1]['in_offset'] >= target_chunk_size:
+                points.append(point)
+        if len(points) < 2:
+            return None
+
+        end_offsets = [point['out_offset'] for point in points[1:]] + [None]
+        # Records which have been read during analysis are skipped by the first part
+        return [(filename, point['out_offset'], end_offset, skip_records if i == 0 else 0, header_expected and i == 0, point)
+                for i, (point, end_offset) in enumerate(zip(points, end_offsets))]
+
+    def _split_file_part(self, filename, skip_records, header_expected, target_chunk_size):
+        if not is_byte_scannable_file(filename, self.input_params):
+            indexed_gzip_parts = self._split_indexed_gzip_file_part(filename, skip_records, header_expected, target_chunk_size)
+            if indexed_gzip_parts is not None:
+                return indexed_gzip_parts
+            return [(filename, None, None, skip_records, header_expected, None)]
+
+        file_size = os.stat(filename).st_size
+        if file_size < 2 * target_chunk_size:
+            return [(filename, None, None, skip_records, header_expected, None)]
+
+        record_offset_index = RecordOffsetIndex.load(filename, self.input_params, self.dialect_params)
+        if record_offset_index is not None:
+            # Indexed offsets are record boundaries, so the file does not need to be scanned. Records which have been
+            # read during analysis are skipped by the first chunk
+            boundaries = [0]
+            for offset in record_offset_index.offsets[1:]:
+                if offset - boundaries[-1] >= target_chunk_size and file_size - offset >= target_chunk_size // 2:
+                    boundaries.append(offset)
+            boundaries.append(file_size)
+            return [(filename, s, e, skip_records if i == 0 else 0, header_expected and i == 0, None)
+                    for i, (s, e) in enumerate(zip(boundaries[:-1], boundaries[1:]))]
+
+        scanner = RecordBoundaryScanner(filename, self.dialect_params)
+        scanner.detect_special_bytes()
+        if scanner.has_lone_carriage_returns:
+            return [(filename, None, None, skip_records, header_expected, None)]
+
+        start_offset = scanner.record_start_offset(skip_records)
+        chunk_count = max(1, int(math.ceil((file_size - start_offset) / target_chunk_size)))
+        ranges = scanner.chunk_ranges(start_offset, chunk_count)
+        # Only the first chunk of a file can contain its header
+        return [(filename, s, e, 0, header_expected and i == 0, None) for i, (s, e) in enumerate(ranges)]
+
+    def load(self, table_creator):
+        reason = self._get_ineligibility_reason(table_creator)
+        if reason is not None:
+            xprint("Not loading in parallel: %s" % reason)
+            return False
+
+        parts = table_creator.delimited_file_reader.get_unread_file_parts()
+        total_size = sum([os.stat(fn).st_size for fn, _, _ in parts])
+        target_chunk_size = max(PARALLEL_LOAD_MIN_CHUNK_SIZE, min(PARALLEL_LOAD_MAX_CHUNK_SIZE, total_size // self.worker_count))
+
+        try:
+            file_parts = []
+            for filename, skip_records, header_expected in parts:
+                file_parts += self._split_file_part(filename, skip_records, header_expected, target_chunk_size)
+        except csv.Error as e:
+            xprint("Not loading in parallel: Could not scan record boundaries: %s" % str(e))
+            return False
+
+        if len(file_parts) < 2:
+            xprint("Not loading in parallel: Not enough data for more than one worker")
+            return False
+
+        iprint("Loading %s in parallel: %s parts using %s workers" % (",".join([p[0] for p in parts]), len(file_parts), self.worker_count))
+        return self._load_file_parts(table_creator, file_parts)
+
+    def _create_tasks(self, table_creator, file_parts, temp_folder):
+        sqlite_db = table_creator.sqlite_db
+        table_creator.initialize_numeric_column_indices_if_needed()
+        column_names = table_creator.get_table_column_names()
+        column_count = table_creator.column_inferer.get_column_count()
+
+        create_table_stmt = sqlite_db.generate_create_table(self.CHUNK_TABLE_NAME, column_names,
+                                                           table_creator.get_table_column_dict())
+        insert_row_stmt = sqlite_db.generate_insert_row(self.CHUNK_TABLE_NAME, column_names)
+
+        tasks = []
+        for i, (filename, start_offset, end_offset, skip_records, header_expected, gzip_index_point) in enumerate(file_parts):
+            tasks.append({
+                'filename': filename,
+                'start_offset': start_offset,
+                'end_offset': end_offset,
+                'gzip_index_point': gzip_index_point,
+                'skip_records': skip_records,
+                'header_expected': header_expected,
+                'compression': get_file_compression(filename, self.input_params),
+                'encoding': self.input_params.input_encoding,
+                'dialect_params': self.dialect_params,
+                'max_column_length_limit': self.input_params.max_column_length_limit,
+                'mode': table_creator.mode,
+                'column_count': column_count,
+                'numeric_column_indices': table_creator.numeric_column_indices,
+                'projected_column_indices': table_creator.projected_column_indices,
+                'row_filter': table_creator.row_filter,
+                'input_delimiter': table_creator.input_delimiter,
+                'create_table_stmt': create_table_stmt,
+                'insert_row_stmt': insert_row_stmt,
+                'db_filename': os.path.join(temp_folder, 'part_%s.sqlite' % i)
+            })
+        return tasks
+
+    def _validate_result(self, table_creator, task, result):
+        if result['error'] is not None:
+            return 'Part %s of %s (%s-%s): %s' % (task['db_filename'], task['filename'], task['start_offset'], task['end_offset'], result['error'])
+        if result['header'] is not None:
+            header_row = table_creator.column_inferer.header_row
+            if header_row is None or tuple(header_row) != tuple(result['header']):
+                # The serial load will raise the proper BadHeaderException
+                return 'Extra header of file %s mismatches original header' % task['filename']
+        return None
+
+    def _load_file_parts(self, table_creator, file_parts):
+        import concurrent.futures
+        import tempfile
+        import shutil
+
+        sqlite_db = table_creator.sqlite_db
+        target_table_name = table_creator.target_sqlite_table_name
+
+        table_creator._flush_inserts()
+        sqlite_db.conn.commit()
+        max_rowid_before_load = sqlite_db.execute_and_fetch('SELECT max(rowid) FROM %s' % target_table_name).results[0][0]
+
+        temp_folder = tempfile.mkdtemp(prefix='q-parallel-load-')
+        total_record_count = 0
+        error = None
+        try:
+            tasks = self._create_tasks(table_creator, file_parts, temp_folder)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.worker_count) as executor:
+                futures = [executor.submit(load_delimited_file_part_into_sqlite, task) for task in tasks]
+                # Parts are copied in their original order as soon as each one of them is ready
+                for task, future in zip(tasks, futures):
+                    result = future.result()
+                    error = self._validate_result(table_creator, task, result)
+                    if error is not None:
+                        # Parts which have not started yet are not loaded (shutdown(cancel_futures=True) requires python 3.9)
+                        for f in futures:
+                            f.cancel()
+                        break
+                    self._copy_part_into_table(sqlite_db, task['db_filename'], target_table_name)
+                    os.remove(task['db_filename'])
+                    total_record_count += result['record_count']
+        except concurrent.futures.BrokenExecutor as e:
+            error = 'Worker pool failed: %s' % str(e)
+        finally:
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+        if error is not None:
+            # Records which have not been read during analysis are still available to the serial reader
+            xprint("Parallel load failed, falling back to a serial load. %s" % error)
+            if max_rowid_before_load is None:
+                sqlite_db.execute_and_fetch('DELETE FROM %s' % target_table_name)
+            else:
+                sqlite_db.execute_and_fetch('DELETE FROM %s WHERE rowid > ?' % target_table_name, (max_rowid_before_load,))
+            sqlite_db.conn.commit()
+            return False
+
+        table_creator.delimited_file_reader.lines_read += total_record_count
+        sqlite_db.conn.commit()
+        iprint("Parallel load completed. %s records have been loaded" % total_record_count)
+        return True
+
+    def _copy_part_into_table(self, sqlite_db, part_db_filename, target_table_name):
+        sqlite_db.conn.commit()
+        sqlite_db.execute_and_fetch("ATTACH ? AS %s" % self.CHUNK_DB_ID, (part_db_filename,))
+        try:
+            sqlite_db.execute_and_fetch('INSERT INTO %s SELECT * FROM %s.%s' % (target_table_name, self.CHUNK_DB_ID, self.CHUNK_TABLE_NAME))
+            sqlite_db.conn.commit()
+        finally:
+            sqlite_db.execute_and_fetch('DETACH DATABASE %s' % self.CHUNK_DB_ID)
+
+class DelimitedFileRecordCounter(object):
+    # Counts the records of the files of a table which have not been read during analysis, without parsing them.
+    # Only files in which every newline is a record boundary are counted this way (no quote, escape, NUL or lone
+    # carriage return bytes, and no line longer than the column length limit). In all other cases the counting is
+    # done by the regular parsing code, so errors and edge cases are exactly the same
+    def __init__(self, input_params, dialect_id):
+        self.input_params = input_params
+        self.dialect_params = get_dialect_params(dialect_id)
+        self.special_bytes = get_dialect_special_bytes(self.dialect_params) + [b'\x00']
+
+    def _get_ineligibility_reason(self, table_creator):
+        delimited_file_reader = table_creator.delimited_file_reader
+        if delimited_file_reader.atomic_fns is None or len(delimited_file_reader.atomic_fns) == 0:
+            return 'data streams cannot be scanned'
+        if is_range_read(self.input_params):
+            return 'a range of the file is read'
+        if self.input_params.with_universal_newlines:
+            return 'universal newlines are used'
+        if table_creator.mode == 'strict':
+            return 'strict mode requires parsing all records'
+        if not table_creator.table_created or delimited_file_reader.current_file_name is None:
+            return 'table has not been created'
+        return None
 
-        xprint("XX Opening file %s" % ",".join(self.atomic_fns))
-        import fileinput
+    def count(self, table_creator):
+        reason = self._get_ineligibility_reason(table_creator)
+        if reason is not None:
+            xprint("Not counting records by scanning: %s" % reason)
+            return False
 
-        def q_openhook(filename, mode):
-            if self.input_params.gzipped_input or filename.endswith('.gz'):
-                import gzip
-                f = gzip.open(filename,mode='rt',encoding=self.input_params.input_encoding)
-            else:
-                if six.PY3:
-                    if self.input_params.with_universal_newlines:
-                        f = io.open(filename, 'rU', newline=None, encoding=self.input_params.input_encoding)
-                    else:
-                        f = io.open(filename, 'r', newline=None, encoding=self.input_params.input_encoding)
-                else:
-                    if self.input_params.with_universal_newlines:
-                        file_opening_mode = 'rbU'
-                    else:
-                        file_opening_mode = 'rb'
-                    f = open(filename, file_opening_mode)
+        delimited_file_reader = table_creator.delimited_file_reader
+        header_row = table_creator.column_inferer.header_row
+        record_count = 0
+        data_record_count = 0
+        for filename, skip_records, header_expected in delimited_file_reader.get_unread_file_parts():
+            if not is_byte_scannable_file(filename, self.input_params):
+                xprint("Not counting records by scanning: %s cannot be scanned" % filename)
+                return False
+            file_record_count = self._get_indexed_record_count(filename, header_row if header_expected else None)
+            if file_record_count is None:
+                file_record_count = self._count_file_records(filename, header_row if header_expected else None)
+            if file_record_count is None:
+                return False
+            file_record_count -= skip_records
+            record_count += file_record_count
+            data_record_count += file_record_count - (1 if header_expected and file_record_count > 0 else 0)
+
+        delimited_file_reader.lines_read += record_count
+        table_creator.record_count += data_record_count
+        iprint("Counted %s records by scanning" % data_record_count)
+        return True
 
-            if self.input_params.input_encoding == 'utf-8-sig' and not self.skipped_bom:
-                skip_BOM(f)
+    def _get_indexed_record_count(self, filename, expected_header_row):
+        # Returns the record count of the file's record index, or None if there is no valid index
+        record_offset_index = RecordOffsetIndex.load(filename, self.input_params, self.dialect_params)
+        if record_offset_index is None:
+            return None
+        if expected_header_row is not None and record_offset_index.record_count > 0:
+            with io.open(filename, 'r', newline=None, encoding=self.input_params.input_encoding) as f:
+                first_record = next(csv.reader(f, **self.dialect_params), [])
+            if tuple(first_record) != tuple(expected_header_row):
+                return None
+        xprint("Using the record count of the record index of %s" % filename)
+        return record_offset_index.record_count
+
+    def _is_header_matching(self, first_line, header_row):
+        if header_row is None:
+            return False
+        try:
+            decoded_line = first_line.decode(self.input_params.input_encoding)
+        except UnicodeDecodeError:
+            return False
+        col_vals = next(csv.reader([decoded_line], **self.dialect_params), [])
+        return tuple(col_vals) == tuple(header_row)
 
-            return f
+    def _are_lines_countable(self, lines):
+        if any(b in lines for b in self.special_bytes):
+            return False
+        if lines.count(b'\r') != lines.count(b'\r\n'):
+            return False
+        return max(map(len, lines.split(b'\n'))) <= self.input_params.max_column_length_limit
+
+    def _count_file_records(self, filename, expected_header_row):
+        # Returns the number of records in the file, or None if they cannot be counted without parsing
+        decoder = codecs.getincrementaldecoder(self.input_params.input_encoding)()
+        record_count = 0
+        tail = b''
+        with open(filename, 'rb') as f:
+            while True:
+                block = f.read(RECORD_SCAN_BLOCK_SIZE)
+                if not block:
+                    break
+                data = tail + block
+                last_newline_pos = data.rfind(b'\n')
+                if last_newline_pos == -1:
+                    tail = data
+                    if len(tail) > self.input_params.max_column_length_limit:
+                        return None
+                    continue
+                lines, tail = data[:last_newline_pos + 1], data[last_newline_pos + 1:]
+                if not self._are_lines_countable(lines):
+                    xprint("Records of %s cannot be counted by scanning" % filename)
+                    return None
+                if record_count == 0 and expected_header_row is not None:
+                    if not self._is_header_matching(lines[:lines.find(b'\n') + 1], expected_header_row):
+                        return None
+                try:
+                    decoder.decode(lines)
+                except UnicodeDecodeError:
+                    return None
+                record_count += lines.count(b'\n')
+
+        if len(tail) > 0:
+            if not self._are_lines_countable(tail):
+                return None
+            if record_count == 0 and expected_header_row is not None and not self._is_header_matching(tail, expected_header_row):
+                return None
+            record_count += 1
+        try:
+            decoder.decode(tail, final=True)
+        except UnicodeDecodeError:
+            return None
+        return record_count
 
-        f = fileinput.input(self.atomic_fns,mode='rb',openhook=q_openhook)
 
-        self.f = f
-        self.is_open = True
-        xprint("Actually opened file %s" % self.f)
-        return f
+SAMPLE_PILOT_SIZE = 64 * 1024
+SAMPLE_PROBE_WINDOW_SIZE = 16 * 1024
 
-    def close_file(self):
-        if not self.is_open:
-            # TODO Convert to assertion
-            raise Exception("Bug - file should already be open: %s" % ",".join(self.atomic_fns))
+class SeekingRowSampler(object):
+    # Samples the records of an uncompressed file by seeking to random positions, so only the sampled records are
+    # read. With a record index (see RecordOffsetIndex), records are chosen exactly uniformly by their number and
+    # parsed from the preceding indexed offset. Otherwise random offsets are aligned to lines, and each line is accepted
+    # with a probability inversely proportional to its length, so long lines are not favoured. Newlines have to be
+    # record boundaries for that, so the file is read fully instead if a quote or escape character (or a lone carriage
+    # return) is found around any sampled line, or when the sample is too large for seeking to pay off
+    def __init__(self, input_params, dialect_id):
+        self.input_params = input_params
+        self.dialect_params = get_dialect_params(dialect_id)
+        self.special_bytes = get_dialect_special_bytes(self.dialect_params)
+
+        # Set after sampling
+        self.method = None
+        self.population_size = None
+        self.is_population_size_estimated = False
+
+    def _get_ineligibility_reason(self, table_creator):
+        atomic_fns = table_creator.delimited_file_reader.atomic_fns
+        if atomic_fns is None or len(atomic_fns) == 0:
+            return 'data streams cannot be seeked'
+        if len(atomic_fns) > 1:
+            return 'table has multiple files'
+        if is_range_read(self.input_params):
+            return 'a range of the file is read'
+        if self.input_params.with_universal_newlines:
+            return 'universal newlines are used'
+        if not table_creator.table_created:
+            return 'table has not been created'
+        if not is_byte_scannable_file(atomic_fns[0], self.input_params):
+            return 'file cannot be seeked'
+        return None
 
-        self.f.close()
-        xprint("XX Closed file %s" % ",".join(self.atomic_fns))
+    def get_planned_method(self, table_creator):
+        if self._get_ineligibility_reason(table_creator) is not None:
+            return 'reading all rows'
+        if RecordOffsetIndex.load(table_creator.delimited_file_reader.atomic_fns[0], self.input_params, self.dialect_params) is not None:
+            return 'random seeks using the record index'
+        return 'random seeks if possible'
+
+    def sample(self, table_creator):
+        # Returns the sampled rows in their original order, or None if the file needs to be read fully instead
+        reason = self._get_ineligibility_reason(table_creator)
+        if reason is not None:
+            xprint("Not sampling by seeking: %s" % reason)
+            return None
+
+        return self.sample_file(table_creator.delimited_file_reader.atomic_fns[0], table_creator.skip_header,
+                                table_creator.sample, table_creator.random_generator)
+
+    def sample_file(self, filename, skip_header, sample, random_generator):
+        record_offset_index = RecordOffsetIndex.load(filename, self.input_params, self.dialect_params)
+        if record_offset_index is not None:
+            return self._sample_indexed_records(filename, record_offset_index, skip_header, sample, random_generator)
+        return self._sample_lines(filename, skip_header, sample, random_generator)
+
+    def _get_sample_size(self, sample, population_size):
+        if isinstance(sample, float):
+            return int(round(sample * population_size))
+        return min(sample, population_size)
+
+    def _sample_indexed_records(self, filename, record_offset_index, skip_header, sample, random_generator):
+        first_record_number = 1 if skip_header else 0
+        population_size = max(0, record_offset_index.record_count - first_record_number)
+        sample_size = self._get_sample_size(sample, population_size)
+        record_numbers = sorted(random_generator.sample(range(first_record_number, record_offset_index.record_count), sample_size))
+
+        rows = []
+        interval = record_offset_index.interval
+        with open(filename, 'rb') as f:
+            for block_number, block_record_numbers in itertools.groupby(record_numbers, lambda n: n // interval):
+                block_record_numbers = set(block_record_numbers)
+                last_record_number = max(block_record_numbers)
+                f.seek(record_offset_index.offsets[block_number])
+                # The index is built only for files without lone carriage returns, so lines are split on newlines
+                lines = (line.decode(self.input_params.input_encoding) for line in f)
+                for record_number, col_vals in enumerate(csv.reader(lines, **self.dialect_params), block_number * interval):
+                    if record_number in block_record_numbers:
+                        rows.append(col_vals)
+                    if record_number == last_record_number:
+                        break
+
+        self.method = 'random seeks using the record index'
+        self.population_size = population_size
+        xprint("Sampled %s records of %s using its record index" % (len(rows), filename))
+        return rows
+
+    def _are_newlines_record_boundaries(self, data):
+        if any(b in data for b in self.special_bytes):
+            return False
+        # A window might end in the middle of a CRLF
+        return data.count(b'\r') - data.count(b'\r\n') == (1 if data.endswith(b'\r') else 0)
+
+    def _sample_lines(self, filename, skip_header, sample, random_generator):
+        file_size = os.stat(filename).st_size
+        with open(filename, 'rb') as f:
+            pilot = f.read(SAMPLE_PILOT_SIZE)
+            if not self._are_newlines_record_boundaries(pilot):
+                xprint("Not sampling %s by seeking: newlines might not be record boundaries" % filename)
+                return None
+            data_start_offset = pilot.find(b'\n') + 1 if skip_header else 0
+            pilot_lines = pilot[data_start_offset:]
+            if len(pilot) < file_size:
+                pilot_lines = pilot_lines[:pilot_lines.rfind(b'\n') + 1]
+            line_lengths = [len(line) for line in io.BytesIO(pilot_lines)]
+            if (skip_header and data_start_offset == 0) or len(line_lengths) == 0:
+                xprint("Not sampling %s by seeking: no complete lines in its beginning" % filename)
+                return None
+
+            min_line_length = min(line_lengths)
+            average_line_length = sum(line_lengths) / len(line_lengths)
+            population_size = int(round((file_size - data_start_offset) / average_line_length))
+            sample_size = self._get_sample_size(sample, population_size)
+            # Each accepted line takes about average_line_length / min_line_length probes
+            expected_probe_count = sample_size * average_line_length / min_line_length
+            if sample_size * 2 > population_size or expected_probe_count * 2 * SAMPLE_PROBE_WINDOW_SIZE > (file_size - data_start_offset) // 2:
+                xprint("Not sampling %s by seeking: sample of %s lines out of about %s lines is too large" % (filename, sample_size, population_size))
+                return None
+
+            sampled_lines = {}
+            probe_count = 0
+            while len(sampled_lines) < sample_size:
+                probe_count += 1
+                if probe_count > 10 * expected_probe_count + 100:
+                    xprint("Not sampling %s by seeking: too many probes" % filename)
+                    return None
+                offset = random_generator.randrange(data_start_offset, file_size)
+                window_start = max(data_start_offset, offset - SAMPLE_PROBE_WINDOW_SIZE)
+                window_end = min(file_size, offset + SAMPLE_PROBE_WINDOW_SIZE)
+                f.seek(window_start)
+                window = f.read(window_end - window_start)
+                if not self._are_newlines_record_boundaries(window):
+                    xprint("Not sampling %s by seeking: newlines around offset %s might not be record boundaries" % (filename, offset))
+                    return None
+
+                line_start = window.rfind(b'\n', 0, offset - window_start) + 1
+                line_end = window.find(b'\n', offset - window_start) + 1
+                if (line_start == 0 and window_start > data_start_offset) or (line_end == 0 and window_end < file_size):
+                    xprint("Not sampling %s by seeking: line at offset %s is longer than the probe window" % (filename, offset))
+                    return None
+                if line_end == 0:
+                    line_end = len(window)
+                if window_start + line_start in sampled_lines:
+                    continue
+                if random_generator.random() * (line_end - line_start) < min_line_length:
+                    sampled_lines[window_start + line_start] = window[line_start:line_end]
 
-    def generate_rows(self):
-        csv_reader = encoded_csv_reader(self.input_params.input_encoding, self.f, dialect=self.dialect,row_data_only=self.external_f)
         try:
-            # TODO Some order with regard to separating data-streams for actual files
-            if self.external_f:
-                for col_vals in csv_reader:
-                    self.lines_read += 1
-                    yield self.external_f_name,0, self.lines_read == 0, col_vals
-            else:
-                for file_name,is_first_line,col_vals in csv_reader:
-                    if is_first_line:
-                        self.file_number = self.file_number + 1
-                    self.lines_read += 1
-                    yield file_name,self.file_number,is_first_line,col_vals
-        except ColumnMaxLengthLimitExceededException as e:
-            msg = "Column length is larger than the maximum. Offending file is '%s' - Line is %s, counting from 1 (encoding %s). The line number is the raw line number of the file, ignoring whether there's a header or not" % (",".join(self.atomic_fns),self.lines_read + 1,self.input_params.input_encoding)
-            raise ColumnMaxLengthLimitExceededException(msg)
-        except UniversalNewlinesExistException as e2:
-            # No need to translate the exception, but we want it to be explicitly defined here for clarity
-            raise UniversalNewlinesExistException()
+            lines = [sampled_lines[line_offset].decode(self.input_params.input_encoding) for line_offset in sorted(sampled_lines.keys())]
+        except UnicodeDecodeError:
+            xprint("Not sampling %s by seeking: sampled lines cannot be decoded" % filename)
+            return None
+
+        self.method = 'random seeks'
+        self.population_size = population_size
+        self.is_population_size_estimated = True
+        xprint("Sampled %s lines of %s using %s probes" % (len(lines), filename, probe_count))
+        return list(csv.reader(lines, **self.dialect_params))
 
 class MaterializedState(object):
     def __init__(self, table_source_type,qtable_name, engine_id):
@@ -1563,12 +5073,13 @@ class MaterializedState(object):
         assert False, 'not implemented'
 
 class MaterializedDelimitedFileState(MaterializedState):
-    def __init__(self, table_source_type,qtable_name, input_params, dialect_id,engine_id,target_table_name=None):
+    def __init__(self, table_source_type,qtable_name, input_params, dialect_id,engine_id,target_table_name=None,load_hints=None):
         super().__init__(table_source_type,qtable_name,engine_id)
 
         self.input_params = input_params
         self.dialect_id = dialect_id
         self.target_table_name = target_table_name
+        self.load_hints = load_hints
 
         self.content_signature = None
 
@@ -1576,6 +5087,13 @@ class MaterializedDelimitedFileState(MaterializedState):
 
         self.can_store_as_cached = None
 
+        # Multi-file tables are assembled from the caches of their files when caching is enabled (see
+        # _load_from_member_caches_if_possible)
+        self.use_member_caches = False
+
+        # Set when the table has been read from the cache directory (see _read_from_cache_directory_if_possible)
+        self.read_from_cache_directory = False
+
     def get_materialized_state_type(self):
         return MaterializedStateType.DELIMITED_FILE
 
@@ -1588,8 +5106,25 @@ class MaterializedDelimitedFileState(MaterializedState):
         self.source_type = self.table_source_type
         self.source = ",".join(self.atomic_fns)
 
+        self.use_member_caches = self._should_use_member_caches()
+        if self.use_member_caches and self.load_hints is not None:
+            # Member caches contain full tables, so hints which change how the table is loaded are not used
+            xprint("Not using load hints for table %s, since it is assembled from the caches of its files" % self.qtable_name)
+            self.load_hints = None
+
         return
 
+    def _should_use_member_caches(self):
+        if len(self.atomic_fns) <= 1:
+            return False
+        if self.input_params.sample is not None or self.input_params.type_inference_sample_rows > 0 or is_range_read(self.input_params):
+            return False
+        if self.input_params.write_caching:
+            return True
+        if self.input_params.cache_dir is not None:
+            return self.input_params.read_caching
+        return self.input_params.read_caching and any(is_qsql_file('%s.qsql' % fn) for fn in self.atomic_fns)
+
     def materialize_file_list(self,qtable_name):
         materialized_file_list = []
 
@@ -1658,7 +5193,7 @@ class MaterializedDelimitedFileState(MaterializedState):
         xprint("Target sqlite table name is %s" % target_sqlite_table_name)
         # Create the matching database table and populate it
         table_creator = TableCreator(self.qtable_name, self.delimited_file_reader,self.input_params, sqlite_db=database_info.sqlite_db,
-                                     target_sqlite_table_name=target_sqlite_table_name)
+                                     target_sqlite_table_name=target_sqlite_table_name,load_hints=self.load_hints)
         table_creator.perform_analyze(self.dialect_id)
         xprint("after perform_analyze")
         self.content_signature = table_creator._generate_content_signature()
@@ -1673,7 +5208,7 @@ class MaterializedDelimitedFileState(MaterializedState):
         return table_creator
 
     def _generate_disk_db_filename(self, filenames_str):
-        fn = '%s.qsql' % (os.path.abspath(filenames_str).replace("+","__"))
+        fn = '%s%s.qsql' % (os.path.abspath(filenames_str).replace("+","__"), get_range_read_cache_suffix(self.input_params))
         return fn
 
 
@@ -1685,8 +5220,8 @@ class MaterializedDelimitedFileState(MaterializedState):
         return should_read_from_cache
 
     def calculate_should_read_from_cache(self):
-        # TODO cache filename is chosen according to first filename only, which makes multi-file (glob) caching difficult
-        #  cache writing is blocked for now in these cases. Will be added in the future (see save_cache_to_disk_if_needed)
+        # The cache filename is chosen according to the first filename only. Multi-file tables are assembled from the caches
+        # of each of their files instead (see _load_from_member_caches_if_possible)
         disk_db_filename = self._generate_disk_db_filename(self.atomic_fns[0])
         should_read_from_cache = self._get_should_read_from_cache(disk_db_filename)
         xprint("should read from cache %s" % should_read_from_cache)
@@ -1706,48 +5241,229 @@ class MaterializedDelimitedFileState(MaterializedState):
         xprint("db %s (%s) has been added to the database list" % (self.db_id, self.db_to_use))
 
         self.delimited_file_reader.open_file()
+        try:
+            table_creator = self.__analyze_delimited_file(database_info)
+            if not stop_after_analysis and self._read_from_cache_directory_if_possible(table_creator):
+                database_info = DatabaseInfo(self.db_id, self.db_to_use, needs_closing=True)
+
+            self.mfs_structure = MaterializedStateTableStructure(self.qtable_name, self.atomic_fns, self.db_id,
+                                                                 table_creator.get_table_column_names(),
+                                                                 table_creator.get_table_column_types(),
+                                                                 None,
+                                                                 self.target_table_name,
+                                                                 self.source_type,
+                                                                 self.source,
+                                                                 self.get_planned_table_name())
+
+            content_signature = table_creator.content_signature
+            content_signature_key = self.db_to_use.calculate_content_signature_key(content_signature)
+            xprint("table creator signature key: %s" % content_signature_key)
+
+            relevant_table = self.db_to_use.get_from_qcatalog(content_signature)['temp_table_name']
+
+            seeking_row_sampler = SeekingRowSampler(self.input_params, self.dialect_id)
+            if not stop_after_analysis and not self.read_from_cache_directory and not self._load_from_member_caches_if_possible(table_creator):
+                table_creator.perform_read_fully(self.dialect_id, self._create_parallel_loader_if_needed(),
+                                                 DelimitedFileRecordCounter(self.input_params, self.dialect_id),
+                                                 seeking_row_sampler)
+                if table_creator.count_only:
+                    self.mfs_structure.record_count = table_creator.record_count
+                self.mfs_structure.pipeline_stats = table_creator.pipeline_stats
+
+                self.save_cache_to_disk_if_needed(disk_db_filename, table_creator)
+            elif table_creator.sample is not None:
+                table_creator.complete_analysis_only_sampling(seeking_row_sampler.get_planned_method(table_creator))
+            self.mfs_structure.sampling = table_creator.get_sampling_description()
+        finally:
+            # The file is closed even when loading fails
+            self.delimited_file_reader.close_file()
 
-        table_creator = self.__analyze_delimited_file(database_info)
+        return database_info, relevant_table
 
-        self.mfs_structure = MaterializedStateTableStructure(self.qtable_name, self.atomic_fns, self.db_id,
-                                                             table_creator.column_inferer.get_column_names(),
-                                                             table_creator.column_inferer.get_column_types(),
-                                                             None,
-                                                             self.target_table_name,
-                                                             self.source_type,
-                                                             self.source,
-                                                             self.get_planned_table_name())
+    def _get_cache_directory(self):
+        if self.input_params.cache_dir is None:
+            return None
+        return CacheDirectory(self.input_params.cache_dir, self.input_params.cache_max_size)
+
+    def _read_from_cache_directory_if_possible(self, table_creator):
+        # Replaces the database of the table with its cache in the cache directory, if there is one. Caches are keyed by
+        # the content signature of the table, so a cache is found only if the file and the reading options are the same
+        cache_directory = self._get_cache_directory()
+        if cache_directory is None or not self.input_params.read_caching or not self.can_store_as_cached:
+            return False
+        if len(self.atomic_fns) > 1 or table_creator.sample is not None:
+            return False
 
-        content_signature = table_creator.content_signature
-        content_signature_key = self.db_to_use.calculate_content_signature_key(content_signature)
-        xprint("table creator signature key: %s" % content_signature_key)
+        content_signature_key = self.db_to_use.calculate_content_signature_key(table_creator.content_signature)
+        cache_filename = cache_directory.find(content_signature_key)
+        if cache_filename is None:
+            xprint("No cache of %s in cache directory %s (content signature key %s)" % (self.atomic_fns[0], cache_directory.path, content_signature_key))
+            return False
 
-        relevant_table = self.db_to_use.get_from_qcatalog(content_signature)['temp_table_name']
+        cache_db = None
+        try:
+            cache_db = Sqlite3DB(self.db_id, 'file:%s?mode=ro&immutable=1' % cache_filename, cache_filename, create_qcatalog=False)
+            cache_table_name = cache_db.get_from_qcatalog(table_creator.content_signature)['temp_table_name']
+        except (sqlite3.Error, SqliteOperationalErrorException, TypeError) as e:
+            # e.g. the cache has just been evicted by another process
+            xprint("Could not read cache %s of %s: %s" % (cache_filename, self.atomic_fns[0], e))
+            if cache_db is not None:
+                cache_db.done()
+            return False
 
-        if not stop_after_analysis:
-            table_creator.perform_read_fully(self.dialect_id)
+        xprint("Reading %s from cache %s" % (self.atomic_fns[0], cache_filename))
+        self.db_to_use.done()
+        self.db_to_use = cache_db
+        self.target_table_name = cache_table_name
+        self.read_from_cache_directory = True
+        return True
 
-            self.save_cache_to_disk_if_needed(disk_db_filename, table_creator)
+    def _get_member_column_info(self, filename):
+        # Returns the column names and sqlite column types which the file would have as a table of its own
+        column_inferer = TableColumnInferer(self.input_params)
+        delimited_file_reader = DelimitedFileReader([filename], self.input_params, self.dialect_id)
+        delimited_file_reader.open_file()
+        try:
+            for file_name, file_number, is_first_line, col_vals in delimited_file_reader.generate_rows():
+                if column_inferer.analyze(file_name, col_vals):
+                    break
+            else:
+                column_inferer.force_analysis()
+        finally:
+            delimited_file_reader.close_file()
+        return column_inferer.get_column_names(), [Sqlite3DB.PYTHON_TO_SQLITE_TYPE_NAMES[t] for t in column_inferer.get_column_types()]
+
+    def _load_member(self, member_number, filename):
+        # Returns the database info and table name of a file of a multi-file table, and whether it has been read from its
+        # cache. Files without a valid cache are loaded as tables of their own, which writes their caches when write
+        # caching is enabled
+        qsql_filename = '%s.qsql' % filename
+        if self.input_params.read_caching and self.input_params.cache_dir is None and is_qsql_file(qsql_filename):
+            member_state = MaterializedQsqlState(TableSourceType.QSQL_FILE_WITH_ORIGINAL, filename, qsql_filename, None,
+                                                 '%s_cached_member_%s' % (self.engine_id, member_number), self.input_params, self.dialect_id)
+            try:
+                member_state.initialize()
+                member_state.choose_db_to_use()
+                database_info, table_name = member_state.make_data_available(stop_after_analysis=False)
+                member_state.finalize()
+                return database_info, table_name, True
+            except (ContentSignatureDiffersException, ContentSignatureDataDiffersException) as e:
+                xprint("Cache %s does not match file %s, so the file is read again: %s" % (qsql_filename, filename, e))
+
+        member_state = MaterializedDelimitedFileState(TableSourceType.DELIMITED_FILE, filename, self.input_params, self.dialect_id,
+                                                      '%s_member_%s' % (self.engine_id, member_number))
+        member_state.initialize()
+        member_state.choose_db_to_use()
+        database_info, table_name = member_state.make_data_available(stop_after_analysis=False)
+        member_state.finalize()
+        return database_info, table_name, member_state.read_from_cache_directory
+
+    def _load_from_member_caches_if_possible(self, table_creator):
+        # Loads a multi-file table from the caches of its files, so only files which are new or have changed are parsed.
+        # The columns of each file as a table of its own have to match the columns of the table, so the assembled table
+        # is identical to a table which is loaded directly. Returns False if the table needs to be loaded directly
+        if not self.use_member_caches:
+            return False
 
+        target_table_name = table_creator.target_sqlite_table_name
+        table_info = self.db_to_use.get_sqlite_table_info(target_table_name)
+        column_names = [x[1] for x in table_info]
+        sqlite_column_types = [x[2] for x in table_info]
+        for filename in self.atomic_fns:
+            member_column_names, member_sqlite_column_types = self._get_member_column_info(filename)
+            if member_column_names != column_names or member_sqlite_column_types != sqlite_column_types:
+                xprint("Columns of %s as a table of its own differ from the columns of table %s (%s vs %s). Loading the table directly" % (
+                    filename, self.qtable_name, list(zip(member_column_names, member_sqlite_column_types)), list(zip(column_names, sqlite_column_types))))
+                return False
+
+        # The rows which have been read during the analysis are copied from the first file again
+        self.db_to_use.execute_and_fetch('DELETE FROM %s' % target_table_name)
+        self.db_to_use.conn.commit()
+
+        column_list = self.db_to_use._get_as_list_str(column_names)
+        cached_member_count = 0
+        for member_number, filename in enumerate(self.atomic_fns):
+            database_info, member_table_name, is_cached = self._load_member(member_number, filename)
+            try:
+                self.db_to_use.execute_and_fetch("attach '%s' as glob_member_db" % database_info.sqlite_db.sqlite_db_url)
+                try:
+                    self.db_to_use.execute_and_fetch('INSERT INTO %s (%s) SELECT %s FROM glob_member_db.%s' % (target_table_name, column_list, column_list, member_table_name))
+                    self.db_to_use.conn.commit()
+                finally:
+                    self.db_to_use.execute_and_fetch('detach glob_member_db')
+            finally:
+                database_info.sqlite_db.done()
+            if is_cached:
+                cached_member_count += 1
 
-        self.delimited_file_reader.close_file()
+        iprint("Loaded table %s from %s cached files and %s parsed files" % (self.qtable_name, cached_member_count, len(self.atomic_fns) - cached_member_count))
+        return True
 
-        return database_info, relevant_table
+    def _create_parallel_loader_if_needed(self):
+        if self.input_params.parallel_load <= 1:
+            return None
+        return ParallelDelimitedFileLoader(self.input_params.parallel_load, self.input_params, self.dialect_id)
 
     def save_cache_to_disk_if_needed(self, disk_db_filename, table_creator):
         if len(self.atomic_fns) > 1:
-            xprint("Cannot save cache for multi-files for now, deciding auto-naming for cache is challenging. Will be added in the future.")
+            xprint("Multi-file tables are not cached as a whole. Their files are cached separately (see _load_from_member_caches_if_possible)")
+            return
+
+        if table_creator.sample is not None:
+            xprint("Not saving a cache of a sample of %s" % ",".join(self.atomic_fns))
             return
 
         effective_write_caching = self.input_params.write_caching
         if effective_write_caching:
-            if self.can_store_as_cached:
+            if self.can_store_as_cached and self.input_params.cache_dir is not None:
+                content_signature_key = table_creator.sqlite_db.calculate_content_signature_key(table_creator.content_signature)
+                cache_filename = self._get_cache_directory().store(table_creator.sqlite_db, content_signature_key)
+                xprint("Written cache of %s to cache directory: %s" % (",".join(self.atomic_fns), cache_filename))
+            elif self.can_store_as_cached:
                 assert self.table_source_type != TableSourceType.DELIMITED_FILE_WITH_UNUSED_QSQL
                 xprint("Going to write file cache for %s. Disk filename is %s" % (",".join(self.atomic_fns), disk_db_filename))
+                covered_file_prefix = self._get_covered_file_prefix(table_creator)
+                if covered_file_prefix is not None:
+                    table_creator.sqlite_db.set_qcatalog_covered_file_prefix(table_creator.target_sqlite_table_name, covered_file_prefix)
+                # Allows validating the cache without analyzing the file again (see MaterializedQsqlState._is_cache_valid_by_file_stat)
+                file_stat = get_file_stat_signature_if_unchanged(self.atomic_fns[0], table_creator.content_signature)
+                table_creator.sqlite_db.set_qcatalog_source_file_stat(table_creator.target_sqlite_table_name, file_stat)
+                if self.input_params.content_fingerprint and file_stat is not None:
+                    table_creator.sqlite_db.set_qcatalog_content_fingerprint(table_creator.target_sqlite_table_name,
+                                                                             self._get_content_fingerprint(file_stat))
                 self._store_qsql(table_creator.sqlite_db, disk_db_filename)
             else:
                 xprint("Database has been provided externally. Skipping storing a cached version of the data")
 
+    def _get_covered_file_prefix(self, table_creator):
+        # Returns the part of the file which has been loaded, or None if rows which are appended to the file later cannot
+        # be added to the cache
+        filename = self.atomic_fns[0]
+        reason = get_appended_rows_loading_ineligibility_reason(filename, self.input_params)
+        if reason is not None:
+            xprint("Appended rows of %s cannot be added to its cache: %s" % (filename, reason))
+            return None
+        size = os.stat(filename).st_size
+        if str(size) != table_creator.content_signature['original_file_size']:
+            xprint("File %s has changed while being loaded. Appended rows cannot be added to its cache" % filename)
+            return None
+        # The last record might still be written
+        if size == 0 or find_last_line_end(filename, size - 1, size) != size:
+            xprint("File %s does not end with a newline. Appended rows cannot be added to its cache" % filename)
+            return None
+        record_count = table_creator.sqlite_db.execute_and_fetch('SELECT COUNT(*) FROM %s' % table_creator.target_sqlite_table_name).results[0][0]
+        return CoveredFilePrefix(size, record_count, calculate_file_prefix_hash(filename, size))
+
+    def _get_content_fingerprint(self, file_stat):
+        # Returns the content fingerprint of the file, or None if it has changed while being hashed
+        filename = self.atomic_fns[0]
+        content_fingerprint = ContentFingerprint.calculate(filename, file_stat['size'])
+        if get_file_stat_signature(filename) != file_stat:
+            xprint("File %s has changed while calculating its content fingerprint" % filename)
+            return None
+        xprint("Content fingerprint of %s is %s" % (filename, content_fingerprint))
+        return content_fingerprint
+
     def _store_qsql(self, source_sqlite_db, disk_db_filename):
         xprint("Storing data as disk db")
         disk_db_conn = sqlite3.connect(disk_db_filename)
@@ -1761,10 +5477,10 @@ class MaterializedDelimitedFileState(MaterializedState):
 
 
 class MaterialiedDataStreamState(MaterializedDelimitedFileState):
-    def __init__(self, table_source_type, qtable_name, input_params, dialect_id, engine_id, data_stream, stream_target_db): ## should pass adhoc_db
+    def __init__(self, table_source_type, qtable_name, input_params, dialect_id, engine_id, data_stream, stream_target_db,load_hints=None): ## should pass adhoc_db
         assert data_stream is not None
 
-        super().__init__(table_source_type, qtable_name, input_params, dialect_id, engine_id,target_table_name=None)
+        super().__init__(table_source_type, qtable_name, input_params, dialect_id, engine_id,target_table_name=None,load_hints=load_hints)
 
         self.data_stream = data_stream
 
@@ -1780,8 +5496,6 @@ class MaterialiedDataStreamState(MaterializedDelimitedFileState):
 
     def initialize(self):
         self.start_time = time.time()
-        if self.input_params.gzipped_input:
-            raise CannotUnzipDataStreamException()
 
         self.source_type = self.table_source_type
         self.source = self.data_stream.stream_id
@@ -1934,6 +5648,9 @@ class MaterializedQsqlState(MaterializedState):
 
         self.table_name_autodetected = None
 
+        # Set when rows which have been appended to the original file are added to the cache, which validates it as well
+        self.appended_rows_loaded = False
+
     def initialize(self):
         super(MaterializedQsqlState, self).initialize()
 
@@ -1994,6 +5711,12 @@ class MaterializedQsqlState(MaterializedState):
         self.source = self.qsql_filename
         self.source_type = self.table_source_type
 
+        # Done before the cache is opened (or copied), since it modifies it
+        if self.input_params.write_caching and self._backing_original_file_exists():
+            if self.input_params.content_fingerprint:
+                self._update_file_stat_of_unchanged_content_if_needed()
+            self._load_appended_rows_if_needed()
+
         self.db_id = '%s' % self._generate_qsql_only_db_name__temp(self.qtable_name)
 
         x = 'file:%s?immutable=1' % self.qsql_filename
@@ -2014,6 +5737,8 @@ class MaterializedQsqlState(MaterializedState):
             cs = OrderedDict(json.loads(d['content_signature']))
             forced_db_to_use.add_to_qcatalog_table(new_table_name, cs, d['creation_time'],
                                     d['source_type'], d['source'])
+            forced_db_to_use.set_qcatalog_source_file_stat(new_table_name, self.db_to_use.get_qcatalog_source_file_stat(t))
+            forced_db_to_use.set_qcatalog_content_fingerprint(new_table_name, self.db_to_use.get_qcatalog_content_fingerprint(t))
 
             self.table_name = new_table_name
             self.db_id = forced_db_to_use.db_id
@@ -2054,8 +5779,176 @@ class MaterializedQsqlState(MaterializedState):
     def _backing_original_file_exists(self):
         return '%s.qsql' % self.qtable_name == self.qsql_filename
 
+    def _is_cache_valid_by_file_stat(self):
+        # A cache is valid if the size, modification time and inode of the original file are the ones it has been cached
+        # with, and if it has been cached using the same reading options. Otherwise (or for caches without a file stat),
+        # the file is analyzed again in order to validate the cache
+        cached_file_stat = self.db_to_use.get_qcatalog_source_file_stat(self.table_name)
+        if cached_file_stat is None:
+            xprint("Cache %s has no file stat of %s" % (self.qsql_filename, self.qtable_name))
+            return False
+        file_stat = get_file_stat_signature(self.qtable_name)
+        if file_stat != cached_file_stat:
+            xprint("File stat of %s differs from the one of its cache (%s vs %s)" % (self.qtable_name, file_stat, cached_file_stat))
+            return False
+
+        qcatalog_entry = self.db_to_use.get_from_qcatalog_using_table_name(self.table_name)
+        return self._has_same_reading_options(json.loads(qcatalog_entry['content_signature']))
+
+    def _is_cache_valid_by_content_fingerprint(self):
+        # A cache is valid if the original file has the content it has been cached with (even if its modification time has
+        # changed), and if it has been cached using the same reading options
+        content_fingerprint = self.db_to_use.get_qcatalog_content_fingerprint(self.table_name)
+        if content_fingerprint is None:
+            xprint("Cache %s has no content fingerprint of %s" % (self.qsql_filename, self.qtable_name))
+            return False
+        if os.stat(self.qtable_name).st_size != content_fingerprint.size:
+            xprint("Size of %s differs from the size in the content fingerprint of its cache" % self.qtable_name)
+            return False
+        qcatalog_entry = self.db_to_use.get_from_qcatalog_using_table_name(self.table_name)
+        if not self._has_same_reading_options(json.loads(qcatalog_entry['content_signature'])):
+            return False
+        if not content_fingerprint.is_prefix_of(self.qtable_name):
+            xprint("Content of %s differs from the content fingerprint of its cache" % self.qtable_name)
+            return False
+        return True
+
+    def _has_same_reading_options(self, cached_content_signature):
+        data_keys = ['inferer', 'original_file_size', 'last_modification_time']
+        cached_reading_options = dict([(k, v) for k, v in cached_content_signature.items() if k not in data_keys])
+        if cached_reading_options != get_reading_options_content_signature(self.input_params):
+            xprint("Reading options of %s differ from the ones of its cache %s" % (self.qtable_name, self.qsql_filename))
+            return False
+        inferer_data_keys = ['inferred', 'rows', 'header_row']
+        cached_inferer_options = dict([(k, v) for k, v in cached_content_signature['inferer'].items() if k not in inferer_data_keys])
+        inferer_options = dict([(k, v) for k, v in TableColumnInferer(self.input_params)._generate_content_signature().items() if k not in inferer_data_keys])
+        if cached_inferer_options != inferer_options:
+            xprint("Type inference options of %s differ from the ones of its cache %s" % (self.qtable_name, self.qsql_filename))
+            return False
+        return True
+
+    def _update_file_stat_of_unchanged_content_if_needed(self):
+        # When the original file has the content fingerprint of its cache but a different file stat (e.g. when it has been
+        # copied without preserving its modification time), the file stat and content signature of the cache are updated,
+        # so the cache remains valid without hashing the file again
+        original_filename = self.qtable_name
+        db = Sqlite3DB('fingerprint_db', 'file:%s' % self.qsql_filename, self.qsql_filename, create_qcatalog=False)
+        try:
+            content_fingerprint = db.get_qcatalog_content_fingerprint(self.table_name)
+            if content_fingerprint is None:
+                return
+            file_stat = get_file_stat_signature(original_filename)
+            if file_stat == db.get_qcatalog_source_file_stat(self.table_name) or file_stat['size'] != content_fingerprint.size:
+                return
+            if not content_fingerprint.is_prefix_of(original_filename) or get_file_stat_signature(original_filename) != file_stat:
+                xprint("Content of %s differs from the content fingerprint of its cache" % original_filename)
+                return
+
+            qcatalog_entry = db.get_from_qcatalog_using_table_name(self.table_name)
+            content_signature = OrderedDict(json.loads(qcatalog_entry['content_signature']))
+            content_signature['last_modification_time'] = get_files_last_modification_time_hash([original_filename])
+            db.update_qcatalog_content_signature(self.table_name, content_signature)
+            db.set_qcatalog_source_file_stat(self.table_name, file_stat)
+            iprint("File %s has the same content as when it has been cached. Updated the file stat of its cache %s" % (original_filename, self.qsql_filename))
+        finally:
+            db.done()
+
+    def _load_appended_rows_if_needed(self):
+        # When the original file has only been appended to since its cache has been written, the new complete records are
+        # parsed and added to the cached table, instead of failing the content signature validation
+        original_filename = self.qtable_name
+        reason = get_appended_rows_loading_ineligibility_reason(original_filename, self.input_params)
+        if reason is not None:
+            xprint("Not checking for appended rows of %s: %s" % (original_filename, reason))
+            return
+
+        db = Sqlite3DB('append_db', 'file:%s' % self.qsql_filename, self.qsql_filename, create_qcatalog=False)
+        try:
+            covered_file_prefix = db.get_qcatalog_covered_file_prefix(self.table_name)
+            size = os.stat(original_filename).st_size
+            xprint("Covered prefix of %s is %s. Current size is %s" % (original_filename, covered_file_prefix, size))
+            if covered_file_prefix is None or size <= covered_file_prefix.size:
+                return
+            # The last appended record might still be written. The cache is not extended at all in that case, since the
+            # file would no longer match it otherwise
+            if find_last_line_end(original_filename, size - 1, size) != size:
+                xprint("File %s does not end with a newline. Not adding its appended rows to its cache" % original_filename)
+                return
+            if calculate_file_prefix_hash(original_filename, covered_file_prefix.size) != covered_file_prefix.prefix_hash:
+                xprint("The cached part of %s has changed, so the file has not only been appended to" % original_filename)
+                return
+            content_fingerprint = db.get_qcatalog_content_fingerprint(self.table_name) if self.input_params.content_fingerprint else None
+
+            # Everything except the size and modification time still needs to match
+            mdfs = MaterializedDelimitedFileState(TableSourceType.DELIMITED_FILE,original_filename,self.input_params,self.dialect_id,self.engine_id,target_table_name=None)
+            mdfs.initialize()
+            mdfs.choose_db_to_use(forced_db_to_use=None,stop_after_analysis=True)
+            _,_ = mdfs.make_data_available(stop_after_analysis=True)
+            qcatalog_entry = db.get_from_qcatalog_using_table_name(self.table_name)
+            validate_content_signature(original_filename, mdfs.content_signature, self.qsql_filename, json.loads(qcatalog_entry['content_signature']),
+                                       dump=True, ignored_keys=('original_file_size', 'last_modification_time'))
+            mdfs.finalize()
+            if mdfs.content_signature['original_file_size'] != str(size):
+                xprint("File %s has changed while being checked. Not adding its appended rows to its cache" % original_filename)
+                return
+
+            appended_record_count = self._insert_appended_rows(db, original_filename, covered_file_prefix.size, size)
+
+            db.update_qcatalog_content_signature(self.table_name, mdfs.content_signature)
+            file_stat = get_file_stat_signature_if_unchanged(original_filename, mdfs.content_signature)
+            db.set_qcatalog_source_file_stat(self.table_name, file_stat)
+            if content_fingerprint is not None:
+                # Only the chunks which contain appended data are hashed
+                db.set_qcatalog_content_fingerprint(self.table_name, content_fingerprint.extended_to(original_filename, file_stat['size']) if file_stat is not None else None)
+            db.set_qcatalog_covered_file_prefix(self.table_name, CoveredFilePrefix(size, covered_file_prefix.record_count + appended_record_count,
+                                                                                   calculate_file_prefix_hash(original_filename, size)))
+            iprint("Added %s appended rows of %s to its cache %s" % (appended_record_count, original_filename, self.qsql_filename))
+            self.appended_rows_loaded = True
+        except:
+            # The cache is left as it was
+            db.conn.rollback()
+            raise
+        finally:
+            db.done()
+
+    def _insert_appended_rows(self, db, filename, start_offset, end_offset):
+        table_info = db.get_sqlite_table_info(self.table_name)
+        column_names = [x[1] for x in table_info]
+        numeric_column_indices = [i for i, x in enumerate(table_info) if db.is_numeric_type(sqlite_type_to_python_type(x[2]))]
+
+        def on_column_count_mismatch(actual_col_count):
+            raise ColumnCountMismatchException('Strict mode - Expected %s columns instead of %s columns in the appended rows of file %s. Either use relaxed modes or check your delimiter' % (
+                len(column_names), actual_col_count, normalized_filename(filename)))
+
+        normalize_row = create_row_normalizer(self.input_params.parsing_mode, len(column_names), numeric_column_indices,
+                                              self.input_params.delimiter, None, on_column_count_mismatch)
+        insert_row_stmt = db.generate_insert_row(self.table_name, column_names)
+        record_count = 0
+        if end_offset > start_offset:
+            lines = generate_mmap_file_lines(filename, self.input_params.input_encoding, regions=[(start_offset, end_offset)])
+            try:
+                rows = []
+                for col_vals in encoded_csv_reader(self.input_params.input_encoding, lines, dialect=self.dialect_id):
+                    rows.append(normalize_row(col_vals))
+                    if len(rows) >= 5000:
+                        db.update_many(insert_row_stmt, rows)
+                        record_count += len(rows)
+                        rows = []
+                db.update_many(insert_row_stmt, rows)
+                record_count += len(rows)
+            finally:
+                lines.close()
+        db.conn.commit()
+        return record_count
+
     def _read_table_from_cache(self, stop_after_analysis):
-        if self._backing_original_file_exists():
+        if self.appended_rows_loaded:
+            xprint("Cache %s has already been validated while adding the appended rows of %s" % (self.qsql_filename, self.qtable_name))
+        elif self._backing_original_file_exists() and self.input_params.cache_validation == 'stat' and self._is_cache_valid_by_file_stat():
+            xprint("Cache %s has been validated using the file stat of %s" % (self.qsql_filename, self.qtable_name))
+        elif self._backing_original_file_exists() and self.input_params.content_fingerprint and self._is_cache_valid_by_content_fingerprint():
+            xprint("Cache %s has been validated using the content fingerprint of %s" % (self.qsql_filename, self.qtable_name))
+        elif self._backing_original_file_exists():
             xprint("Found a matching source file for qsql file with qtable name %s. Checking content signature by creating a temp MFDS + analysis" % self.qtable_name)
             mdfs = MaterializedDelimitedFileState(TableSourceType.DELIMITED_FILE,self.qtable_name,self.input_params,self.dialect_id,self.engine_id,target_table_name=None)
             mdfs.initialize()
@@ -2096,6 +5989,13 @@ class MaterializedStateTableStructure(object):
         else:
             self.sqlite_column_types = [Sqlite3DB.PYTHON_TO_SQLITE_TYPE_NAMES[t].lower() for t in python_column_types]
 
+        # Set when the rows of the table have only been counted, and the table itself has no rows
+        self.record_count = None
+        # Set when the table has been loaded through a pipelined load (see PipelineStats)
+        self.pipeline_stats = None
+        # Describes the sampling parameters and results when only a random sample of the rows is loaded
+        self.sampling = None
+
     def get_table_name_for_querying(self):
         return self.table_name_for_querying
 
@@ -2108,7 +6008,7 @@ class TableCreator(object):
         return "TableCreator<%s>" % str(self)
     __repr__ = __str__
 
-    def __init__(self, qtable_name, delimited_file_reader,input_params,sqlite_db=None,target_sqlite_table_name=None):
+    def __init__(self, qtable_name, delimited_file_reader,input_params,sqlite_db=None,target_sqlite_table_name=None,load_hints=None):
 
         self.qtable_name = qtable_name
         self.delimited_file_reader = delimited_file_reader
@@ -2118,6 +6018,7 @@ class TableCreator(object):
         self.sqlite_db = sqlite_db
         self.target_sqlite_table_name = target_sqlite_table_name
 
+        self.input_params = input_params
         self.skip_header = input_params.skip_header
         self.gzipped = input_params.gzipped_input
         self.table_created = False
@@ -2127,6 +6028,8 @@ class TableCreator(object):
         self.expected_column_count = input_params.expected_column_count
         self.input_delimiter = input_params.delimiter
         self.with_universal_newlines = input_params.with_universal_newlines
+        self.byte_range = input_params.byte_range
+        self.record_range = input_params.record_range
 
         self.column_inferer = TableColumnInferer(input_params)
 
@@ -2138,6 +6041,64 @@ class TableCreator(object):
         # so column inferer can do its work before this information is needed
         self.numeric_column_indices = None
 
+        # Names of columns which are needed by the query (None means all columns). Columns which are not needed
+        # are not stored in the table at all
+        self.required_column_names = load_hints.required_column_names if load_hints is not None else None
+        # Indices of the columns that are actually stored in the table, when only some of them are needed. Initialized
+        # when the table is created
+        self.projected_column_indices = None
+        # Normalizes (and projects) each row before it is inserted (see create_row_normalizer). Lazily initialized
+        self.row_normalizer = None
+
+        # WHERE conditions of the query. Rows which provably fail them are not inserted into the table
+        self.pushed_down_conditions = load_hints.pushed_down_conditions if load_hints is not None else []
+        # Initialized when the table is created
+        self.row_filter = None
+
+        # Reading stops after this number of rows which certainly match the query's WHERE clause have been inserted.
+        # Strict mode requires all rows to be validated, so it always reads everything
+        self.row_limit = load_hints.row_limit if load_hints is not None and self.mode != 'strict' else None
+        self.matching_rows_inserted = 0
+
+        # When only the number of rows is needed, rows are counted and validated but not inserted
+        self.count_only = load_hints.count_only if load_hints is not None else False
+        self.record_count = 0
+
+        # Evaluates the query on each batch of inserted rows. Strict mode requires all rows to be validated before
+        # any output is written, so it never streams output
+        self.streaming_query_executor = load_hints.streaming_query_executor if load_hints is not None else None
+        if self.streaming_query_executor is not None and self.streaming_query_executor.writes_output and self.mode == 'strict':
+            self.streaming_query_executor = None
+
+        # When only the first rows of an ordering are needed, other rows are dropped while reading. The collector is
+        # initialized when the table is created
+        self.top_n = load_hints.top_n if load_hints is not None else None
+        self.top_n_collector = None
+
+        # When the load is pipelined, inserts are executed on a separate thread while reading. Streaming executors
+        # query the table after each insert, so inserts are kept synchronous for them
+        self.pipeline_stats = delimited_file_reader.pipeline_stats
+        self.insert_queue_depth = input_params.insert_queue_depth
+        self.background_inserter = None
+
+        # When only a random sample of the rows is loaded (see RowSampler and SeekingRowSampler), rows which are read
+        # during analysis are kept aside until the sampling method is chosen. The query runs on the sample, so hints
+        # which assume all rows are loaded are not used
+        self.sample = input_params.sample
+        self.sample_seed = input_params.sample_seed
+        self.random_generator = random.Random(input_params.sample_seed)
+        self.row_sampler = None
+        self.unsampled_rows = []
+        self.sampling_completed = False
+        self.sampling_method = None
+        self.sampled_row_count = None
+        self.sampled_population_size = None
+        self.is_sampled_population_size_estimated = False
+        if self.sample is not None:
+            self.row_limit = None
+            self.count_only = False
+            self.top_n = None
+
         self.state = TableCreatorState.INITIALIZED
 
         self.content_signature = None
@@ -2150,19 +6111,10 @@ class TableCreator(object):
         size = self.delimited_file_reader.get_size_hash()
         last_modification_time = self.delimited_file_reader.get_last_modification_time_hash()
 
-        m = OrderedDict({
-            "_signature_version": "v1",
-            "skip_header": self.skip_header,
-            "gzipped": self.gzipped,
-            "with_universal_newlines": self.with_universal_newlines,
-            "encoding": self.encoding,
-            "mode": self.mode,
-            "expected_column_count": self.expected_column_count,
-            "input_delimiter": self.input_delimiter,
-            "inferer": self.column_inferer._generate_content_signature(),
-            "original_file_size": size,
-            "last_modification_time": last_modification_time
-        })
+        m = get_reading_options_content_signature(self.input_params)
+        m["inferer"] = self.column_inferer._generate_content_signature()
+        m["original_file_size"] = size
+        m["last_modification_time"] = last_modification_time
 
         return m
 
@@ -2194,9 +6146,14 @@ class TableCreator(object):
 
     def _populate(self,dialect,stop_after_analysis=False):
         total_data_lines_read = 0
+        if self.pipeline_stats is not None and self.streaming_query_executor is None and not stop_after_analysis:
+            self.background_inserter = BackgroundInserter(self.sqlite_db, self.insert_queue_depth, self.pipeline_stats)
         try:
             try:
                 for file_name,file_number,is_first_line,col_vals in self.delimited_file_reader.generate_rows():
+                    if self.is_row_limit_reached():
+                        xprint("Row limit %s has been reached, stopping to read" % self.row_limit)
+                        break
                     if is_first_line:
                         if self.validate_extra_header_if_needed(file_number,file_name,col_vals):
                             continue
@@ -2219,7 +6176,13 @@ class TableCreator(object):
                     'Deprecated fluffy mode - Too many columns in file %s row %s (%s fields instead of %s fields). Consider moving to either relaxed or strict mode' % (
                     normalized_filename(e.atomic_fn), e.lines_read, e.actual_col_count, e.expected_col_count))
         finally:
-            self._flush_inserts()
+            try:
+                self._flush_inserts()
+            finally:
+                if self.background_inserter is not None:
+                    background_inserter = self.background_inserter
+                    self.background_inserter = None
+                    background_inserter.finish()
 
         if not self.table_created:
             self.column_inferer.force_analysis()
@@ -2227,9 +6190,16 @@ class TableCreator(object):
 
         self.sqlite_db.conn.commit()
 
+    def is_row_limit_reached(self):
+        if self.streaming_query_executor is not None and self.streaming_query_executor.is_done():
+            return True
+        return self.row_limit is not None and self.matching_rows_inserted >= self.row_limit
+
     def perform_analyze(self, dialect):
         xprint("Analyzing... %s" % dialect)
         if self.state == TableCreatorState.INITIALIZED:
+            if self.column_inferer.type_inference_sample_rows > 0:
+                self.column_inferer.sampled_rows = self._sample_rows_for_type_inference(dialect)
             self._populate(dialect,stop_after_analysis=True)
             self.state = TableCreatorState.ANALYZED
 
@@ -2240,20 +6210,117 @@ class TableCreator(object):
             # TODO Convert to assertion
             raise Exception('Bug - Wrong state %s' % self.state)
 
-    def perform_read_fully(self, dialect):
+    def _sample_rows_for_type_inference(self, dialect):
+        # Returns rows sampled uniformly from the whole data, so column types are not inferred from the first rows only.
+        # A single uncompressed file is sampled by seeking if possible, other files are read fully in advance
+        sample_size = self.column_inferer.type_inference_sample_rows
+        atomic_fns = self.delimited_file_reader.atomic_fns
+        input_params = self.input_params
+        if self.delimited_file_reader.external_f:
+            xprint("Not sampling rows for type inference of table %s, since data streams can only be read once" % self.qtable_name)
+            return []
+
+        random_generator = random.Random(TYPE_INFERENCE_SAMPLE_SEED)
+        if len(atomic_fns) == 1 and not is_range_read(input_params) and not input_params.with_universal_newlines \
+                and is_byte_scannable_file(atomic_fns[0], input_params):
+            rows = SeekingRowSampler(input_params, dialect).sample_file(atomic_fns[0], self.skip_header, sample_size, random_generator)
+            if rows is not None:
+                xprint("Sampled %s rows for type inference of table %s by seeking" % (len(rows), self.qtable_name))
+                return rows
+
+        row_sampler = RowSampler(sample_size, random_generator)
+        delimited_file_reader = DelimitedFileReader(atomic_fns, input_params, dialect)
+        delimited_file_reader.open_file()
+        try:
+            for file_name, file_number, is_first_line, col_vals in delimited_file_reader.generate_rows():
+                if is_first_line and self.skip_header:
+                    continue
+                row_sampler.add(col_vals)
+        finally:
+            delimited_file_reader.close_file()
+        rows = row_sampler.get_rows()
+        xprint("Sampled %s rows out of %s rows for type inference of table %s" % (len(rows), row_sampler.row_number, self.qtable_name))
+        return rows
+
+    def perform_read_fully(self, dialect, parallel_loader=None, record_counter=None, seeking_row_sampler=None):
         if self.state == TableCreatorState.ANALYZED:
-            self._populate(dialect,stop_after_analysis=False)
+            if self.sample is not None:
+                self._load_sample(dialect, seeking_row_sampler)
+            elif self.count_only and record_counter is not None and record_counter.count(self):
+                self.sqlite_db.conn.commit()
+            elif parallel_loader is None or not parallel_loader.load(self):
+                self._populate(dialect,stop_after_analysis=False)
+            if self.top_n_collector is not None:
+                self._insert_top_n_rows()
+            if self.streaming_query_executor is not None and not self.streaming_query_executor.started:
+                # Provides the output column names even when there are no rows
+                self.streaming_query_executor.process_batch(self.sqlite_db, self.target_sqlite_table_name)
+            if self.pipeline_stats is not None:
+                iprint("Pipelined load of table %s: %s" % (self.qtable_name, self.pipeline_stats.get_summary()))
             self.state = TableCreatorState.FULLY_READ
         else:
             # TODO Convert to assertion
             raise Exception('Bug - Wrong state %s' % self.state)
 
+    def _load_sample(self, dialect, seeking_row_sampler):
+        rows = seeking_row_sampler.sample(self) if seeking_row_sampler is not None else None
+        if rows is not None:
+            self.sampling_method = seeking_row_sampler.method
+            self.sampled_population_size = seeking_row_sampler.population_size
+            self.is_sampled_population_size_estimated = seeking_row_sampler.is_population_size_estimated
+            self.sampled_row_count = len(rows)
+        else:
+            self.sampling_method = 'reading all rows'
+            self.row_sampler = RowSampler(self.sample, self.random_generator)
+            unsampled_rows = self.unsampled_rows
+            self.unsampled_rows = []
+            for col_vals in unsampled_rows:
+                self._insert_row_i(col_vals)
+            self._populate(dialect,stop_after_analysis=False)
+            rows = self.row_sampler.get_rows()
+            self.sampled_population_size = self.row_sampler.row_number
+            self.sampled_row_count = self.row_sampler.get_sampled_row_count()
+        xprint("Sampled %s rows out of %s rows of table %s" % (self.sampled_row_count,self.sampled_population_size,self.target_sqlite_table_name))
+
+        self.sampling_completed = True
+        for col_vals in rows:
+            self._insert_row_i(col_vals)
+        self._flush_inserts()
+        self.sqlite_db.conn.commit()
+
+    def complete_analysis_only_sampling(self, planned_sampling_method):
+        # When only analyzing, the rows which have been read during analysis are inserted as they are, like when not
+        # sampling, and the sampling method which a full read would try is described
+        self.sampling_method = planned_sampling_method
+        self.sampling_completed = True
+        unsampled_rows = self.unsampled_rows
+        self.unsampled_rows = []
+        for col_vals in unsampled_rows:
+            self._insert_row_i(col_vals)
+        self._flush_inserts()
+        self.sqlite_db.conn.commit()
+
+    def get_sampling_description(self):
+        if self.sample is None:
+            return None
+        description = get_sample_size_description(self.sample)
+        if self.sampling_method is not None:
+            description += ', %s' % self.sampling_method
+        if self.sample_seed is not None:
+            description += ', seed %s' % self.sample_seed
+        if self.sampled_row_count is not None:
+            description += ' - %s rows sampled out of %s%s rows' % (self.sampled_row_count,
+                                                                  'about ' if self.is_sampled_population_size_estimated else '',
+                                                                  self.sampled_population_size)
+        return description
+
     def _flush_pre_creation_rows(self, filename):
         for i, col_vals in enumerate(self.pre_creation_rows):
             if self.skip_header and i == 0:
                 # skip header line
                 continue
-            self._insert_row(filename, col_vals)
+            # The same row lists are kept by the column inferer, and normalization might modify them
+            self._insert_row(filename, col_vals[:])
         self._flush_inserts()
         self.pre_creation_rows = []
 
@@ -2263,11 +6330,14 @@ class TableCreator(object):
             # Try to create it along with another "example" line of data
             self.try_to_create_table(filename, col_vals)
 
-        # If the table is still not created, then we don't have enough data, just
-        # store the data and return
-        if not self.table_created:
-            self.pre_creation_rows.append(col_vals)
-            return
+            # If the table is still not created, then we don't have enough data, just
+            # store the data and return
+            if not self.table_created:
+                self.pre_creation_rows.append(col_vals)
+                return
+
+            # The column inferer keeps this row as well, and normalization might modify it
+            col_vals = col_vals[:]
 
 
         # The table already exists, so we can just add a new row
@@ -2280,53 +6350,52 @@ class TableCreator(object):
             self.numeric_column_indices = [idx for idx, column_type in enumerate(
                 column_types) if self.sqlite_db.is_numeric_type(column_type)]
 
-    def nullify_values_if_needed(self, col_vals):
-        new_vals = col_vals[:]
-        col_count = len(col_vals)
-        for i in self.numeric_column_indices:
-            if i >= col_count:
-                continue
-            v = col_vals[i]
-            if v == '':
-                new_vals[i] = None
-        return new_vals
-
-    def normalize_col_vals(self, col_vals):
-        # Make sure that numeric column indices are initializd
-        self.initialize_numeric_column_indices_if_needed()
-
-        col_vals = self.nullify_values_if_needed(col_vals)
+    def _raise_strict_mode_column_count_mismatch(self, actual_col_count):
+        raise StrictModeColumnCountMismatchException(",".join(self.delimited_file_reader.atomic_fns), self.column_inferer.get_column_count(),actual_col_count,self.delimited_file_reader.get_lines_read())
 
-        expected_col_count = self.column_inferer.get_column_count()
-        actual_col_count = len(col_vals)
-        if self.mode == 'strict':
-            if actual_col_count != expected_col_count:
-                raise StrictModeColumnCountMismatchException(",".join(self.delimited_file_reader.atomic_fns), expected_col_count,actual_col_count,self.delimited_file_reader.get_lines_read())
-            return col_vals
+    def initialize_row_normalizer_if_needed(self):
+        # Lazy initialization, since the column count and types are known only after analysis
+        if self.row_normalizer is None:
+            self.initialize_numeric_column_indices_if_needed()
+            self.row_normalizer = create_row_normalizer(self.mode, self.column_inferer.get_column_count(), self.numeric_column_indices,
+                                                        self.input_delimiter, self.projected_column_indices,
+                                                        self._raise_strict_mode_column_count_mismatch)
 
-        # in all non strict mode, we add dummy data to missing columns
+    def normalize_col_vals(self, col_vals):
+        self.initialize_row_normalizer_if_needed()
+        return self.row_normalizer(col_vals)
 
-        if actual_col_count < expected_col_count:
-            col_vals = col_vals + \
-                [None for x in range(expected_col_count - actual_col_count)]
+    def _insert_row_i(self, col_vals):
+        if self.sample is not None and not self.sampling_completed:
+            if self.row_sampler is None:
+                self.unsampled_rows.append(col_vals)
+                return
+            if not self.row_sampler.add(col_vals):
+                return
 
-        # in relaxed mode, we merge all extra columns to the last column value
-        if self.mode == 'relaxed':
-            if actual_col_count > expected_col_count:
-                xxx = col_vals[:expected_col_count - 1] + \
-                    [self.input_delimiter.join([v if v  is not None else '' for v in
-                        col_vals[expected_col_count - 1:]])]
-                return xxx
-            else:
-                return col_vals
+        if self.row_normalizer is None:
+            self.initialize_row_normalizer_if_needed()
+        col_vals = self.row_normalizer(col_vals)
 
-        assert False, "Unidentified parsing mode %s" % self.mode
+        if self.count_only:
+            self.record_count += 1
+            return
 
-    def _insert_row_i(self, col_vals):
-        col_vals = self.normalize_col_vals(col_vals)
+        filter_result = RowFilter.MATCH
+        if self.row_filter is not None:
+            filter_result = self.row_filter.evaluate(col_vals)
+            if filter_result == RowFilter.NO_MATCH:
+                return
+        if filter_result == RowFilter.MATCH:
+            self.matching_rows_inserted += 1
 
         if self.effective_column_names is None:
-            self.effective_column_names = self.column_inferer.column_names[:len(col_vals)]
+            self.effective_column_names = self.get_table_column_names()[:len(col_vals)]
+
+        if self.top_n_collector is not None:
+            # The kept rows are inserted after all rows have been read
+            self.top_n_collector.add(col_vals, filter_result == RowFilter.MATCH)
+            return
 
         if len(self.effective_column_names) > 0:
             self.buffered_inserts.append(col_vals)
@@ -2337,6 +6406,17 @@ class TableCreator(object):
             return
         self._flush_inserts()
 
+    def _insert_top_n_rows(self):
+        rows = self.top_n_collector.get_rows()
+        xprint("Inserting %s rows out of %s rows collected for table %s" % (len(rows),self.top_n_collector.row_number,self.target_sqlite_table_name))
+        self.top_n_collector = None
+        for col_vals in rows:
+            self.buffered_inserts.append(col_vals if len(self.effective_column_names) > 0 else [""])
+            if len(self.buffered_inserts) >= 5000:
+                self._flush_inserts()
+        self._flush_inserts()
+        self.sqlite_db.conn.commit()
+
     def _flush_inserts(self):
         # If the table is still not created, then we don't have enough data
         if not self.table_created:
@@ -2346,9 +6426,43 @@ class TableCreator(object):
             insert_row_stmt = self.sqlite_db.generate_insert_row(
                 self.target_sqlite_table_name, self.effective_column_names)
 
-            self.sqlite_db.update_many(insert_row_stmt, self.buffered_inserts)
+            if self.background_inserter is not None:
+                self.background_inserter.insert(insert_row_stmt, self.buffered_inserts)
+            else:
+                self.sqlite_db.update_many(insert_row_stmt, self.buffered_inserts)
+            if self.streaming_query_executor is not None:
+                self.streaming_query_executor.process_batch(self.sqlite_db, self.target_sqlite_table_name)
         self.buffered_inserts = []
 
+    def _determine_projected_column_indices(self):
+        if self.required_column_names is None:
+            return None
+        column_names = self.column_inferer.get_column_names()
+        indices = [i for i, column_name in enumerate(column_names) if column_name.lower() in self.required_column_names]
+        if len(indices) == len(column_names):
+            return None
+        if len(indices) == 0:
+            # Tables cannot be created without columns, so the first one is kept (e.g. for count(*))
+            indices = [0]
+        xprint("Projecting table %s to columns %s" % (self.target_sqlite_table_name,[column_names[i] for i in indices]))
+        return indices
+
+    def get_table_column_names(self):
+        # Names of the columns which are actually stored in the table
+        if self.projected_column_indices is None:
+            return self.column_inferer.get_column_names()
+        column_names = self.column_inferer.get_column_names()
+        return [column_names[i] for i in self.projected_column_indices]
+
+    def get_table_column_types(self):
+        if self.projected_column_indices is None:
+            return self.column_inferer.get_column_types()
+        column_types = self.column_inferer.get_column_types()
+        return [column_types[i] for i in self.projected_column_indices]
+
+    def get_table_column_dict(self):
+        return OrderedDict(zip(self.get_table_column_names(), self.get_table_column_types()))
+
     def try_to_create_table(self, filename, col_vals):
         if self.table_created:
             # TODO Convert to assertion
@@ -2371,7 +6485,17 @@ class TableCreator(object):
             column_dict = { 'dummy_column_for_empty_tables' : str }
             ordered_column_names = [ 'dummy_column_for_empty_tables' ]
         else:
-            ordered_column_names = self.column_inferer.get_column_names()
+            self.projected_column_indices = self._determine_projected_column_indices()
+            ordered_column_names = self.get_table_column_names()
+            self.row_filter = RowFilter.create(self.pushed_down_conditions, ordered_column_names, self.get_table_column_types())
+            xprint("Row filter for table %s: %s" % (self.target_sqlite_table_name,self.row_filter))
+            if len(self.pushed_down_conditions) > 0 and (self.row_filter is None or not self.row_filter.is_complete):
+                # Matching rows cannot be counted reliably
+                self.row_limit = None
+                self.top_n = None
+            if self.top_n is not None:
+                self.top_n_collector = TopNRowCollector.create(self.top_n[0], self.top_n[1], ordered_column_names, self.get_table_column_types())
+                xprint("Top rows collector for table %s: %s" % (self.target_sqlite_table_name,self.top_n_collector))
 
         # Create the CREATE TABLE statement
         create_table_stmt = self.sqlite_db.generate_create_table(
@@ -2468,7 +6592,24 @@ class QInputParams(object):
             max_column_length_limit=131072,
             read_caching=False,
             write_caching=False,
-            max_attached_sqlite_databases = 10):
+            max_attached_sqlite_databases = 10,
+            parallel_load=1,
+            query_specific_optimizations=False,
+            max_in_memory_aggregation_groups=DEFAULT_MAX_IN_MEMORY_AGGREGATION_GROUPS,
+            pipelined_load=False,
+            read_ahead_queue_depth=8,
+            insert_queue_depth=4,
+            build_gzip_index=False,
+            sample=None,
+            sample_seed=None,
+            byte_range=None,
+            record_range=None,
+            type_inference_rows=DEFAULT_TYPE_INFERENCE_ROWS,
+            type_inference_sample_rows=0,
+            cache_dir=None,
+            cache_max_size=None,
+            cache_validation='stat',
+            content_fingerprint=False):
         self.skip_header = skip_header
         self.delimiter = delimiter
         self.input_encoding = input_encoding
@@ -2485,6 +6626,41 @@ class QInputParams(object):
         self.read_caching = read_caching
         self.write_caching = write_caching
         self.max_attached_sqlite_databases = max_attached_sqlite_databases
+        self.parallel_load = parallel_load
+        # Allows loading only what a specific query needs. Should be enabled only when loaded tables are not
+        # reused by other queries
+        self.query_specific_optimizations = query_specific_optimizations
+        # Aggregations over data streams keep their state in a temporary file above this number of groups
+        self.max_in_memory_aggregation_groups = max_in_memory_aggregation_groups
+        # Reads (and decompresses) files and inserts rows on separate threads, overlapping them with parsing. The
+        # queue depths bound the number of read blocks and insert batches waiting between the stages
+        self.pipelined_load = pipelined_load
+        self.read_ahead_queue_depth = read_ahead_queue_depth
+        self.insert_queue_depth = insert_queue_depth
+        # Builds an access point index sidecar file while reading a gzip file, which allows loading it in parallel
+        self.build_gzip_index = build_gzip_index
+        # Loads only a random sample of the rows of delimited files - Either a fraction of the rows (float) or a row
+        # count (int). A seed makes the sample reproducible
+        self.sample = sample
+        self.sample_seed = sample_seed
+        # Reads only a range of a single delimited file - Records starting within a (start offset, end offset) byte range,
+        # or the (first record, end record) range of the data records. Ends are exclusive, and None means the end of file
+        self.byte_range = byte_range
+        self.record_range = record_range
+        # Column types are inferred from the given number of leading rows, along with a given number of rows sampled
+        # uniformly from the whole data (0 means no sampling)
+        self.type_inference_rows = type_inference_rows
+        self.type_inference_sample_rows = type_inference_sample_rows
+        # Caches of delimited files are stored in this directory instead of next to the files, and the least recently
+        # used ones are evicted above a total size of cache_max_size bytes (see CacheDirectory)
+        self.cache_dir = cache_dir
+        self.cache_max_size = cache_max_size
+        # Caches next to their files are validated using the stat of the files ('stat'), or by analyzing the files again
+        # and comparing the results with the caches ('strict')
+        self.cache_validation = cache_validation
+        # Caches next to their files store the hashes of the chunks of the files, so a file with a different modification
+        # time but the same content can still use its cache (see ContentFingerprint)
+        self.content_fingerprint = content_fingerprint
 
     def merged_with(self,input_params):
         params = QInputParams(**self.__dict__)
@@ -2607,15 +6783,17 @@ class QTextAsData(object):
     def get_dialect_id(self,filename):
         return 'q_dialect_%s' % filename
 
-    def _open_files_and_get_mfss(self,qtable_name,input_params,dialect):
+    def _open_files_and_get_mfss(self,qtable_name,input_params,dialect,load_hints=None):
         materialized_file_dict = OrderedDict()
 
-        materialized_state_type,table_source_type,source_info = detect_qtable_name_source_info(qtable_name,self.data_streams,read_caching_enabled=input_params.read_caching)
+        materialized_state_type,table_source_type,source_info = detect_qtable_name_source_info(qtable_name,self.data_streams,read_caching_enabled=input_params.read_caching and input_params.sample is None,
+                                                                                          cache_filename_suffix=get_range_read_cache_suffix(input_params),
+                                                                                          cache_dir=input_params.cache_dir)
         xprint("Detected source type %s source info %s" % (materialized_state_type,source_info))
 
         if materialized_state_type == MaterializedStateType.DATA_STREAM:
             (data_stream,) = source_info
-            ms = MaterialiedDataStreamState(table_source_type,qtable_name,input_params,dialect,self.engine_id,data_stream,stream_target_db=self.adhoc_db)
+            ms = MaterialiedDataStreamState(table_source_type,qtable_name,input_params,dialect,self.engine_id,data_stream,stream_target_db=self.adhoc_db,load_hints=load_hints)
             effective_qtable_name = data_stream.stream_id
         elif materialized_state_type == MaterializedStateType.QSQL_FILE:
             (qsql_filename,table_name) = source_info
@@ -2629,7 +6807,7 @@ class QTextAsData(object):
             effective_qtable_name = '%s:::%s' % (sqlite_filename, table_name)
         elif materialized_state_type == MaterializedStateType.DELIMITED_FILE:
             (source_qtable_name,_) = source_info
-            ms = MaterializedDelimitedFileState(table_source_type,source_qtable_name, input_params, dialect, self.engine_id)
+            ms = MaterializedDelimitedFileState(table_source_type,source_qtable_name, input_params, dialect, self.engine_id,load_hints=load_hints)
             effective_qtable_name = source_qtable_name
         else:
             assert False, "Unknown file type for qtable %s should have exited with an exception" % (qtable_name)
@@ -2697,7 +6875,7 @@ class QTextAsData(object):
         xprint("should_copy_instead_of_attach: attached_database_count=%s should_copy=%s" % (attached_database_count,x))
         return x
 
-    def _load_data(self,qtable_name,input_params=QInputParams(),stop_after_analysis=False):
+    def _load_data(self,qtable_name,input_params=QInputParams(),stop_after_analysis=False,load_hints=None):
         xprint("Attempting to load data for materialized file names %s" % qtable_name)
 
         q_dialect = self.determine_proper_dialect(input_params)
@@ -2708,7 +6886,8 @@ class QTextAsData(object):
         xprint("qtable metadata for loading is %s" % qtable_name)
         mfss = self._open_files_and_get_mfss(qtable_name,
                                              input_params,
-                                             dialect_id)
+                                             dialect_id,
+                                             load_hints)
         assert len(mfss) == 1, "one MS now encapsulated an entire table"
         mfs = mfss[0]
 
@@ -2755,13 +6934,35 @@ class QTextAsData(object):
     def load_data(self,filename,input_params=QInputParams(),stop_after_analysis=False):
         return self._load_data(filename,input_params,stop_after_analysis=stop_after_analysis)
 
-    def _ensure_data_is_loaded_for_sql(self,sql_object,input_params,data_streams=None,stop_after_analysis=False):
+    def _create_table_load_hints(self,sql_object,input_params,stop_after_analysis,save_db_to_disk_filename,output_writer=None):
+        if not input_params.query_specific_optimizations:
+            return None
+        # The full tables are needed when analyzing, saving the database or writing caches
+        if stop_after_analysis or save_db_to_disk_filename is not None or input_params.write_caching:
+            return None
+        load_hints = sql_object.create_table_load_hints(output_writer,input_params.max_in_memory_aggregation_groups)
+        xprint("Table load hints: %s" % load_hints)
+        return load_hints
+
+    def _get_started_streaming_query_executor(self,load_hints):
+        # The executor is started only if the table has actually been loaded in batches. Otherwise (e.g. for sqlite
+        # and cached tables, or in strict mode) the query is executed normally
+        if load_hints is None:
+            return None
+        for table_load_hints in load_hints.values():
+            executor = table_load_hints.streaming_query_executor
+            if executor is not None and executor.started:
+                return executor
+        return None
+
+    def _ensure_data_is_loaded_for_sql(self,sql_object,input_params,data_streams=None,stop_after_analysis=False,load_hints=None):
         xprint("Ensuring Data load")
         new_table_structures = OrderedDict()
 
         # For each "table name"
         for qtable_name in sql_object.qtable_names:
-            tss = self._load_data(qtable_name,input_params,stop_after_analysis=stop_after_analysis)
+            table_load_hints = load_hints.get(qtable_name) if load_hints is not None else None
+            tss = self._load_data(qtable_name,input_params,stop_after_analysis=stop_after_analysis,load_hints=table_load_hints)
             if tss is not None:
                 xprint("New Table Structures:",new_table_structures)
                 assert qtable_name not in new_table_structures, "new_table_structures was changed not to contain a list as a value"
@@ -2847,7 +7048,7 @@ class QTextAsData(object):
 
         xprint("Query validated")
 
-    def _execute(self,query_str,input_params=None,data_streams=None,stop_after_analysis=False,save_db_to_disk_filename=None):
+    def _execute(self,query_str,input_params=None,data_streams=None,stop_after_analysis=False,save_db_to_disk_filename=None,output_writer=None):
         warnings = []
         error = None
         table_structures = []
@@ -2869,11 +7070,40 @@ class QTextAsData(object):
             # Create SQL statement
             sql_object = Sql('%s' % query_str, self.data_streams)
 
+            load_hints = self._create_table_load_hints(sql_object,effective_input_params,stop_after_analysis,save_db_to_disk_filename,output_writer)
+
             load_start_time = time.time()
             iprint("Going to ensure data is loaded. Currently loaded tables: %s" % str(self.loaded_table_structures_dict))
-            new_table_structures = self._ensure_data_is_loaded_for_sql(sql_object,effective_input_params,data_streams,stop_after_analysis=stop_after_analysis)
+            new_table_structures = self._ensure_data_is_loaded_for_sql(sql_object,effective_input_params,data_streams,stop_after_analysis=stop_after_analysis,load_hints=load_hints)
             iprint("Ensured data is loaded. loaded tables: %s" % self.loaded_table_structures_dict)
 
+            streaming_query_executor = self._get_started_streaming_query_executor(load_hints)
+            if streaming_query_executor is not None and not streaming_query_executor.writes_output:
+                db_results_obj = streaming_query_executor.get_results()
+                iprint("Query results have been computed from the aggregation state")
+                if len(db_results_obj.results) == 0:
+                    warnings.append(QWarning(None, "Warning - data is empty"))
+                return QOutput(
+                    data = db_results_obj.results,
+                    metadata = QMetadata(
+                        table_structures=self.loaded_table_structures_dict,
+                        new_table_structures=new_table_structures,
+                        output_column_name_list=db_results_obj.query_column_names),
+                    warnings = warnings,
+                    error = error)
+            if streaming_query_executor is not None:
+                iprint("Query results have been streamed")
+                if streaming_query_executor.output_row_count == 0:
+                    warnings.append(QWarning(None, "Warning - data is empty"))
+                return QOutput(
+                    data = None,
+                    metadata = QMetadata(
+                        table_structures=self.loaded_table_structures_dict,
+                        new_table_structures=new_table_structures,
+                        output_column_name_list=streaming_query_executor.column_names),
+                    warnings = warnings,
+                    error = error)
+
             self.validate_query(sql_object,self.loaded_table_structures_dict)
 
             iprint("Query validated")
@@ -2905,6 +7135,13 @@ class QTextAsData(object):
             db_results_obj = sql_object.execute_and_fetch(self.query_level_db)
             iprint("Query executed")
 
+            count_only_qtable_name = sql_object.get_count_only_qtable_name() if load_hints is not None else None
+            if count_only_qtable_name is not None:
+                record_count = self.loaded_table_structures_dict[count_only_qtable_name].record_count
+                if record_count is not None:
+                    xprint("Using the record count of %s: %s" % (count_only_qtable_name,record_count))
+                    db_results_obj.results = [(record_count,)]
+
             if len(db_results_obj.results) == 0:
                 warnings.append(QWarning(None, "Warning - data is empty"))
 
@@ -2936,6 +7173,10 @@ class QTextAsData(object):
             error = QError(e,"Bad header row: %s" % e.msg,35)
         except CannotUnzipDataStreamException as e:
             error = QError(e,"Cannot decompress standard input. Pipe the input through zcat in order to decompress.",36)
+        except CannotDecompressInputException as e:
+            error = QError(e,e.msg,37)
+        except RangeReadException as e:
+            error = QError(e,e.msg,38)
         except UniversalNewlinesExistException as e:
             error = QError(e,"Data contains universal newlines. Run q with -U to use universal newlines. Please note that q still doesn't support universal newlines for .gz files or for stdin. Route the data through a regular file to use -U.",103)
         # deprecated, but shouldn't be used:  error = QError(e,"Standard Input must be provided in order to use it as a table",61)
@@ -2989,8 +7230,10 @@ class QTextAsData(object):
 
         return QOutput(data=None,warnings = warnings,error = error , metadata=QMetadata(table_structures=self.loaded_table_structures_dict,new_table_structures=self.loaded_table_structures_dict,output_column_name_list=[]))
 
-    def execute(self,query_str,input_params=None,save_db_to_disk_filename=None):
-        r = self._execute(query_str,input_params,stop_after_analysis=False,save_db_to_disk_filename=save_db_to_disk_filename)
+    def execute(self,query_str,input_params=None,save_db_to_disk_filename=None,output_writer=None):
+        # When an output writer is provided (see QOutputStreamWriter), the results of simple queries might be written
+        # to it while the data is loaded. In that case, the returned output has no data
+        r = self._execute(query_str,input_params,stop_after_analysis=False,save_db_to_disk_filename=save_db_to_disk_filename,output_writer=output_writer)
         return r
 
     def unload(self):
@@ -3008,6 +7251,25 @@ class QTextAsData(object):
 
         return q_output
 
+    def build_record_indices(self,filename_pattern,input_params=None):
+        # Builds and saves the record offset index (see RecordOffsetIndex) of each file matching the pattern. Returns
+        # the filenames along with their indices
+        effective_input_params = self.default_input_params.merged_with(input_params)
+        dialect_id = self.get_dialect_id(filename_pattern)
+        csv.register_dialect(dialect_id, **self.determine_proper_dialect(effective_input_params))
+        dialect_params = get_dialect_params(dialect_id)
+
+        filenames = [filename_pattern] if os.path.exists(filename_pattern) else list(sorted(glob.glob(filename_pattern)))
+        if len(filenames) == 0:
+            raise FileNotFoundException("No files matching '%s' have been found" % filename_pattern)
+
+        results = []
+        for filename in filenames:
+            record_offset_index = RecordOffsetIndex.build(filename, effective_input_params, dialect_params)
+            record_offset_index.save(filename)
+            results.append((filename, record_offset_index))
+        return results
+
 def escape_double_quotes_if_needed(v):
     x = v.replace(six.u('"'), six.u('""'))
     return x
@@ -3094,6 +7356,8 @@ class QOutputPrinter(object):
             print("  Sources:",file=f_out)
             dl = results.metadata.new_table_structures[qtable_name]
             print("    source_type: %s source: %s" % (dl.source_type,dl.source),file=f_out)
+            if dl.sampling is not None:
+                print("  Sampling: %s" % dl.sampling,file=f_out)
             print("  Fields:",file=f_out)
             for n,t in zip(table_structures.column_names,table_structures.sqlite_column_types):
                 print("    `%s` - %s" % (n,t), file=f_out)
@@ -3114,6 +7378,36 @@ class QOutputPrinter(object):
         except KeyboardInterrupt:
             pass
 
+    def get_formatting_dict(self):
+        if self.output_params.formatting:
+            return dict([(x.split("=")[0], x.split("=")[1]) for x in self.output_params.formatting.split(",")])
+        return {}
+
+    def format_row(self,row,formatting_dict,max_lengths=None,skip_formatting=False):
+        row_str = []
+        for i, col in enumerate(row):
+            if str(i + 1) in formatting_dict.keys() and not skip_formatting:
+                fmt_str = formatting_dict[str(i + 1)]
+            else:
+                if max_lengths is not None:
+                    fmt_str = six.u("{{0:<{}}}").format(max_lengths[i])
+                else:
+                    fmt_str = six.u("{}")
+
+            if col is not None:
+                xx = self.output_field_quoting_func(self.output_params.delimiter,col)
+                row_str.append(fmt_str.format(xx))
+            else:
+                row_str.append(fmt_str.format(""))
+
+        return six.u(self.output_params.delimiter).join(row_str) + six.u("\n")
+
+    def create_stream_writer(self,f_out):
+        # Beautified output requires all rows in advance in order to determine the column widths
+        if self.output_params.beautify:
+            return None
+        return QOutputStreamWriter(self,f_out)
+
     def _print_output(self,f_out,f_err,results):
         self.print_errors_and_warnings(f_err,results)
 
@@ -3130,36 +7424,14 @@ class QOutputPrinter(object):
                 data_with_possible_headers = data
             max_lengths = determine_max_col_lengths(data_with_possible_headers,self.output_field_quoting_func,self.output_params.delimiter)
 
-        if self.output_params.formatting:
-            formatting_dict = dict(
-                [(x.split("=")[0], x.split("=")[1]) for x in self.output_params.formatting.split(",")])
-        else:
-            formatting_dict = {}
+        formatting_dict = self.get_formatting_dict()
 
         try:
             if self.output_params.output_header and results.metadata.output_column_name_list is not None:
                 data.insert(0,results.metadata.output_column_name_list)
             for rownum, row in enumerate(data):
-                row_str = []
                 skip_formatting = rownum == 0 and self.output_params.output_header
-                for i, col in enumerate(row):
-                    if str(i + 1) in formatting_dict.keys() and not skip_formatting:
-                        fmt_str = formatting_dict[str(i + 1)]
-                    else:
-                        if self.output_params.beautify:
-                            fmt_str = six.u("{{0:<{}}}").format(max_lengths[i])
-                        else:
-                            fmt_str = six.u("{}")
-
-                    if col is not None:
-                        xx = self.output_field_quoting_func(self.output_params.delimiter,col)
-                        row_str.append(fmt_str.format(xx))
-                    else:
-                        row_str.append(fmt_str.format(""))
-
-
-                xxxx = six.u(self.output_params.delimiter).join(row_str) + six.u("\n")
-                f_out.write(xxxx)
+                f_out.write(self.format_row(row,formatting_dict,max_lengths if self.output_params.beautify else None,skip_formatting))
         except (UnicodeEncodeError, UnicodeError) as e:
             print("Cannot encode data. Error:%s" % e, file=sys.stderr)
             sys.exit(3)
@@ -3182,6 +7454,45 @@ class QOutputPrinter(object):
         except IOError as e:
             pass
 
+class QOutputStreamWriter(object):
+    # Writes query results while they are being produced (see StreamingQueryExecutor), using the formatting
+    # of QOutputPrinter
+    def __init__(self,output_printer,f_out):
+        self.output_printer = output_printer
+        self.f_out = f_out
+        self.formatting_dict = output_printer.get_formatting_dict()
+        self.closed = False
+
+    def is_closed(self):
+        return self.closed
+
+    def start(self,column_names):
+        if self.output_printer.output_params.output_header and column_names is not None:
+            self._write([column_names],skip_formatting=True)
+
+    def write_rows(self,rows):
+        self._write(rows,skip_formatting=False)
+
+    def _write(self,rows,skip_formatting):
+        if self.closed:
+            return
+        try:
+            for row in rows:
+                self.f_out.write(self.output_printer.format_row(row,self.formatting_dict,skip_formatting=skip_formatting))
+            self.f_out.flush()
+        except (UnicodeEncodeError, UnicodeError) as e:
+            print("Cannot encode data. Error:%s" % e, file=sys.stderr)
+            sys.exit(3)
+        except TypeError as e:
+            print("Error while formatting output: %s" % e, file=sys.stderr)
+            sys.exit(4)
+        except IOError as e:
+            if e.errno == 32:
+                # broken pipe, no need to produce more output
+                self.closed = True
+            else:
+                raise
+
 def get_option_with_default(p, option_type, option, default):
     try:
         if not p.has_option('options', option):
@@ -3257,12 +7568,16 @@ def run_standalone():
 
     dump_version_and_stop__if_needed(options)
 
+    show_cache_stats_and_stop__if_needed(options)
+
     STDOUT, default_input_params, q_output_printer, query_strs = parse_options(args, options)
 
     data_streams_dict = initialize_default_data_streams()
 
     q_engine = QTextAsData(default_input_params=default_input_params,data_streams_dict=data_streams_dict)
 
+    build_record_indices_and_stop__if_needed(options, q_engine, query_strs)
+
     execute_queries(STDOUT, options, q_engine, q_output_printer, query_strs)
 
     q_engine.done()
@@ -3278,17 +7593,54 @@ def dump_version_and_stop__if_needed(options):
 
 def dump_defaults_and_stop__if_needed(options, parser):
     if options.dump_defaults:
-        dump_default_values_as_qrc(parser, ['dump-defaults', 'version'])
+        dump_default_values_as_qrc(parser, ['dump-defaults', 'version', 'build_index', 'byte_range', 'record_range', 'cache_stats'])
         sys.exit(0)
 
 
+def get_cache_max_size(options):
+    if options.cache_max_size is None:
+        return None
+    try:
+        return parse_cache_size(options.cache_max_size)
+    except ValueError:
+        print("Cache maximum size must be a byte count, optionally with a K/M/G/T suffix (%s)" % options.cache_max_size, file=sys.stderr)
+        sys.exit(126)
+
+
+def show_cache_stats_and_stop__if_needed(options):
+    if not options.cache_stats:
+        return
+    if options.cache_dir is None:
+        print("A cache directory must be provided (using --cache-dir or the .qrc file) in order to show cache stats", file=sys.stderr)
+        sys.exit(126)
+    CacheDirectory(options.cache_dir, get_cache_max_size(options)).print_stats(sys.stdout)
+    sys.exit(0)
+
+
+def build_record_indices_and_stop__if_needed(options, q_engine, filename_patterns):
+    # With --build-index, the parameters are filenames (or glob patterns) instead of queries
+    if not options.build_index:
+        return
+    for filename_pattern in filename_patterns:
+        try:
+            for filename, record_offset_index in q_engine.build_record_indices(filename_pattern):
+                print("Built record index %s: %s records, %s offsets" % (RecordOffsetIndex.get_index_filename(filename),
+                      record_offset_index.record_count, len(record_offset_index.offsets)), file=sys.stdout)
+        except (RecordIndexException, FileNotFoundException) as e:
+            print(e.msg, file=sys.stderr)
+            sys.exit(122)
+    q_engine.done()
+    sys.exit(0)
+
+
 def execute_queries(STDOUT, options, q_engine, q_output_printer, query_strs):
     for query_str in query_strs:
         if options.analyze_only:
             q_output = q_engine.analyze(query_str)
             q_output_printer.print_analysis(STDOUT, sys.stderr, q_output)
         else:
-            q_output = q_engine.execute(query_str, save_db_to_disk_filename=options.save_db_to_disk_filename)
+            q_output = q_engine.execute(query_str, save_db_to_disk_filename=options.save_db_to_disk_filename,
+                                        output_writer=q_output_printer.create_stream_writer(STDOUT))
             q_output_printer.print_output(STDOUT, sys.stderr, q_output)
 
         if q_output.status == 'error':
@@ -3336,6 +7688,19 @@ def initialize_command_line_parser(p, qrc_filename):
         default_query_filename = get_option_with_default(p, 'string', 'query_filename', None)
         default_query_encoding = get_option_with_default(p, 'string', 'query_encoding', locale.getpreferredencoding())
         default_max_attached_sqlite_databases = get_option_with_default(p,'int','max_attached_sqlite_databases', 10)
+        default_parallel_load = get_option_with_default(p, 'int', 'parallel_load', 1)
+        default_pipelined_load = get_option_with_default(p, 'boolean', 'pipelined_load', False)
+        default_read_ahead_queue_depth = get_option_with_default(p, 'int', 'read_ahead_queue_depth', 8)
+        default_insert_queue_depth = get_option_with_default(p, 'int', 'insert_queue_depth', 4)
+        default_build_gzip_index = get_option_with_default(p, 'boolean', 'build_gzip_index', False)
+        default_sample = get_option_with_default(p, 'string', 'sample', None)
+        default_sample_seed = get_option_with_default(p, 'int', 'sample_seed', None)
+        default_type_inference_rows = get_option_with_default(p, 'int', 'type_inference_rows', DEFAULT_TYPE_INFERENCE_ROWS)
+        default_type_inference_sample_rows = get_option_with_default(p, 'int', 'type_inference_sample_rows', 0)
+        default_cache_dir = get_option_with_default(p, 'string', 'cache_dir', None)
+        default_cache_max_size = get_option_with_default(p, 'string', 'cache_max_size', None)
+        default_cache_validation = get_option_with_default(p, 'string', 'cache_validation', 'stat')
+        default_content_fingerprint = get_option_with_default(p, 'boolean', 'content_fingerprint', False)
     except IncorrectDefaultValueException as e:
         print("Incorrect value '%s' for option %s in .qrc file %s (option type is %s)" % (
         e.actual_value, e.option, qrc_filename, e.option_type))
@@ -3347,7 +7712,17 @@ def initialize_command_line_parser(p, qrc_filename):
     parser.add_argument("-S", "--save-db-to-disk", dest="save_db_to_disk_filename", default=default_save_db_to_disk,
                       help="Save database to an sqlite database file")
     parser.add_argument("-C", "--caching-mode", default=default_caching_mode,
-                      help="Choose the autocaching mode (none/read/readwrite). Autocaches files to disk db so further queries will be faster. Caching is done to a side-file with the same name of the table, but with an added extension .qsql")
+                      help="Choose the autocaching mode (none/read/readwrite). Autocaches files to disk db so further queries will be faster. Caching is done to a side-file with the same name of the table, but with an added extension .qsql. In readwrite mode, when an uncompressed file has only been appended to since it has been cached, just the new complete records are parsed and added to the cache (e.g. for growing log files)")
+    parser.add_argument("--cache-dir", default=default_cache_dir,
+                      help="Store the caches of delimited files (see -C) in this directory instead of next to the files, e.g. when the files are on a read-only filesystem. Caches are named after the content signature of the data, so a cache is used only while the file and the reading options are the same. Appended rows are not added to these caches")
+    parser.add_argument("--cache-max-size", default=default_cache_max_size,
+                      help="Maximum total size of the caches in the cache directory, in bytes or with a K/M/G/T suffix (e.g. 10G). The least recently used caches are deleted when it is exceeded. Defaults to no limit")
+    parser.add_argument("--cache-validation", default=default_cache_validation,
+                      help="How caches next to the files are validated before they are used (stat/strict). In stat mode, a cache is used if the size, modification time and inode of the file and the reading options are the ones it has been written with, and the file is analyzed again only if they differ. In strict mode, the first rows of the file are analyzed again and compared with the cache, unless the file has the content fingerprint of the cache (see --content-fingerprint). Defaults to stat")
+    parser.add_argument("--content-fingerprint", default=default_content_fingerprint, action="store_true",
+                      help="Store hashes of fixed-size chunks of the file in its cache (hashed in parallel). A file which has been copied or touched without changing its content (e.g. by rsync or backup tools) can then still use its cache, and appending to a file is told apart from rewriting it by comparing all of its cached part")
+    parser.add_argument("--cache-stats", default=False, action="store_true",
+                      help="Print the caches in the cache directory, their sizes, last access times and sources, and exit")
     parser.add_argument("--dump-defaults", action="store_true",
                       help="Dump all default values for parameters and exit. Can be used in order to make sure .qrc file content is being read properly.")
     parser.add_argument("--max-attached-sqlite-databases", default=default_max_attached_sqlite_databases,type=int,
@@ -3368,7 +7743,7 @@ def initialize_command_line_parser(p, qrc_filename):
     input_data_option_group.add_argument("-e", "--encoding", default=default_encoding,
                                        help="Input file encoding. Defaults to UTF-8. set to none for not setting any encoding - faster, but at your own risk...")
     input_data_option_group.add_argument("-z", "--gzipped", default=default_gzipped, action="store_true",
-                                       help="Data is gzipped. Useful for reading from stdin. For files, .gz means automatic gunzipping")
+                                       help="Data is gzipped. gzip, bz2, xz and zstd (requires the zstandard module) compressed files and standard input are detected automatically, so this is needed only for gzipped files without a .gz suffix whose contents cannot be recognized")
     input_data_option_group.add_argument("-A", "--analyze-only", default=default_analyze_only,
                                        action='store_true',
                                        help="Analyze sample input and provide information about data types")
@@ -3388,6 +7763,10 @@ def initialize_command_line_parser(p, qrc_filename):
     input_data_option_group.add_argument("--as-text", dest="disable_column_type_detection",
                                        default=default_disable_column_type_detection, action="store_true",
                                        help="Don't detect column types - All columns will be treated as text columns")
+    input_data_option_group.add_argument("--type-inference-rows", default=default_type_inference_rows, type=int,
+                                       help="Number of rows at the beginning of the data which are used for detecting the column types. Defaults to %s" % DEFAULT_TYPE_INFERENCE_ROWS)
+    input_data_option_group.add_argument("--type-inference-sample-rows", default=default_type_inference_sample_rows, type=int,
+                                       help="Number of additional rows, sampled uniformly from the whole data, which are used for detecting the column types, so a value which appears only late in the data (e.g. a decimal number in a mostly integer column) is detected as well. Single uncompressed files are sampled by seeking to random positions when possible, and other files are read in advance. Data streams (e.g. stdin) are not sampled. Defaults to 0 (no sampling)")
     input_data_option_group.add_argument("-w", "--input-quoting-mode", 
                                        default=default_input_quoting_mode,
                                        help="Input quoting mode. Possible values are all, minimal and none. Note the slightly misleading parameter name, and see the matching -W parameter for output quoting.")
@@ -3397,6 +7776,26 @@ def initialize_command_line_parser(p, qrc_filename):
     input_data_option_group.add_argument("-U", "--with-universal-newlines", 
                                        default=default_with_universal_newlines, action="store_true",
                                        help="Expect universal newlines in the data. Limitation: -U works only with regular files for now, stdin or .gz files are not supported yet.")
+    input_data_option_group.add_argument("--parallel-load", default=default_parallel_load, type=int,
+                                       help="Number of worker processes to use for loading delimited files. Each file of a multi-file (glob) table is parsed by its own worker, large uncompressed files are also split into chunks at record boundaries, and multi-member gzip files (e.g. concatenated or BGZF files) are decompressed in parallel. The parsed parts are merged in their original order. Defaults to 1 (no parallelism)")
+    input_data_option_group.add_argument("--pipelined-load", default=default_pipelined_load, action="store_true",
+                                       help="Read (and decompress) files and insert rows on separate threads, overlapping them with parsing. Files which are memory mapped (regular uncompressed files) and stdin are not read ahead, but their inserts are still pipelined. Stall times of each stage are printed in verbose mode")
+    input_data_option_group.add_argument("--read-ahead-queue-depth", default=default_read_ahead_queue_depth, type=int,
+                                       help="Maximum number of blocks read ahead of the parser in a pipelined load. Defaults to 8")
+    input_data_option_group.add_argument("--insert-queue-depth", default=default_insert_queue_depth, type=int,
+                                       help="Maximum number of row batches waiting to be inserted in a pipelined load. Defaults to 4")
+    input_data_option_group.add_argument("--build-index", default=False, action="store_true",
+                                       help="Build a record index of each of the files provided instead of queries (e.g. q -d , --build-index file.csv), and store it next to the file (with a .qidx suffix). The index is built using the current encoding and delimiter/quoting options, and is used by queries with the same options while the file is unchanged. It provides the record count of the file (e.g. for count(*)), and allows --parallel-load to split quoted files without scanning them")
+    input_data_option_group.add_argument("--build-gzip-index", default=default_build_gzip_index, action="store_true",
+                                       help="Build an access point index of each single-member gzip file that is read fully, and store it next to the file (with a .qgzidx suffix). An up-to-date index allows --parallel-load to split the gzip file between the workers")
+    input_data_option_group.add_argument("--byte-range", default=None,
+                                       help="Read only the records of the file which start within the given START:END byte range (e.g. --byte-range 0:1000000). Reading starts at the first record boundary at or after START and stops at the first record boundary at or after END, so consecutive ranges split a file between multiple q processes without missing or duplicating any record. The header (-H) is always read from the beginning of the file. Works only with a single uncompressed file. Quoted files are parsed from their beginning to find the boundaries, unless they have a record index (see --build-index)")
+    input_data_option_group.add_argument("--record-range", default=None,
+                                       help="Read only the data records A to B-1 of the file (counting from 0, not including the header), given as A:B. Either side can be omitted. Uses the record index of the file (see --build-index) when there is one, instead of parsing all records before the range")
+    input_data_option_group.add_argument("--sample", default=default_sample,
+                                       help="Load only a uniform random sample of the rows of each delimited file table, for fast approximate answers. Either a fraction of the rows (e.g. 0.01) or a row count (e.g. 1000). Single uncompressed files are sampled by seeking to random positions when possible (using the record index if there is one, see --build-index), and other inputs are read fully and sampled while reading. Samples are never cached")
+    input_data_option_group.add_argument("--sample-seed", default=default_sample_seed, type=int,
+                                       help="Seed of the random number generator used by --sample, which makes the sample reproducible")
     # -----------------------------------------------
     output_data_option_group = parser.add_argument_group("Output Options")
     output_data_option_group.add_argument("-D", "--output-delimiter", 
@@ -3601,12 +8000,47 @@ def parse_options(args, options):
         print("caching mode must be none,read or readwrite",file=sys.stderr)
         sys.exit(85)
     read_caching = options.caching_mode in ['read', 'readwrite']
+    if options.cache_validation not in ['stat', 'strict']:
+        print("cache validation mode must be stat or strict", file=sys.stderr)
+        sys.exit(127)
     write_caching = options.caching_mode in ['readwrite']
 
     if options.max_attached_sqlite_databases <= 3:
         print("Max attached sqlite databases must be larger than 3")
         sys.exit(99)
 
+    if options.parallel_load < 1:
+        print("Parallel load worker count must be at least 1", file=sys.stderr)
+        sys.exit(120)
+
+    if options.read_ahead_queue_depth < 1 or options.insert_queue_depth < 1:
+        print("Pipelined load queue depths must be at least 1", file=sys.stderr)
+        sys.exit(121)
+
+    try:
+        byte_range = parse_range(options.byte_range) if options.byte_range is not None else None
+        record_range = parse_range(options.record_range) if options.record_range is not None else None
+    except ValueError:
+        print("Ranges must be of the form START:END, where START is at least 0 and END is not smaller than START", file=sys.stderr)
+        sys.exit(124)
+    if byte_range is not None and record_range is not None:
+        print("Only one of --byte-range and --record-range can be used", file=sys.stderr)
+        sys.exit(124)
+
+    sample = None
+    if options.sample is not None:
+        try:
+            sample = parse_sample_size(options.sample)
+        except ValueError:
+            print("Sample must be either a fraction larger than 0 and at most 1, or a row count of at least 1 (%s)" % options.sample, file=sys.stderr)
+            sys.exit(123)
+
+    if options.type_inference_rows < 1 or options.type_inference_sample_rows < 0:
+        print("Type inference row count must be at least 1, and type inference sample row count must be at least 0", file=sys.stderr)
+        sys.exit(125)
+
+    cache_max_size = get_cache_max_size(options)
+
     default_input_params = QInputParams(skip_header=options.skip_header,
                                         delimiter=options.delimiter,
                                         input_encoding=options.encoding,
@@ -3622,7 +8056,23 @@ def parse_options(args, options):
                                         max_column_length_limit=max_column_length_limit,
                                         read_caching=read_caching,
                                         write_caching=write_caching,
-                                        max_attached_sqlite_databases=options.max_attached_sqlite_databases)
+                                        max_attached_sqlite_databases=options.max_attached_sqlite_databases,
+                                        parallel_load=options.parallel_load,
+                                        pipelined_load=options.pipelined_load,
+                                        read_ahead_queue_depth=options.read_ahead_queue_depth,
+                                        insert_queue_depth=options.insert_queue_depth,
+                                        build_gzip_index=options.build_gzip_index,
+                                        sample=sample,
+                                        sample_seed=options.sample_seed,
+                                        byte_range=byte_range,
+                                        record_range=record_range,
+                                        type_inference_rows=options.type_inference_rows,
+                                        type_inference_sample_rows=options.type_inference_sample_rows,
+                                        cache_dir=options.cache_dir,
+                                        cache_max_size=cache_max_size,
+                                        cache_validation=options.cache_validation,
+                                        content_fingerprint=options.content_fingerprint,
+                                        query_specific_optimizations=len(query_strs) == 1)
 
     output_params = QOutputParams(
         delimiter=options.output_delimiter,
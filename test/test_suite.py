@@ -32,16 +32,23 @@ import pprint
 import six
 from six.moves import range
 import codecs
+import csv
+import io
 import itertools
 from gzip import GzipFile
 import pytest
 import uuid
 import sqlite3
+import hashlib
 import re
 import collections
 
 sys.path.append(os.path.join(os.path.abspath(os.path.dirname(sys.argv[0])),'..','bin'))
-from bin.q import QTextAsData, QOutput, QOutputPrinter, QInputParams, DataStream, Sqlite3DB
+from bin.q import QTextAsData, QOutput, QOutputPrinter, QInputParams, DataStream, Sqlite3DB, create_row_normalizer, generate_mmap_file_lines, ParallelGzipDecompressor, detect_compression, \
+    GzipIndex, GzipIndexBuilder, generate_gzip_index_point_blocks, read_gzip_index_region, RecordOffsetIndex, \
+    RecordIndexException, RowSampler, parse_sample_size, TableColumnInferer, ContentFingerprint, calculate_chunk_hashes, tokenize_sql, \
+    generate_split_tokenized_records
+import bin.q
 
 # q uses this encoding as the default output encoding. Some of the tests use it in order to 
 # make sure that the output is correctly encoded
@@ -879,10 +886,11 @@ class SaveToSqliteTests(AbstractQTestCase):
         cmd = '%s -H "select count(*) from %s"' % (Q_EXECUTABLE,tmpfilename)
         retcode, o, e = run_command(cmd)
 
-        self.assertEqual(retcode, 59)
+        # The file is a gzipped tar file, which is decompressed automatically and then fails to be parsed
+        self.assertEqual(retcode, 35)
         self.assertEqual(len(o), 0)
-        self.assertEqual(len(e), 1)
-        self.assertTrue(e[0].startswith(six.b("Could not parse the input. Please make sure to set the proper -w input-wrapping parameter for your input, and that you use the proper input encoding (-e). Error:")))
+        self.assertTrue(len(e) > 1)
+        self.assertTrue(e[0].startswith(six.b("Bad header row: Header must contain only strings and not numbers or empty strings:")))
 
 class OldSaveDbToDiskTests(AbstractQTestCase):
 
@@ -2168,6 +2176,145 @@ class ManyOpenFilesTests(AbstractQTestCase):
         self.cleanup_folder(tmpfolder2)
 
 
+class ParallelLoadTests(AbstractQTestCase):
+
+    def _create_large_file(self,line_generator,line_count,header=None):
+        lines = []
+        if header is not None:
+            lines.append(header)
+        lines += [line_generator(i) for i in range(line_count)]
+        return self.create_file_with_data(six.b("\n".join(lines) + "\n"))
+
+    def _run_serial_and_parallel(self,params,query):
+        serial_results = run_command('%s %s "%s"' % (Q_EXECUTABLE,params,query))
+        parallel_results = run_command('%s %s --parallel-load 3 "%s"' % (Q_EXECUTABLE,params,query))
+        return serial_results,parallel_results
+
+    def test_parallel_load_matches_serial_load(self):
+        tmpfile = self._create_large_file(lambda i: '%s,name_%s,%s,some text %s' % (i,i % 13,'' if i % 7 == 0 else i * 1.5,i),
+                                          60000,header='id,name,value,text')
+
+        serial,parallel = self._run_serial_and_parallel('-d , -H','select count(*),count(value),sum(value),max(text) from %s' % tmpfile.name)
+
+        self.assertEqual(serial[0],0)
+        self.assertEqual(parallel[0],0)
+        self.assertEqual(len(parallel[2]),0)
+        self.assertEqual(parallel[1],serial[1])
+        self.assertEqual(parallel[1][0].split(six.b(','))[:2],[six.b('60000'),six.b('51428')])
+
+        self.cleanup(tmpfile)
+
+    def test_parallel_load_preserves_row_order(self):
+        tmpfile = self._create_large_file(lambda i: '%s,%s' % (i,i * 2),80000)
+
+        cmd = Q_EXECUTABLE + ' -d , --parallel-load 4 "select sum(c1 != rn - 1) from (select c1,row_number() over () rn from %s)"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(len(e),0)
+        self.assertEqual(o,[six.b('0')])
+
+        self.cleanup(tmpfile)
+
+    def test_parallel_load_with_quoted_multiline_fields(self):
+        def line(i):
+            if i % 5 == 0:
+                return '%s,"quoted, value\nwith newline %s",%s' % (i,i,i * 2)
+            return '%s,plain %s,%s' % (i,i,i * 2)
+        tmpfile = self._create_large_file(line,60000)
+
+        serial,parallel = self._run_serial_and_parallel('-d ,','select count(*),sum(c1),max(c2),sum(length(c2)) from %s' % tmpfile.name)
+
+        self.assertEqual(serial[0],0)
+        self.assertEqual(parallel[0],0)
+        self.assertEqual(parallel[1],serial[1])
+        self.assertEqual(parallel[1][0].split(six.b(','))[0],six.b('60000'))
+
+        self.cleanup(tmpfile)
+
+    def test_parallel_load_strict_mode_error_is_identical_to_serial(self):
+        tmpfile = self._create_large_file(lambda i: '%s,%s,%s' % (i,i,i) if i != 54321 else '%s,%s' % (i,i),60000)
+
+        serial,parallel = self._run_serial_and_parallel('-d , -m strict','select count(*) from %s' % tmpfile.name)
+
+        self.assertEqual(serial[0],2)
+        self.assertEqual(parallel[0],2)
+        self.assertEqual(parallel[1],[])
+        self.assertEqual(parallel[2],serial[2])
+        self.assertTrue(six.b('row 54322.') in parallel[2][0])
+
+        self.cleanup(tmpfile)
+
+    def test_parallel_load_cache_is_identical_to_serial_cache(self):
+        tmpfile = self._create_large_file(lambda i: '%s,%s' % (i,'x' * (i % 20)),60000,header='a,b')
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H --parallel-load 3 -C readwrite "select count(*) from %s"' % tmpfile.name)
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('60000')])
+        self.assertTrue(os.path.exists('%s.qsql' % tmpfile.name))
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H -C read "select sum(a),sum(length(b)) from %s"' % tmpfile.name)
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('%s,%s' % (sum(range(60000)),sum(i % 20 for i in range(60000))))])
+
+        os.remove('%s.qsql' % tmpfile.name)
+        self.cleanup(tmpfile)
+
+    def _create_glob_folder(self,file_contents):
+        return self.create_folder_with_files(dict([('file_%s.csv' % i,six.b(content)) for i,content in enumerate(file_contents)]),'parallel_glob','test')
+
+    def test_parallel_load_of_glob_matches_serial_load(self):
+        # The first file is shorter than the analysis sample, so analysis spans two files
+        file_contents = ['a,b\n' + ''.join(['%s,first_%s\n' % (i,i) for i in range(30)])]
+        for f in range(1,5):
+            file_contents.append('a,b\n' + ''.join(['%s,v_%s_%s\n' % (i * f,f,i) for i in range(5000)]))
+        tmpfolder = self._create_glob_folder(file_contents)
+
+        serial,parallel = self._run_serial_and_parallel('-d , -H','select count(*),sum(a),group_concat(b) from %s/*' % tmpfolder)
+
+        self.assertEqual(serial[0],0)
+        self.assertEqual(parallel[0],0)
+        self.assertEqual(len(parallel[2]),0)
+        self.assertEqual(parallel[1],serial[1])
+        self.assertTrue(parallel[1][0].startswith(six.b('20030,')))
+
+    def test_parallel_load_of_glob_with_gzipped_files(self):
+        tmpfolder = self._create_glob_folder(['a,b\n' + ''.join(['%s,v_%s_%s\n' % (i,f,i) for i in range(3000)]) for f in range(3)])
+        import gzip
+        with open(os.path.join(tmpfolder,'file_1.csv'),'rb') as f_in:
+            with gzip.open(os.path.join(tmpfolder,'file_1.csv.gz'),'wb') as f_out:
+                f_out.write(f_in.read())
+        os.remove(os.path.join(tmpfolder,'file_1.csv'))
+
+        serial,parallel = self._run_serial_and_parallel('-d , -H','select count(*),sum(a),max(b),min(rowid) from %s/*' % tmpfolder)
+
+        self.assertEqual(serial[0],0)
+        self.assertEqual(parallel[0],0)
+        self.assertEqual(parallel[1],serial[1])
+        self.assertEqual(parallel[1],[six.b('9000,13495500,v_2_999,1')])
+
+    def test_parallel_load_of_glob_with_mismatching_extra_header(self):
+        file_contents = ['a,b\n' + ''.join(['%s,%s\n' % (i,i) for i in range(200)]) for f in range(3)]
+        file_contents[2] = 'a,c\n' + ''.join(['%s,%s\n' % (i,i) for i in range(200)])
+        tmpfolder = self._create_glob_folder(file_contents)
+
+        serial,parallel = self._run_serial_and_parallel('-d , -H','select count(*) from %s/*' % tmpfolder)
+
+        self.assertEqual(serial[0],35)
+        self.assertEqual(parallel[0],35)
+        self.assertEqual(parallel[1],[])
+        self.assertEqual(parallel[2],serial[2])
+        self.assertTrue(parallel[2][0].startswith(six.b("Bad header row: Extra header 'a,c' in file '%s/file_2.csv' mismatches original header 'a,b'" % tmpfolder)))
+
+    def test_invalid_parallel_load_value(self):
+        cmd = Q_EXECUTABLE + ' --parallel-load 0 "select 1"'
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,120)
+        self.assertEqual(len(o),0)
+        self.assertEqual(e,[six.b('Parallel load worker count must be at least 1')])
+
+
 class GzippingTests(AbstractQTestCase):
 
     def test_gzipped_file(self):
@@ -2535,18 +2682,17 @@ class StdInTests(AbstractQTestCase):
         self.assertEqual(o[1], sample_data_rows[1])
         self.assertEqual(o[2], sample_data_rows[2])
 
-    def test_attempt_to_unzip_stdin(self):
+    def test_unzip_stdin(self):
         tmpfile = self.create_file_with_data(
             six.b('\x1f\x8b\x08\x08\xf2\x18\x12S\x00\x03xxxxxx\x003\xe42\xe22\xe62\xe12\xe52\xe32\xe7\xb2\xe0\xb2\xe424\xe0\x02\x00\xeb\xbf\x8a\x13\x15\x00\x00\x00'))
 
-        cmd = 'cat %s | ' % tmpfile.name + Q_EXECUTABLE + ' -z "select sum(c1),avg(c1) from -"'
-
-        retcode, o, e = run_command(cmd)
-        self.assertTrue(retcode != 0)
-        self.assertTrue(len(o) == 0)
-        self.assertTrue(len(e) == 1)
+        for flags in ['-z', '']:
+            cmd = 'cat %s | ' % tmpfile.name + Q_EXECUTABLE + ' %s "select sum(c1),avg(c1) from -"' % flags
 
-        self.assertEqual(e[0],six.b('Cannot decompress standard input. Pipe the input through zcat in order to decompress.'))
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode, 0)
+            self.assertEqual(len(e), 0)
+            self.assertEqual(o, [six.b('55 5.5')])
 
         self.cleanup(tmpfile)
 
@@ -3059,8 +3205,13 @@ output_delimiter=|
         tmp_qrc_file = self.create_file_with_data(six.b('''[options]
 analyze_only=True
 beautify=True
+build_gzip_index=True
+cache_dir=cache-dir
+cache_max_size=10G
+cache_validation=strict
 caching_mode=readwrite
 column_count=32
+content_fingerprint=True
 delimiter=,
 disable_column_type_detection=True
 disable_double_double_quoting=False
@@ -3069,6 +3220,7 @@ encoding=ascii
 formatting=xxx
 gzipped=True
 input_quoting_mode=all
+insert_queue_depth=6
 keep_leading_whitespace_in_values=True
 list_user_functions=True
 max_attached_sqlite_databases=888
@@ -3079,14 +3231,21 @@ output_encoding=utf-8
 output_header=True
 output_quoting_mode=all
 overwrite_qsql=False
+parallel_load=4
 pipe_delimited=True
 pipe_delimited_output=True
+pipelined_load=True
 query_encoding=ascii
 query_filename=query-filename
+read_ahead_queue_depth=5
+sample=0.5
+sample_seed=42
 save_db_to_disk_filename=save-db-to-disk-filename
 skip_header=True
 tab_delimited=True
 tab_delimited_output=true
+type_inference_rows=200
+type_inference_sample_rows=1000
 verbose=True
 with_universal_newlines=True
 '''))
@@ -3095,7 +3254,7 @@ with_universal_newlines=True
         retcode, o, e = run_command(cmd, env_to_inject=env_to_inject)
 
         self.assertEqual(retcode, 0)
-        self.assertEqual(len(o), 34)
+        self.assertEqual(len(o), 47)
         self.assertEqual(len(e), 0)
 
         self.assertEqual(o[0],six.b('[options]'))
@@ -3108,8 +3267,13 @@ with_universal_newlines=True
 
         self.assertEqual(m[six.b('analyze_only')],six.b('True'))
         self.assertEqual(m[six.b('beautify')],six.b('True'))
+        self.assertEqual(m[six.b('build_gzip_index')],six.b('True'))
+        self.assertEqual(m[six.b('cache_dir')],six.b('cache-dir'))
+        self.assertEqual(m[six.b('cache_max_size')],six.b('10G'))
+        self.assertEqual(m[six.b('cache_validation')],six.b('strict'))
         self.assertEqual(m[six.b('caching_mode')],six.b('readwrite'))
         self.assertEqual(m[six.b('column_count')],six.b('32'))
+        self.assertEqual(m[six.b('content_fingerprint')],six.b('True'))
         self.assertEqual(m[six.b('delimiter')],six.b(','))
         self.assertEqual(m[six.b('disable_column_type_detection')],six.b('True'))
         self.assertEqual(m[six.b('disable_double_double_quoting')],six.b('False'))
@@ -3118,6 +3282,7 @@ with_universal_newlines=True
         self.assertEqual(m[six.b('formatting')],six.b('xxx'))
         self.assertEqual(m[six.b('gzipped')],six.b('True'))
         self.assertEqual(m[six.b('input_quoting_mode')],six.b('all'))
+        self.assertEqual(m[six.b('insert_queue_depth')],six.b('6'))
         self.assertEqual(m[six.b('keep_leading_whitespace_in_values')],six.b('True'))
         self.assertEqual(m[six.b('list_user_functions')],six.b('True'))
         self.assertEqual(m[six.b('max_attached_sqlite_databases')],six.b('888'))
@@ -3128,14 +3293,21 @@ with_universal_newlines=True
         self.assertEqual(m[six.b('output_header')],six.b('True'))
         self.assertEqual(m[six.b('output_quoting_mode')],six.b('all'))
         self.assertEqual(m[six.b('overwrite_qsql')],six.b('False'))
+        self.assertEqual(m[six.b('parallel_load')],six.b('4'))
         self.assertEqual(m[six.b('pipe_delimited')],six.b('True'))
         self.assertEqual(m[six.b('pipe_delimited_output')],six.b('True'))
+        self.assertEqual(m[six.b('pipelined_load')],six.b('True'))
         self.assertEqual(m[six.b('query_encoding')],six.b('ascii'))
         self.assertEqual(m[six.b('query_filename')],six.b('query-filename'))
+        self.assertEqual(m[six.b('read_ahead_queue_depth')],six.b('5'))
+        self.assertEqual(m[six.b('sample')],six.b('0.5'))
+        self.assertEqual(m[six.b('sample_seed')],six.b('42'))
         self.assertEqual(m[six.b('save_db_to_disk_filename')],six.b('save-db-to-disk-filename'))
         self.assertEqual(m[six.b('skip_header')],six.b('True'))
         self.assertEqual(m[six.b('tab_delimited')],six.b('True'))
         self.assertEqual(m[six.b('tab_delimited_output')],six.b('True'))
+        self.assertEqual(m[six.b('type_inference_rows')],six.b('200'))
+        self.assertEqual(m[six.b('type_inference_sample_rows')],six.b('1000'))
         self.assertEqual(m[six.b('verbose')],six.b('True'))
         self.assertEqual(m[six.b('with_universal_newlines')],six.b('True'))
 
@@ -4227,6 +4399,376 @@ class CachingTests(AbstractQTestCase):
         self.cleanup(tmpfile2)
 
 
+    def _get_covered_file_prefix_columns(self, qsql_filename):
+        conn = sqlite3.connect(qsql_filename)
+        try:
+            return conn.execute('select covered_size, covered_record_count from _qcatalog').fetchall()[0]
+        finally:
+            conn.close()
+
+    def test_appended_rows_are_added_to_the_cache(self):
+        tmpfile = self.create_file_with_data(six.b('a,b\n' + ''.join(['%s,v%s\n' % (i, i) for i in range(150)])))
+        expected_cache_filename = tmpfile.name + '.qsql'
+        cmd = Q_EXECUTABLE + ' -H -d , "select count(*),sum(a),max(b) from %s" -C readwrite' % tmpfile.name
+
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('150,11175,v99')])
+        self.assertEqual(self._get_covered_file_prefix_columns(expected_cache_filename), (os.stat(tmpfile.name).st_size, 150))
+
+        # The last appended record might still be written, so the cache is not extended and doesn't match the file
+        original_size = os.stat(tmpfile.name).st_size
+        with open(tmpfile.name,'ab') as f:
+            f.write(six.b('150,w1\n151,w2\n152,w'))
+        for caching_mode in ['readwrite', 'read']:
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -H -d , "select count(*),sum(a),max(b) from %s" -C %s' % (tmpfile.name,caching_mode))
+            self.assertEqual(retcode, 80)
+        self.assertEqual(self._get_covered_file_prefix_columns(expected_cache_filename), (original_size, 150))
+
+        with open(tmpfile.name,'ab') as f:
+            f.write(six.b('3\n'))
+        for caching_mode in ['readwrite', 'read', 'none']:
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -H -d , "select count(*),sum(a),max(b) from %s" -C %s' % (tmpfile.name,caching_mode))
+            self.assertEqual(retcode, 0)
+            self.assertEqual(len(e), 0)
+            self.assertEqual(o, [six.b('153,11628,w3')])
+
+        os.remove(expected_cache_filename)
+        self.cleanup(tmpfile)
+
+    def test_appended_rows_are_not_added_to_the_cache_when_the_file_has_been_modified(self):
+        data = six.b('a,b\n' + ''.join(['%s,v%s\n' % (i, i) for i in range(150)]))
+        tmpfile = self.create_file_with_data(data)
+        expected_cache_filename = tmpfile.name + '.qsql'
+        cmd = Q_EXECUTABLE + ' -H -d , "select count(*) from %s" -C readwrite' % tmpfile.name
+
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode, 0)
+
+        # The end of the cached part has been modified
+        self.write_file(tmpfile.name, data[:-2] + six.b('X\n150,v150\n'))
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode, 80)
+        self.assertTrue(e[0].endswith(six.b("differ at original_file_size (source value '%s' disk signature value '%s')" % (len(data) + 9, len(data)))))
+
+        # Only read caching
+        self.write_file(tmpfile.name, data + six.b('150,v150\n'))
+        retcode, o, e = run_command(cmd.replace('readwrite','read'))
+        self.assertEqual(retcode, 80)
+
+        # Not enough rows for inferring the types, so the types might depend on the appended rows
+        small_tmpfile = self.create_file_with_data(six.b('a,b\n1,2\n'))
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -H -d , "select count(*) from %s" -C readwrite' % small_tmpfile.name)
+        self.assertEqual(retcode, 0)
+        with open(small_tmpfile.name,'ab') as f:
+            f.write(six.b('3,4.5\n'))
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -H -d , "select count(*) from %s" -C readwrite' % small_tmpfile.name)
+        self.assertEqual(retcode, 81)
+
+        for filename in [tmpfile.name, small_tmpfile.name]:
+            os.remove(filename + '.qsql')
+        self.cleanup(tmpfile)
+        self.cleanup(small_tmpfile)
+
+
+    def _create_partitioned_files(self, partition_count):
+        return self.create_folder_with_files(dict([('2026-%02d.csv' % m, six.b('a,b\n' + ''.join(['%s,%s\n' % (i, m) for i in range(150)])))
+                                                   for m in range(1, partition_count + 1)]), 'partitions', 'test')
+
+    def test_multi_file_table_is_loaded_from_the_caches_of_its_files(self):
+        tmpfolder = self._create_partitioned_files(3)
+        glob_pattern = os.path.join(tmpfolder, '2026-*.csv')
+        cmd = Q_EXECUTABLE + ' -H -d , "select count(*),sum(a),sum(b) from %s" -C %s'
+
+        retcode, o, e = run_command(cmd % (glob_pattern, 'readwrite') + ' -V')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('450,33525,900')])
+        self.assertEqual(len([l for l in e if six.b('from 0 cached files and 3 parsed files') in l]), 1)
+        for m in range(1, 4):
+            self.assertTrue(os.path.exists(os.path.join(tmpfolder, '2026-%02d.csv.qsql' % m)))
+
+        retcode, o, e = run_command(cmd % (glob_pattern, 'read') + ' -V')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('450,33525,900')])
+        self.assertEqual(len([l for l in e if six.b('from 3 cached files and 0 parsed files') in l]), 1)
+
+        # Only the changed file and the new file are parsed
+        self.write_file(os.path.join(tmpfolder, '2026-02.csv'), six.b('a,b\n1000,2\n'))
+        self.write_file(os.path.join(tmpfolder, '2026-04.csv'), six.b('a,b\n2000,4\n'))
+        retcode, o, e = run_command(cmd % (glob_pattern, 'readwrite') + ' -V')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('302,25350,606')])
+        self.assertEqual(len([l for l in e if six.b('from 2 cached files and 2 parsed files') in l]), 1)
+
+        for caching_mode in ['read', 'none']:
+            retcode, o, e = run_command(cmd % (glob_pattern, caching_mode))
+            self.assertEqual(retcode, 0)
+            self.assertEqual(o, [six.b('302,25350,606')])
+
+        # Member caches are the same as the caches of single file tables
+        retcode, o, e = run_command(cmd % (os.path.join(tmpfolder, '2026-02.csv'), 'read'))
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('1,1000,2')])
+
+        self.cleanup_folder(tmpfolder)
+
+    def test_multi_file_table_is_loaded_directly_when_the_columns_of_its_files_differ(self):
+        tmpfolder = self._create_partitioned_files(2)
+        glob_pattern = os.path.join(tmpfolder, '2026-*.csv')
+        self.write_file(os.path.join(tmpfolder, '2026-03.csv'), six.b('a,b\n1,x\n'))
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -H -d , "select count(*),sum(a),max(b) from %s" -C readwrite -V' % glob_pattern)
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('301,22351,x')])
+        self.assertEqual(len([l for l in e if six.b('differ from the columns of table %s' % glob_pattern) in l]), 1)
+
+        # A mismatching header still fails as before
+        self.write_file(os.path.join(tmpfolder, '2026-03.csv'), six.b('c,d\n1,2\n'))
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -H -d , "select count(*) from %s" -C readwrite' % glob_pattern)
+        self.assertEqual(retcode, 35)
+
+        self.cleanup_folder(tmpfolder)
+
+    def _create_files_and_cache_dir(self, file_count):
+        tmpfolder = self.create_folder_with_files(dict([('data-%s.csv' % i, six.b('a,b\n' + ''.join(['%s,%s\n' % (j, i) for j in range(150)])))
+                                                        for i in range(1, file_count + 1)]), 'cache_dir_sources', 'test')
+        return tmpfolder, os.path.join(tmpfolder, 'cache')
+
+    def test_caches_are_stored_in_the_cache_directory(self):
+        tmpfolder, cache_dir = self._create_files_and_cache_dir(1)
+        filename = os.path.join(tmpfolder, 'data-1.csv')
+        cmd = Q_EXECUTABLE + ' -H -d , "select count(*),sum(a),sum(b) from %s" -C %%s --cache-dir %s' % (filename, cache_dir)
+
+        retcode, o, e = run_command(cmd % 'readwrite')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('150,11175,150')])
+        self.assertFalse(os.path.exists(filename + '.qsql'))
+        cache_filenames = os.listdir(cache_dir)
+        self.assertEqual(len(cache_filenames), 1)
+        self.assertTrue(cache_filenames[0].endswith('.qsql'))
+        self.assertEqual(len(cache_filenames[0]), 40 + len('.qsql'))
+
+        retcode, o, e = run_command(cmd % 'read' + ' -V')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('150,11175,150')])
+        self.assertEqual(len([l for l in e if six.b('Reading %s from cache %s' % (filename, os.path.join(cache_dir, cache_filenames[0]))) in l]), 1)
+
+        # A changed file has a different content signature, so it is not read from the old cache
+        self.write_file(filename, six.b('a,b\n1000,1\n'))
+        retcode, o, e = run_command(cmd % 'read')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('1,1000,1')])
+        retcode, o, e = run_command(cmd % 'readwrite')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        self.cleanup_folder(tmpfolder)
+
+    def test_multi_file_table_is_loaded_from_the_cache_directory(self):
+        tmpfolder, cache_dir = self._create_files_and_cache_dir(3)
+        cmd = Q_EXECUTABLE + ' -H -d , "select count(*),sum(a),sum(b) from %s" -C %%s --cache-dir %s -V' % (os.path.join(tmpfolder, 'data-*.csv'), cache_dir)
+
+        retcode, o, e = run_command(cmd % 'readwrite')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('450,33525,900')])
+        self.assertEqual(len(os.listdir(cache_dir)), 3)
+
+        retcode, o, e = run_command(cmd % 'read')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('450,33525,900')])
+        self.assertEqual(len([l for l in e if six.b('from 3 cached files and 0 parsed files') in l]), 1)
+
+        self.cleanup_folder(tmpfolder)
+
+    def test_least_recently_used_caches_are_evicted_from_the_cache_directory(self):
+        tmpfolder, cache_dir = self._create_files_and_cache_dir(3)
+        cmd = Q_EXECUTABLE + ' -H -d , "select sum(b) from %s" -C readwrite --cache-dir %s --cache-max-size %%s' % (os.path.join(tmpfolder, 'data-%s.csv'), cache_dir)
+
+        retcode, o, e = run_command(cmd % (1, '1G'))
+        self.assertEqual(retcode, 0)
+        cache_size = os.stat(os.path.join(cache_dir, os.listdir(cache_dir)[0])).st_size
+        retcode, o, e = run_command(cmd % (2, 2 * cache_size))
+        self.assertEqual(retcode, 0)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        # Using the cache of the first file makes the cache of the second file the least recently used one
+        retcode, o, e = run_command(cmd % (1, 2 * cache_size) + ' -V')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o[-1], six.b('150'))
+        self.assertEqual(len([l for l in e if six.b('Reading %s from cache' % os.path.join(tmpfolder, 'data-1.csv')) in l]), 1)
+
+        retcode, o, e = run_command(cmd % (3, 2 * cache_size))
+        self.assertEqual(retcode, 0)
+        self.assertEqual(len(os.listdir(cache_dir)), 2)
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' --cache-dir %s --cache-stats' % cache_dir)
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o[1], six.b('Cached tables: 2'))
+        sources = [l.split()[-1] for l in o[3:]]
+        self.assertEqual(sources, [six.b(os.path.join(tmpfolder, 'data-%s.csv' % i)) for i in [3, 1]])
+
+        self.cleanup_folder(tmpfolder)
+
+    def test_cache_stats(self):
+        tmpfolder, cache_dir = self._create_files_and_cache_dir(1)
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' --cache-dir %s --cache-stats' % cache_dir)
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('Cache directory: %s' % cache_dir), six.b('Cached tables: 0'), six.b('Total size: 0 bytes (maximum size: unlimited)')])
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -H -d , "select count(*) from %s" -C readwrite --cache-dir %s' % (os.path.join(tmpfolder, 'data-1.csv'), cache_dir))
+        self.assertEqual(retcode, 0)
+        retcode, o, e = run_command(Q_EXECUTABLE + ' --cache-dir %s --cache-max-size 1M --cache-stats' % cache_dir)
+        self.assertEqual(retcode, 0)
+        self.assertEqual(len(o), 4)
+        cache_size = os.stat(os.path.join(cache_dir, os.listdir(cache_dir)[0])).st_size
+        self.assertEqual(o[2], six.b('Total size: %s bytes (maximum size: 1048576 bytes)' % cache_size))
+        self.assertTrue(o[3].endswith(six.b('%s bytes  %s  %s' % (cache_size, os.listdir(cache_dir)[0][:-len('.qsql')], os.path.join(tmpfolder, 'data-1.csv')))))
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' --cache-stats')
+        self.assertEqual(retcode, 126)
+        retcode, o, e = run_command(Q_EXECUTABLE + ' --cache-dir %s --cache-max-size 10X "select 1"' % cache_dir)
+        self.assertEqual(retcode, 126)
+
+        self.cleanup_folder(tmpfolder)
+
+    def test_cache_is_validated_using_the_file_stat(self):
+        tmpfile = self.create_file_with_data(six.b('a,b\n' + ''.join(['%s,v%s\n' % (i, i) for i in range(150)])))
+        cmd = Q_EXECUTABLE + ' -H -d , "select count(*),sum(a) from %s" -C %%s -V' % tmpfile.name
+
+        retcode, o, e = run_command(cmd % 'readwrite')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('150,11175')])
+
+        retcode, o, e = run_command(cmd % 'read')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('150,11175')])
+        self.assertEqual(len([l for l in e if six.b('has been validated using the file stat of %s' % tmpfile.name) in l]), 1)
+        self.assertEqual(len([l for l in e if six.b('Checking content signature') in l]), 0)
+
+        retcode, o, e = run_command(cmd % 'read' + ' --cache-validation strict')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('150,11175')])
+        self.assertEqual(len([l for l in e if six.b('has been validated using the file stat') in l]), 0)
+        self.assertEqual(len([l for l in e if six.b('Checking content signature') in l]), 1)
+
+        # Different reading options fall back to analyzing the file
+        retcode, o, e = run_command(cmd % 'read' + ' -c 2')
+        self.assertEqual(retcode, 80)
+        self.assertEqual(len([l for l in e if six.b('Reading options of %s differ' % tmpfile.name) in l]), 1)
+        retcode, o, e = run_command(cmd % 'read' + ' --type-inference-rows 10')
+        self.assertEqual(retcode, 81)
+        self.assertEqual(len([l for l in e if six.b('Type inference options of %s differ' % tmpfile.name) in l]), 1)
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' "select 1" --cache-validation none')
+        self.assertEqual(retcode, 127)
+
+        os.remove(tmpfile.name + '.qsql')
+        self.cleanup(tmpfile)
+
+    def test_file_stat_validation_trusts_the_size_modification_time_and_inode(self):
+        tmpfile = self.create_file_with_data(six.b('a,b\n' + ''.join(['%s,v%s\n' % (i, i) for i in range(150)])))
+        cmd = Q_EXECUTABLE + ' -H -d , "select count(*),sum(a) from %s" -C %%s' % tmpfile.name
+
+        retcode, o, e = run_command(cmd % 'readwrite')
+        self.assertEqual(retcode, 0)
+
+        # Rewriting the file in place with the same size, and restoring its modification time
+        st = os.stat(tmpfile.name)
+        with open(tmpfile.name, 'r+b') as f:
+            f.seek(4)
+            f.write(six.b('9'))
+        os.utime(tmpfile.name, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+        retcode, o, e = run_command(cmd % 'read')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('150,11175')])
+
+        retcode, o, e = run_command(cmd % 'read' + ' --cache-validation strict')
+        self.assertEqual(retcode, 81)
+
+        # Any other change of the file stat is detected
+        os.utime(tmpfile.name, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        retcode, o, e = run_command(cmd % 'read')
+        self.assertEqual(retcode, 81)
+
+        os.remove(tmpfile.name + '.qsql')
+        self.cleanup(tmpfile)
+
+    def test_content_fingerprint(self):
+        data = six.b(''.join(['%s,%s\n' % (i, i * 2) for i in range(100)]))
+        tmpfile = self.create_file_with_data(data)
+
+        chunk_hashes = calculate_chunk_hashes(tmpfile.name, len(data), 100)
+        self.assertEqual(chunk_hashes, [hashlib.sha1(data[i:i + 100]).hexdigest() for i in range(0, len(data), 100)])
+
+        content_fingerprint = ContentFingerprint.calculate(tmpfile.name, len(data), chunk_size=100)
+        self.assertTrue(content_fingerprint.is_prefix_of(tmpfile.name))
+
+        with open(tmpfile.name, 'ab') as f:
+            f.write(six.b('100,200\n'))
+        self.assertTrue(content_fingerprint.is_prefix_of(tmpfile.name))
+        extended_content_fingerprint = content_fingerprint.extended_to(tmpfile.name, len(data) + 8)
+        self.assertEqual(extended_content_fingerprint.to_dict(), ContentFingerprint.calculate(tmpfile.name, len(data) + 8, chunk_size=100).to_dict())
+
+        self.write_file(tmpfile.name, data[:150] + six.b('X') + data[151:])
+        self.assertFalse(content_fingerprint.is_prefix_of(tmpfile.name))
+
+        self.cleanup(tmpfile)
+
+    def test_cache_is_used_when_only_the_modification_time_has_changed(self):
+        tmpfile = self.create_file_with_data(six.b('a,b\n' + ''.join(['%s,v%s\n' % (i, i) for i in range(150)])))
+        cmd = Q_EXECUTABLE + ' -H -d , "select count(*),sum(a) from %s" -C %%s -V' % tmpfile.name
+
+        retcode, o, e = run_command(cmd % 'readwrite' + ' --content-fingerprint')
+        self.assertEqual(retcode, 0)
+
+        st = os.stat(tmpfile.name)
+        os.utime(tmpfile.name, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+        retcode, o, e = run_command(cmd % 'read')
+        self.assertEqual(retcode, 80)
+
+        retcode, o, e = run_command(cmd % 'read' + ' --content-fingerprint')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(o, [six.b('150,11175')])
+        self.assertEqual(len([l for l in e if six.b('has been validated using the content fingerprint of %s' % tmpfile.name) in l]), 1)
+
+        # The cache is updated, so its file stat can be used again
+        retcode, o, e = run_command(cmd % 'readwrite' + ' --content-fingerprint')
+        self.assertEqual(retcode, 0)
+        self.assertEqual(len([l for l in e if six.b('File %s has the same content as when it has been cached' % tmpfile.name) in l]), 1)
+        for cache_validation in ['stat', 'strict']:
+            retcode, o, e = run_command(cmd % 'read' + ' --cache-validation %s' % cache_validation)
+            self.assertEqual(retcode, 0)
+            self.assertEqual(o, [six.b('150,11175')])
+
+        os.remove(tmpfile.name + '.qsql')
+        self.cleanup(tmpfile)
+
+    def test_file_which_has_changed_in_the_middle_is_not_treated_as_appended(self):
+        # The modification time is not compared when checking for appended rows, so a change far from both ends of the
+        # cached part needs to be found by the hash of the whole part (see calculate_file_prefix_hash)
+        data = six.b('a,b\n' + ''.join(['%s,v%s\n' % (i, i) for i in range(20000)]))
+        middle_record_offset = data.index(six.b('\n10000,')) + 1
+        rewritten_data = data[:middle_record_offset] + six.b('9') + data[middle_record_offset + 1:] + six.b('20000,v20000\n')
+        tmpfiles = []
+        for content_fingerprint_flag in ['', ' --content-fingerprint']:
+            tmpfile = self.create_file_with_data(data)
+            tmpfiles.append(tmpfile)
+            cmd = Q_EXECUTABLE + ' -H -d , "select count(*) from %s" -C readwrite%s' % (tmpfile.name, content_fingerprint_flag)
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode, 0)
+
+            self.write_file(tmpfile.name, rewritten_data)
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode, 80)
+
+        for tmpfile in tmpfiles:
+            os.remove(tmpfile.name + '.qsql')
+            self.cleanup(tmpfile)
+
+
 class UserFunctionTests(AbstractQTestCase):
     def test_regexp_int_data_handling(self):
         tmpfile = self.create_file_with_data(sample_data_no_header)
@@ -5056,74 +5598,1539 @@ class SqlTests(AbstractQTestCase):
         self.cleanup(tmpfile)
 
 
-class BasicModuleTests(AbstractQTestCase):
+class QueryOptimizationTests(AbstractQTestCase):
 
-    def test_engine_isolation(self):
-        tmpfile1 = self.create_file_with_data(six.b("a b c\n1 2 3\n4 5 6"))
-        tmpfile2 = self.create_file_with_data(six.b("d e f\n10 20 30\n40 50 60"))
+    def _create_wide_file(self):
+        header = ','.join(['col%s' % i for i in range(1,21)])
+        rows = [','.join([str(r * 100 + i) if i != 7 else 'text%s' % r for i in range(1,21)]) for r in range(200)]
+        return self.create_file_with_data(six.b('\n'.join([header] + rows) + '\n'))
 
-        # Run file 1 on engine 1
-        q1 = QTextAsData(QInputParams(skip_header=True,delimiter=' '))
-        r = q1.execute('select * from %s' % tmpfile1.name)
-        print("QueryQuery",file=sys.stdout)
+    def test_only_referenced_columns_are_loaded(self):
+        tmpfile = self._create_wide_file()
 
-        self.assertTrue(r.status == 'ok')
-        self.assertEqual(len(r.warnings),0)
-        self.assertEqual(len(r.data),2)
-        self.assertEqual(r.metadata.output_column_name_list,['a','b','c'])
-        self.assertEqual(r.data,[(1,2,3),(4,5,6)])
-        self.assertTrue(tmpfile1.name in r.metadata.table_structures)
-        self.assertTrue(tmpfile1.name in r.metadata.new_table_structures)
-        self.assertEqual(r.metadata.table_structures[tmpfile1.name].atomic_fns,[tmpfile1.name])
-        self.assertEqual(r.metadata.table_structures[tmpfile1.name].source_type,'file')
-        self.assertEqual(r.metadata.table_structures[tmpfile1.name].source,tmpfile1.name)
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+        r = q.execute('select sum(col3),max(COL7) from %s where "col20" > 5000' % tmpfile.name)
 
-        # run file 1 on engine 2
-        q2 = QTextAsData(QInputParams(skip_header=True,delimiter=' '))
-        r2 = q2.execute('select * from %s' % tmpfile1.name)
-        print("QueryQuery",file=sys.stdout)
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(r.data,[(sum([row * 100 + 3 for row in range(50,200)]),'text99')])
+        self.assertEqual(r.metadata.table_structures[tmpfile.name].column_names,['col3','col7','col20'])
+        self.assertEqual(r.metadata.table_structures[tmpfile.name].python_column_types,[int,str,int])
 
-        self.assertTrue(r2.status == 'ok')
-        self.assertEqual(len(r2.warnings),0)
-        self.assertEqual(len(r2.data),2)
-        self.assertEqual(r2.metadata.output_column_name_list,['a','b','c'])
-        self.assertEqual(r2.data,[(1,2,3),(4,5,6)])
-        self.assertTrue(tmpfile1.name in r2.metadata.table_structures)
-        self.assertTrue(tmpfile1.name in r2.metadata.new_table_structures)
-        self.assertEqual(r2.metadata.table_structures[tmpfile1.name].atomic_fns,[tmpfile1.name])
-        self.assertEqual(r2.metadata.table_structures[tmpfile1.name].source_type,'file')
-        self.assertEqual(r2.metadata.table_structures[tmpfile1.name].source,tmpfile1.name)
+        q.done()
+        self.cleanup(tmpfile)
 
-        # run file 2 on engine 1
-        r3 = q1.execute('select * from %s' % tmpfile2.name)
-        print("QueryQuery",file=sys.stdout)
+    def test_string_literals_are_kept_as_possible_column_names(self):
+        tokens = [t for t in tokenize_sql("select 'max', 'x1', X'AB', 'it''s', '', 'unterminated") if t.token_type == 'string']
+        self.assertEqual([t.get_string_value() for t in tokens], ['max', 'x1', 'AB', "it's", '', 'unterminated'])
 
-        print(r3)
-        self.assertTrue(r3.status == 'ok')
-        self.assertEqual(len(r3.warnings),0)
-        self.assertEqual(len(r3.data),2)
-        self.assertEqual(r3.metadata.output_column_name_list,['d','e','f'])
-        self.assertEqual(r3.data,[(10,20,30),(40,50,60)])
-        self.assertTrue(tmpfile2.name in r3.metadata.table_structures)
-        self.assertTrue(tmpfile2.name in r3.metadata.new_table_structures)
-        self.assertEqual(r3.metadata.table_structures[tmpfile2.name].atomic_fns,[tmpfile2.name])
-        self.assertEqual(r3.metadata.table_structures[tmpfile2.name].source,tmpfile2.name)
-        self.assertEqual(r3.metadata.table_structures[tmpfile2.name].source_type,'file')
+        tmpfile = self.create_file_with_data(six.b('max,x1,other\n1,2,3\n4,5,6\n'))
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+        r = q.execute("select count(*) from %s where 'max' != 'x1'" % tmpfile.name)
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(r.data,[(2,)])
+        self.assertEqual(r.metadata.table_structures[tmpfile.name].column_names,['max','x1'])
+        q.done()
 
-        q1.done()
-        q2.done()
+        self.cleanup(tmpfile)
 
-        self.cleanup(tmpfile1)
-        self.cleanup(tmpfile2)
+    def test_all_columns_are_loaded_without_query_specific_optimizations(self):
+        tmpfile = self._create_wide_file()
 
-    def test_simple_query(self):
-        tmpfile = self.create_file_with_data(six.b("a b c\n1 2 3\n4 5 6"))
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=','))
+        r = q.execute('select sum(col3) from %s' % tmpfile.name)
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(len(r.metadata.table_structures[tmpfile.name].column_names),20)
 
-        q = QTextAsData(QInputParams(skip_header=True,delimiter=' '))
-        r = q.execute('select * from %s' % tmpfile.name)
+        # The table is reused by later queries, so all columns must exist
+        r2 = q.execute('select max(col19) from %s' % tmpfile.name)
+        self.assertEqual(r2.status,'ok')
+        self.assertEqual(r2.data,[(19919,)])
 
-        self.assertTrue(r.status == 'ok')
-        self.assertEqual(len(r.warnings),0)
+        q.done()
+        self.cleanup(tmpfile)
+
+    def test_wildcard_and_natural_join_load_all_columns(self):
+        tmpfile = self._create_wide_file()
+
+        for query in ['select * from %s limit 1','select count(*) from %s t1 natural join %s t2','select t.* from %s t limit 1']:
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+            r = q.execute(query.replace('%s',tmpfile.name))
+            self.assertEqual(r.status,'ok')
+            self.assertEqual(len(r.metadata.table_structures[tmpfile.name].column_names),20)
+            q.done()
+
+        self.cleanup(tmpfile)
+
+    def test_projection_keeps_relaxed_mode_semantics(self):
+        tmpfile = self.create_file_with_data(six.b('a b c\n1 2\n3 4 5 6 7\n8 9 10\n'))
+
+        cmd = Q_EXECUTABLE + ' -H -c 3 "select c,a from %s"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b(' 1'),six.b('"5 6 7" 3'),six.b('10 8')])
+
+        self.cleanup(tmpfile)
+
+    def test_projection_keeps_strict_mode_errors(self):
+        # The mismatching line is after the analysis sample
+        tmpfile = self.create_file_with_data(six.b('a,b,c\n' + '1,2,3\n' * 150 + '4,5\n'))
+
+        cmd = Q_EXECUTABLE + ' -d , -H -m strict "select a from %s"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,2)
+        self.assertEqual(len(o),0)
+        self.assertEqual(e,[six.b('Strict mode - Expected 3 columns instead of 2 columns in file %s row 152. Either use relaxed modes or check your delimiter' % tmpfile.name)])
+
+        self.cleanup(tmpfile)
+
+    def test_analysis_shows_all_columns(self):
+        tmpfile = self._create_wide_file()
+
+        cmd = Q_EXECUTABLE + ' -d , -H -A "select col3 from %s"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(len([x for x in o if x.startswith(six.b('    `col'))]),20)
+
+        self.cleanup(tmpfile)
+
+    def _create_file_with_rows(self, rows):
+        return self.create_file_with_data(six.b('\n'.join(rows) + '\n'))
+
+    def _create_mixed_values_file(self):
+        rows = ['n,t,r',
+                '1,a,1.5',
+                '5,b,2',
+                '007,5,-3e1',
+                'abc,10,x',
+                ',,',
+                '12345678901234567890,c,0.1',
+                '-4,B,+7',
+                '1e1,5,.5',
+                '3.0,z,1000']
+        return self.create_file_with_data(six.b('\n'.join(rows) + '\n'))
+
+    def _execute_with_and_without_optimizations(self, tmpfile, query):
+        results = []
+        for query_specific_optimizations in [False, True]:
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=query_specific_optimizations))
+            r = q.execute(query.replace('%s',tmpfile.name))
+            self.assertEqual(r.status,'ok')
+            results.append(r.data)
+            q.done()
+        return results
+
+    def test_where_conditions_are_applied_while_loading(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(1000)])
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+        r = q.execute('select count(*),sum(a) from %s where b = 3 and a >= 500' % tmpfile.name)
+        self.assertEqual(r.status,'ok')
+        expected_values = [i for i in range(500,1000) if i % 7 == 3]
+        self.assertEqual(r.data,[(len(expected_values),sum(expected_values))])
+
+        # The table is reused, and contains only the matching rows
+        r2 = q.execute('select count(*) from %s' % tmpfile.name)
+        self.assertEqual(r2.data,[(len(expected_values),)])
+
+        q.done()
+        self.cleanup(tmpfile)
+
+    def test_where_pushdown_matches_sqlite_comparison_semantics(self):
+        tmpfile = self._create_mixed_values_file()
+
+        queries = ['select * from %s where n > 2',
+                   'select * from %s where n = 7',
+                   'select * from %s where n = \'7\'',
+                   'select * from %s where n < \'b\'',
+                   'select * from %s where n >= \'abc\'',
+                   'select * from %s where n != 5 and r <= 1.5',
+                   'select * from %s where 3 < n',
+                   'select * from %s where n between -5 and 10',
+                   'select * from %s x where x.n <> 1 and x.t == \'5\'',
+                   'select * from %s where t = 5',
+                   'select * from %s where t > 5',
+                   'select * from %s where t < 10.0',
+                   'select * from %s where t = \'B\'',
+                   'select * from %s where t >= \'a\' and t < \'c\'',
+                   'select * from %s where n is null',
+                   'select * from %s where t is not null and r notnull',
+                   'select * from %s where n = null',
+                   'select * from %s where n != null',
+                   'select * from %s where n = 12345678901234567890',
+                   'select * from %s where n > 12345678901234567889',
+                   'select * from %s where r > 0.1',
+                   'select * from %s where r = -30',
+                   'select * from %s where n = 1 or t = \'b\'',
+                   'select * from %s where (n = 1 or n = 5) and r > 1',
+                   'select * from %s where n + 0 = 5',
+                   'select n,count(*) from %s where n > 0 group by n order by n']
+
+        for query in queries:
+            without_pushdown, with_pushdown = self._execute_with_and_without_optimizations(tmpfile, query)
+            self.assertEqual(with_pushdown,without_pushdown,query)
+
+        self.cleanup(tmpfile)
+
+    def test_where_pushdown_is_not_used_for_complex_queries(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(100)])
+
+        queries = ['select count(*) from %s where b = 3 union all select count(*) from %s where b = 4',
+                   'select count(*) from %s t1 join %s t2 on (t1.a = t2.a) where t1.b = 3',
+                   'select count(*) from %s where a in (select a from %s where b = 3)',
+                   'select count(*) from %s t1 where t1.b = 3 and exists (select 1 from %s t2 where t2.b = 4)']
+
+        for query in queries:
+            without_pushdown, with_pushdown = self._execute_with_and_without_optimizations(tmpfile, query)
+            self.assertEqual(with_pushdown,without_pushdown,query)
+
+        self.cleanup(tmpfile)
+
+    def test_where_pushdown_with_parallel_load(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(50000)])
+
+        cmd = Q_EXECUTABLE + ' -d , -H --parallel-load 4 "select count(*),sum(a) from %s where b = 3"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        expected_values = [i for i in range(50000) if i % 7 == 3]
+        self.assertEqual(o,[six.b('%s,%s' % (len(expected_values),sum(expected_values)))])
+
+        self.cleanup(tmpfile)
+
+    def test_reading_stops_when_limit_is_reached(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(10000)])
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+        r = q.execute('select a from %s limit 3 offset 2' % tmpfile.name)
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(r.data,[(2,),(3,),(4,)])
+
+        # Only the rows of the analysis sample have been loaded
+        r2 = q.execute('select count(*) from %s' % tmpfile.name)
+        self.assertEqual(r2.data,[(100,)])
+
+        q.done()
+        self.cleanup(tmpfile)
+
+    def test_limit_with_pushed_down_where_clause(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(10000)])
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+        r = q.execute('select a from %s where b = 3 and a > 5000 limit 2' % tmpfile.name)
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(r.data,[(5001,),(5008,)])
+
+        r2 = q.execute('select count(*) from %s' % tmpfile.name)
+        self.assertEqual(r2.data,[(2,)])
+
+        q.done()
+        self.cleanup(tmpfile)
+
+    def test_rowid_disables_pushed_down_where_clause_and_limit(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(1000)])
+
+        queries = ['select rowid,a from %s where a > 900 order by a',
+                   'select a from %s where b = 3 and _rowid_ > 10 limit 2',
+                   'select oid,a from %s where b = 3 limit 3',
+                   'select "rowid",a from %s where a >= 500 limit 2 offset 1']
+
+        for query in queries:
+            without_optimizations, with_optimizations = self._execute_with_and_without_optimizations(tmpfile, query)
+            self.assertEqual(with_optimizations,without_optimizations,query)
+            self.assertTrue(len(with_optimizations) > 0,query)
+
+        self.cleanup(tmpfile)
+
+    def test_limit_without_early_termination(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(1000)])
+
+        queries = ['select a from %s order by a desc limit 2',
+                   'select distinct b from %s limit 10',
+                   'select count(*) from %s limit 1',
+                   'select b,max(a) from %s limit 1',
+                   'select a from %s where a + 0 > 900 limit 2',
+                   'select a from %s where b = 3 or b = 4 limit 2',
+                   'select a from %s limit 998,5']
+
+        for query in queries:
+            without_optimizations, with_optimizations = self._execute_with_and_without_optimizations(tmpfile, query)
+            self.assertEqual(with_optimizations,without_optimizations,query)
+            self.assertTrue(len(with_optimizations) > 0,query)
+
+        self.cleanup(tmpfile)
+
+    def test_limit_in_strict_mode_reads_all_rows(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['1,2'] * 150 + ['3'])
+
+        cmd = Q_EXECUTABLE + ' -d , -H -m strict "select a from %s limit 1"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,2)
+        self.assertEqual(len(o),0)
+        self.assertTrue(e[0].startswith(six.b('Strict mode - Expected 2 columns instead of 1 columns')))
+
+        self.cleanup(tmpfile)
+
+    def test_limit_on_endless_stdin(self):
+        cmd = 'yes "1 2" | ' + Q_EXECUTABLE + ' -c 2 "select c1,c2 from - limit 3"'
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('1 2')] * 3)
+
+    def _count_with_and_without_optimizations(self, filename, input_params, query='select count(*) from %s'):
+        results = []
+        for query_specific_optimizations in [False, True]:
+            params = QInputParams(**input_params.__dict__)
+            params.query_specific_optimizations = query_specific_optimizations
+            q = QTextAsData(params)
+            r = q.execute(query % filename)
+            results.append((r.status,r.data,r.error.msg if r.error is not None else None))
+            q.done()
+        return results
+
+    def test_count_only_query_does_not_store_rows(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(1000)])
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+        r = q.execute('select count(*) from %s' % tmpfile.name)
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(r.data,[(1000,)])
+        self.assertEqual(r.metadata.output_column_name_list,['count(*)'])
+        self.assertEqual(r.metadata.table_structures[tmpfile.name].record_count,1000)
+
+        r2 = q.execute('select count(*) from %s where a >= 0' % tmpfile.name)
+        self.assertEqual(r2.data,[(0,)])
+
+        q.done()
+        self.cleanup(tmpfile)
+
+    def test_count_only_query_matches_full_load(self):
+        file_contents = [six.b('a,b\n' + '1,2\n' * 300),
+                         six.b('a,b\n' + '1,2\n' * 300 + '\n\n5'),
+                         six.b('a,b\r\n' + '1,2\r\n' * 300),
+                         six.b('a,b\n' + '1,2\n' * 300 + '3,"multi\nline"\n4,5\n'),
+                         six.b('a,b\n' + '1,2\n' * 300 + '3\r4\n'),
+                         six.b('a,b\n' + '1,2,3\n' * 150 + '4\n' * 150),
+                         six.b('a,b\n' + '1,2\n' * 300 + '\xff\xfe\n'),
+                         six.b('a,b\n' + '1,2\n' * 10)]
+
+        for file_content in file_contents:
+            tmpfile = self.create_file_with_data(file_content)
+            for input_params in [QInputParams(skip_header=True,delimiter=','),
+                                 QInputParams(skip_header=False,delimiter=','),
+                                 QInputParams(skip_header=True,delimiter=',',parsing_mode='strict')]:
+                without_optimizations, with_optimizations = self._count_with_and_without_optimizations(tmpfile.name,input_params)
+                self.assertEqual(with_optimizations,without_optimizations,(file_content[-20:],input_params))
+            self.cleanup(tmpfile)
+
+    def test_count_only_query_on_glob_with_extra_headers(self):
+        tmp_data_folder = self.create_folder_with_files({
+            'file1.csv': six.b('a,b\n' + '1,2\n' * 200),
+            'file2.csv': six.b('a,b\n' + '3,4\n' * 50),
+            'file3.csv': six.b(''),
+            'file4.csv': six.b('a,b\n5,6')
+        },prefix='xx',suffix='yy')
+        bad_header_data_folder = self.create_folder_with_files({
+            'file1.csv': six.b('a,b\n' + '1,2\n' * 200),
+            'file2.csv': six.b('a,c\n' + '3,4\n' * 50)
+        },prefix='xx',suffix='yy')
+
+        for folder, expected_status in [(tmp_data_folder,'ok'),(bad_header_data_folder,'error')]:
+            without_optimizations, with_optimizations = self._count_with_and_without_optimizations(
+                '%s/*.csv' % folder, QInputParams(skip_header=True,delimiter=','))
+            self.assertEqual(with_optimizations,without_optimizations)
+            self.assertEqual(with_optimizations[0],expected_status)
+
+        self.cleanup_folder(tmp_data_folder)
+        self.cleanup_folder(bad_header_data_folder)
+
+    def test_count_only_query_from_stdin(self):
+        cmd = '(echo x; seq 1 1000) | ' + Q_EXECUTABLE + ' -H "select count(*) as n from -"'
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('1000')])
+
+    class _CollectingOutputWriter(object):
+        def __init__(self):
+            self.column_names = None
+            self.rows = []
+            self.batch_count = 0
+
+        def is_closed(self):
+            return False
+
+        def start(self, column_names):
+            self.column_names = column_names
+
+        def write_rows(self, rows):
+            self.batch_count += 1
+            self.rows += rows
+
+    def test_row_wise_query_results_are_streamed(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(20000)])
+
+        queries = ['select a,b*2 from %s where b = 3',
+                   'select a x,upper(b) from %s where a % 3 = 0 and b != 1',
+                   'select * from %s limit 7000,4',
+                   'select a from %s where a + 0 > 19990 limit 3',
+                   'select a from %s where b = 8']
+        for query in queries:
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+            output_writer = self._CollectingOutputWriter()
+            r = q.execute(query.replace('%s',tmpfile.name),output_writer=output_writer)
+            self.assertEqual(r.status,'ok')
+            self.assertEqual(r.data,None)
+            self.assertEqual(r.metadata.output_column_name_list,output_writer.column_names)
+            q.done()
+
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=','))
+            expected = q.execute(query.replace('%s',tmpfile.name))
+            self.assertEqual(output_writer.rows,expected.data,query)
+            self.assertEqual(output_writer.column_names,expected.metadata.output_column_name_list,query)
+            self.assertEqual(len(r.warnings),len(expected.warnings),query)
+            q.done()
+
+        self.cleanup(tmpfile)
+
+    def test_streamed_rows_are_not_kept_in_the_table(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(20000)])
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+        output_writer = self._CollectingOutputWriter()
+        r = q.execute('select a from %s where b = 0' % tmpfile.name,output_writer=output_writer)
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(len(output_writer.rows),len([i for i in range(20000) if i % 7 == 0]))
+        self.assertTrue(output_writer.batch_count > 1)
+
+        r2 = q.execute('select count(*) from %s' % tmpfile.name)
+        self.assertEqual(r2.data,[(0,)])
+
+        q.done()
+        self.cleanup(tmpfile)
+
+    def test_queries_which_are_not_streamed(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(1000)])
+
+        queries = [('select a from %s order by a desc limit 2',QInputParams(skip_header=True,delimiter=',')),
+                   ('select distinct b from %s',QInputParams(skip_header=True,delimiter=',')),
+                   ('select b,count(*) from %s group by b',QInputParams(skip_header=True,delimiter=',')),
+                   ('select a from %s where a > 997',QInputParams(skip_header=True,delimiter=',',parsing_mode='strict'))]
+        for query, input_params in queries:
+            input_params.query_specific_optimizations = True
+            q = QTextAsData(input_params)
+            output_writer = self._CollectingOutputWriter()
+            r = q.execute(query % tmpfile.name,output_writer=output_writer)
+            self.assertEqual(r.status,'ok')
+            self.assertTrue(len(r.data) > 0)
+            self.assertEqual(output_writer.column_names,None)
+            q.done()
+
+        self.cleanup(tmpfile)
+
+    def test_queries_which_reference_the_rowid_are_not_streamed(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(20000)])
+
+        queries = ['select rowid,a from %s',
+                   'select a,_rowid_ from %s where b = 3',
+                   'select oid from %s limit 7000,4']
+        for query in queries:
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+            output_writer = self._CollectingOutputWriter()
+            r = q.execute(query.replace('%s',tmpfile.name),output_writer=output_writer)
+            self.assertEqual(r.status,'ok')
+            self.assertEqual(output_writer.column_names,None)
+            q.done()
+
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=','))
+            expected = q.execute(query.replace('%s',tmpfile.name))
+            self.assertEqual(r.data,expected.data,query)
+            q.done()
+
+        self.cleanup(tmpfile)
+
+    def test_streamed_output_with_header_and_empty_results(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(1000)])
+
+        cmd = Q_EXECUTABLE + ' -d , -H -O "select a as x,b from %s where b > 10"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('x,b')])
+        self.assertEqual(e,[six.b('Warning - data is empty')])
+
+        self.cleanup(tmpfile)
+
+    def test_streaming_stops_reading_endless_stdin(self):
+        cmd = 'yes "1 2" | ' + Q_EXECUTABLE + ' -c 2 "select c2 from - where c1 + 0 = 1 limit 2"'
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('2')] * 2)
+
+
+    def _aggregate_with_and_without_streaming(self, tmpfile, query, input_params):
+        # Runs the query on the file as a data stream (with streaming aggregation) and as a regular file
+        data_streams_dict = {
+            '-': DataStream('stdin','-',codecs.open(tmpfile.name,'rb',encoding='utf-8'))
+        }
+        q = QTextAsData(input_params,data_streams_dict=data_streams_dict)
+        r = q.execute(query.replace('%s','-'))
+        q.done()
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=','))
+        expected = q.execute(query.replace('%s',tmpfile.name))
+        q.done()
+        return r, expected
+
+    def _assert_same_aggregation_results(self, r, expected, query):
+        self.assertEqual(r.status,'ok',query)
+        self.assertEqual(r.metadata.output_column_name_list,expected.metadata.output_column_name_list,query)
+        self.assertEqual(len(r.data),len(expected.data),query)
+        self.assertEqual(r.data,expected.data,query)
+        self.assertEqual(len(r.warnings),len(expected.warnings),query)
+
+    def _create_grouped_rows_file(self, row_count, group_count):
+        return self._create_file_with_rows(['k,a,f'] + ['%s,%s,%s' % ('g%s' % (i % group_count) if i % 11 != 0 else '',(i * 7) % 101 - 50,(i % 13) / 4.0) for i in range(row_count)])
+
+    def test_stdin_group_by_is_aggregated_while_loading(self):
+        tmpfile = self._create_grouped_rows_file(23000,5)
+
+        queries = ['select k,count(*),count(k),sum(a),total(f),avg(a),min(a),max(f) from %s group by k',
+                   'select k as key,stddev_pop(f),stddev_sample(a) sd,avg(f) from %s where a > -10 group by key',
+                   'select upper(k),a % 3,count(*),sum(a * 2) from %s group by upper(k),a % 3 limit 5 offset 2',
+                   'select count(*),sum(a),avg(f),stddev_sample(f) from %s',
+                   'select max(k),min(f) from %s where a > 1000']
+        for query in queries:
+            r, expected = self._aggregate_with_and_without_streaming(tmpfile,query,QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+            self._assert_same_aggregation_results(r,expected,query)
+
+        self.cleanup(tmpfile)
+
+    def test_stdin_group_by_state_is_moved_to_disk_when_there_are_many_groups(self):
+        tmpfile = self._create_grouped_rows_file(12000,700)
+
+        query = 'select k,count(*),avg(a),stddev_pop(f),max(a) from %s group by k'
+        input_params = QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True,max_in_memory_aggregation_groups=50)
+        r, expected = self._aggregate_with_and_without_streaming(tmpfile,query,input_params)
+        self._assert_same_aggregation_results(r,expected,query)
+        self.assertEqual(len(r.data),701)
+
+        self.cleanup(tmpfile)
+
+    def test_stdin_aggregations_which_are_not_streamed(self):
+        tmpfile = self._create_grouped_rows_file(1000,5)
+
+        queries = ['select k,count(*) from %s group by k having count(*) > 100',
+                   'select k,sum(a) from %s group by k order by 2 desc',
+                   'select k,group_concat(a) from %s group by k',
+                   'select k,count(distinct a) from %s group by k',
+                   'select k,count(*) from %s group by 1',
+                   'select k,a,count(*) from %s group by k']
+        for query in queries:
+            r, expected = self._aggregate_with_and_without_streaming(tmpfile,query,QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+            self.assertEqual(r.data,expected.data,query)
+
+        self.cleanup(tmpfile)
+
+    def test_stdin_aggregations_which_reference_the_rowid_are_not_streamed(self):
+        tmpfile = self._create_grouped_rows_file(23000,5)
+
+        queries = ['select k,max(rowid),min(oid) from %s group by k',
+                   'select count(*) from %s where _rowid_ > 20000']
+        for query in queries:
+            r, expected = self._aggregate_with_and_without_streaming(tmpfile,query,QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+            self.assertEqual(r.data,expected.data,query)
+
+        self.cleanup(tmpfile)
+
+    def test_stdin_aggregation_from_command_line(self):
+        cmd = 'seq 1 20000 | ' + Q_EXECUTABLE + ' -O "select c1 % 3 as m,count(*) as n,sum(c1) as s from - group by c1 % 3"'
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('m n s'),six.b('0 6666 66663333'),six.b('1 6667 66670000'),six.b('2 6667 66676667')])
+
+
+    def test_stdin_aggregation_of_floats_is_the_same_as_for_a_file(self):
+        # Float sums depend on the order of additions, so streamed aggregation must add the rows in the same order
+        tmpfile = self._create_file_with_rows(['cat,val'] + ['c%s,%s.%02d' % (i % 7,(i * 37) % 1000,(i * 13) % 100) for i in range(30000)])
+
+        queries = ['select cat,count(val),sum(val),total(val),avg(val),min(val),max(val),stddev_pop(val),stddev_sample(val) from - group by cat',
+                   'select sum(val),total(val),avg(val),stddev_pop(val),stddev_sample(val) from -']
+        for query in queries:
+            stdin_retcode, stdin_o, stdin_e = run_command('cat %s | %s -d , -H "%s"' % (tmpfile.name,Q_EXECUTABLE,query))
+            file_retcode, file_o, file_e = run_command('%s -d , -H "%s"' % (Q_EXECUTABLE,query.replace('-',tmpfile.name)))
+
+            self.assertEqual(stdin_retcode,0)
+            self.assertEqual(file_retcode,0)
+            self.assertEqual(stdin_o,file_o,query)
+
+        self.cleanup(tmpfile)
+
+
+    def test_order_by_with_limit_keeps_only_the_top_rows(self):
+        tmpfile = self._create_file_with_rows(['id,latency,host'] + ['%s,%s,h%s' % (i,(i * 7919) % 10007,i % 5) for i in range(30000)])
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+        r = q.execute('select id,latency from %s order by latency desc limit 3' % tmpfile.name)
+        self.assertEqual(r.status,'ok')
+        self.assertEqual([latency for _, latency in r.data],[10006,10006,10006])
+
+        # Only the top rows and their ties have been inserted into the table
+        r2 = q.execute('select count(*) from %s' % tmpfile.name)
+        self.assertEqual(r2.data,[(3,)])
+        q.done()
+
+        queries = ['select * from %s order by latency desc limit 20',
+                   'select id from %s t order by t.host desc,latency,id limit 10 offset 5',
+                   'select host,latency from %s where latency >= 5000 and id < 20000 order by latency limit 7',
+                   'select id,host from %s order by host limit 12000']
+        for query in queries:
+            results = self._execute_with_and_without_optimizations(tmpfile,query)
+            self.assertEqual(results[0],results[1],query)
+
+        self.cleanup(tmpfile)
+
+    def test_order_by_with_limit_matches_sqlite_ordering_of_values(self):
+        tmpfile = self._create_mixed_values_file()
+
+        for column in ['n','t','r']:
+            for direction in ['asc','desc']:
+                for limit in [1,3,8]:
+                    query = 'select * from %%s order by %s %s limit %s' % (column,direction,limit)
+                    results = self._execute_with_and_without_optimizations(tmpfile,query)
+                    self.assertEqual(results[0],results[1],query)
+
+        self.cleanup(tmpfile)
+
+    def test_order_by_queries_which_keep_all_rows(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(1000)])
+
+        queries = ['select a from %s order by a + 0 desc limit 2',
+                   'select b as a from %s order by a limit 2',
+                   'select a from %s order by 1 desc limit 2',
+                   'select a from %s order by a desc',
+                   'select b,max(a) from %s group by b order by b limit 2',
+                   'select a from %s where a % 2 = 0 order by a desc limit 2',
+                   'select rowid,a from %s order by b desc,a limit 3',
+                   'select a from %s order by b,_rowid_ desc limit 3']
+        for query in queries:
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',query_specific_optimizations=True))
+            r = q.execute(query.replace('%s',tmpfile.name))
+            self.assertEqual(r.status,'ok')
+            r2 = q.execute('select count(*) from %s' % tmpfile.name)
+            self.assertEqual(r2.data,[(1000,)],query)
+            q.done()
+
+            results = self._execute_with_and_without_optimizations(tmpfile,query)
+            self.assertEqual(results[0],results[1],query)
+
+        self.cleanup(tmpfile)
+
+
+    def test_row_which_completes_type_inference_is_normalized(self):
+        # The 100th data row is the last row needed for inferring the types, and it's kept by the column inferer as well
+        for row_99 in ['99,', '99']:
+            tmpfile = self._create_file_with_rows(['%s,%s' % (i,i * 2) if i != 99 else row_99 for i in range(150)])
+
+            cmd = Q_EXECUTABLE + ' -d , "select * from %s where c1 between 98 and 100"' % tmpfile.name
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode, 0)
+            self.assertEqual(len(e), 0)
+            self.assertEqual(o, [six.b('98,196'),six.b('99,'),six.b('100,200')])
+
+            q = QTextAsData(QInputParams(delimiter=','))
+            r = q.execute('select count(*),count(c2),sum(c2) from %s' % tmpfile.name)
+            self.assertEqual(r.status,'ok')
+            self.assertEqual(r.data,[(150,149,sum([i * 2 for i in range(150) if i != 99]))])
+            q.done()
+
+            self.cleanup(tmpfile)
+
+    def test_row_normalizer(self):
+        def on_column_count_mismatch(actual_col_count):
+            raise ValueError(actual_col_count)
+
+        relaxed = create_row_normalizer('relaxed',3,[1],',',None,on_column_count_mismatch)
+        self.assertEqual(relaxed(['a','','c']),['a',None,'c'])
+        self.assertEqual(relaxed(['a','']),['a',None,None])
+        self.assertEqual(relaxed(['','1','c','','e']),['','1','c,,e'])
+        self.assertEqual(relaxed([]),[None,None,None])
+
+        strict = create_row_normalizer('strict',3,[0,2],',',None,on_column_count_mismatch)
+        self.assertEqual(strict(['','','']),[None,'',None])
+        self.assertRaises(ValueError,strict,['1','2'])
+        self.assertRaises(ValueError,strict,['1','2','3','4'])
+
+        projected = create_row_normalizer('relaxed',3,[0,2],' ',[2,0],on_column_count_mismatch)
+        self.assertEqual(projected(['','b','']),[None,None])
+        self.assertEqual(projected(['1','b']),[None,'1'])
+        self.assertEqual(projected(['1','b','','d']),[' d','1'])
+
+        projected_strict = create_row_normalizer('strict',3,[],',',[1],on_column_count_mismatch)
+        self.assertEqual(projected_strict(['a','','c']),[''])
+        self.assertRaises(ValueError,projected_strict,['a'])
+
+
+    def test_split_tokenized_records_match_csv_reader(self):
+        rnd = random.Random(0)
+        field_size_limit = csv.field_size_limit()
+        csv.field_size_limit(40)
+        try:
+            for _ in range(200):
+                for delimiter in [',',' ','\t']:
+                    chars = ['a','1',' ',' ',delimiter,delimiter,'\n','\n']
+                    if rnd.random() < 0.3:
+                        chars += ['"','\\','\r','\t','\0']
+                    lines = ''.join([rnd.choice(chars) for _ in range(rnd.randint(0,200))]).splitlines(True)
+                    for quoting in [csv.QUOTE_MINIMAL,csv.QUOTE_NONE]:
+                        for skip_initial_space in [True,False]:
+                            for escapechar in ['\\',None]:
+                                dialect_params = {'delimiter': delimiter, 'quotechar': '"', 'escapechar': escapechar, 'doublequote': True,
+                                                  'skipinitialspace': skip_initial_space, 'quoting': quoting, 'lineterminator': '\r\n', 'strict': False}
+                                expected, actual = [], []
+                                for records, reader in [(expected, lambda: csv.reader(lines,**dialect_params)),
+                                                        (actual, lambda: generate_split_tokenized_records(lines,dialect_params,rnd.choice([1,3,1000]),0))]:
+                                    try:
+                                        records.extend(reader())
+                                    except csv.Error as e:
+                                        records.append(str(e))
+                                self.assertEqual(actual,expected,(lines,dialect_params))
+        finally:
+            csv.field_size_limit(field_size_limit)
+
+    def test_split_tokenizer_is_used_for_wide_files(self):
+        columns = 25
+        rows = [' '.join(['%s' % (r * c) if c % 5 != 0 else 'v"%s' % r for c in range(columns)]) for r in range(1500)]
+        rows[1200] = ' ' + rows[1200].replace(' ','   ')
+        tmpfile = self._create_file_with_rows(rows)
+
+        for quoting_flag, expected_tokenizer_message in [('-w none','Tokenizing lines by splitting them by the delimiter'),
+                                                         ('','Tokenizing lines using csv.reader')]:
+            cmd = Q_EXECUTABLE + ' %s -V "select count(*),sum(c2),sum(length(c6)),min(c25) from %s"' % (quoting_flag,tmpfile.name)
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode,0)
+            self.assertEqual(o[-1],six.b('1500 %s %s 0' % (sum(range(1500)),sum([len('v"%s' % r) for r in range(1500)]))))
+            self.assertTrue(any(six.b(expected_tokenizer_message) in l for l in e),expected_tokenizer_message)
+
+        self.cleanup(tmpfile)
+
+    def test_split_tokenizer_falls_back_to_csv_reader(self):
+        columns = 25
+        rows = [','.join(['%s' % (r * c) for c in range(columns)]) for r in range(3000)]
+        rows[2500] = rows[2500].replace(',7500,',',"75\n00",')
+        tmpfile = self._create_file_with_rows(rows)
+
+        cmd = Q_EXECUTABLE + ' -d , -V "select count(*),sum(c4 like \'%%\' || char(10) || \'%%\') from %s"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode,0)
+        self.assertEqual(o[-1],six.b('3000,1'))
+        self.assertTrue(any(six.b('Tokenizing the rest of the lines using csv.reader') in l for l in e))
+
+        rows = [','.join(['%s' % (r * c) for c in range(columns)]) for r in range(3000)]
+        rows[2500] = rows[2500] + ',' + 'x' * 200
+        self.write_file(tmpfile.name,six.b('\n'.join(rows) + '\n'))
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -M 100 "select count(*) from %s"' % tmpfile.name)
+        self.assertEqual(retcode,31)
+        self.assertTrue(e[0].endswith(six.b('Line is 2501, counting from 1 (encoding UTF-8). The line number is the raw line number of the file, ignoring whether there\'s a header or not')),e[0])
+
+        self.cleanup(tmpfile)
+
+    def test_mmap_file_lines_match_text_mode_reading(self):
+        contents = [six.b('a,b\r\nc,d\re,f\n\ng'),
+                    six.b('x\r') * 10 + six.b('\n'),
+                    u'\u05d0\u05d1,\u00e9\n\u20ac\r\n'.encode('utf-8') * 7,
+                    six.b('"quoted\r\nvalue",1\n'),
+                    six.b('no newline at the end'),
+                    six.b('')]
+        for data in contents:
+            tmpfile = self.create_file_with_data(data)
+            expected = list(io.open(tmpfile.name,'r',newline=None,encoding='utf-8'))
+            for block_size in [1,2,3,7,1024]:
+                self.assertEqual(list(generate_mmap_file_lines(tmpfile.name,'utf-8',block_size=block_size)),expected,(data,block_size))
+            self.cleanup(tmpfile)
+
+        tmpfile = self.create_file_with_data(six.b('\xef\xbb\xbfa,b\n1,2\n'))
+        self.assertEqual(list(generate_mmap_file_lines(tmpfile.name,'utf-8-sig',block_size=2)),['a,b\n','1,2\n'])
+        self.cleanup(tmpfile)
+
+    def test_multiple_files_are_read_one_after_the_other(self):
+        tmpfolder = self.create_folder_with_files({
+            'file1': six.b('a,b\n' + ''.join(['%s,x\n' % i for i in range(150)])),
+            'file2': six.b('a,b\n'),
+            'file3': six.b(''),
+            'file4': six.b('a,b\r\n' + ''.join(['%s,y\r\n' % i for i in range(150,300)]) + '300,"z\r\nz"')
+        },'multiple-files','q-mmap')
+
+        cmd = Q_EXECUTABLE + ' -d , -H "select count(*),sum(a),count(distinct b) from %s/*"' % tmpfolder
+        retcode, o, e = run_command(cmd)
+
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('301,%s,3' % sum(range(301)))])
+
+        self.cleanup_folder(tmpfolder)
+
+
+    def _create_gzipped_copy(self, tmpfile):
+        import gzip
+        gz_filename = tmpfile.name + '.gz'
+        with open(tmpfile.name,'rb') as f_in:
+            with gzip.open(gz_filename,'wb') as f_out:
+                f_out.write(f_in.read())
+        return gz_filename
+
+    def test_pipelined_load_gives_the_same_results(self):
+        tmpfile = self._create_grouped_rows_file(23000,5)
+        gz_filename = self._create_gzipped_copy(tmpfile)
+
+        query = 'select k,count(*),sum(a),max(f),min(rowid),max(rowid) from %s group by k'
+        for filename in [tmpfile.name,gz_filename]:
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',pipelined_load=True,read_ahead_queue_depth=1,insert_queue_depth=1))
+            r = q.execute(query.replace('%s',filename))
+            q.done()
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=','))
+            expected = q.execute(query.replace('%s',filename))
+            q.done()
+
+            self.assertEqual(r.status,'ok')
+            self.assertEqual(r.data,expected.data)
+            pipeline_stats = r.metadata.table_structures[filename].pipeline_stats
+            self.assertEqual(pipeline_stats.insert_batch_count,5)
+            # Only compressed files are read ahead, uncompressed ones are memory mapped
+            self.assertEqual(pipeline_stats.read_block_count > 0,filename == gz_filename)
+            self.assertTrue(expected.metadata.table_structures[filename].pipeline_stats is None)
+
+        os.remove(gz_filename)
+        self.cleanup(tmpfile)
+
+    def test_pipelined_load_errors_are_propagated(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i) for i in range(12000)] + ['1,2,3'])
+        gz_filename = self._create_gzipped_copy(tmpfile)
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',parsing_mode='strict',pipelined_load=True))
+        r = q.execute('select count(*) from %s' % gz_filename)
+        q.done()
+        self.assertEqual(r.status,'error')
+        self.assertTrue(r.error.msg.startswith('Strict mode - Expected 2 columns instead of 3 columns'))
+
+        with open(gz_filename,'r+b') as f:
+            f.seek(100)
+            f.write(six.b('corrupted'))
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',pipelined_load=True))
+        r = q.execute('select count(*) from %s' % gz_filename)
+        q.done()
+        self.assertEqual(r.status,'error')
+
+        os.remove(gz_filename)
+        self.cleanup(tmpfile)
+
+    def test_pipelined_load_command_line_options(self):
+        tmpfile = self._create_file_with_rows(['a,b'] + ['%s,%s' % (i,i % 7) for i in range(7000)])
+        gz_filename = self._create_gzipped_copy(tmpfile)
+
+        cmd = Q_EXECUTABLE + ' -d , -H --pipelined-load --read-ahead-queue-depth 2 --insert-queue-depth 1 "select count(*),sum(a),sum(b) from %s"' % gz_filename
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('7000,%s,%s' % (sum(range(7000)),sum([i % 7 for i in range(7000)])))])
+
+        cmd = Q_EXECUTABLE + ' -d , -H --pipelined-load --insert-queue-depth 0 "select count(*) from %s"' % gz_filename
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode,121)
+        self.assertEqual(e,[six.b('Pipelined load queue depths must be at least 1')])
+
+        os.remove(gz_filename)
+        self.cleanup(tmpfile)
+
+
+    def _create_multi_member_gzip_file(self, member_count, rows_per_member):
+        import gzip
+        tmpfile = self.create_file_with_data(six.b(''))
+        gz_filename = tmpfile.name + '.gz'
+        with open(gz_filename,'wb') as f:
+            f.write(gzip.compress(six.b('a,b,c\n')))
+            for m in range(member_count):
+                f.write(gzip.compress(six.b(''.join(['%s,%s,v%s\n' % (i,i % 17,i) for i in range(m * rows_per_member,(m + 1) * rows_per_member)]))))
+        self.cleanup(tmpfile)
+        return gz_filename
+
+    def test_parallel_gzip_decompression_of_multi_member_files(self):
+        import gzip
+        gz_filename = self._create_multi_member_gzip_file(30,2000)
+        with gzip.open(gz_filename,'rb') as f:
+            expected = f.read()
+
+        d = ParallelGzipDecompressor.create(gz_filename,2,part_size=20000)
+        self.assertTrue(len(d.part_offsets) > 5)
+        self.assertEqual(six.b('').join(d.generate_blocks()),expected)
+
+        # Parts which do not end at a member boundary make the rest of the file be decompressed serially
+        d.part_offsets = d.part_offsets[:3] + [d.part_offsets[3] + 7] + d.part_offsets[4:]
+        self.assertEqual(six.b('').join(d.generate_blocks()),expected)
+
+        # Single member files are decompressed as before
+        with gzip.open(gz_filename + '.single.gz','wb') as f:
+            f.write(expected)
+        self.assertTrue(ParallelGzipDecompressor.create(gz_filename + '.single.gz',2,part_size=20000) is None)
+
+        os.remove(gz_filename + '.single.gz')
+        os.remove(gz_filename)
+
+    def test_parallel_gzip_decompression_of_members_larger_than_the_search_window(self):
+        import gzip
+        r = random.Random(0)
+        members = [six.b(''.join(['%s,%032x\n' % (m, r.getrandbits(128)) for i in range(20000)])) for m in range(4)]
+        tmpfile = self.create_file_with_data(six.b('').join([gzip.compress(member) for member in members]))
+        member_sizes = [len(gzip.compress(member)) for member in members]
+        self.assertTrue(min(member_sizes) > bin.q.GZIP_MEMBER_SEARCH_WINDOW_SIZE)
+
+        d = ParallelGzipDecompressor.create(tmpfile.name,2,part_size=100000)
+        self.assertTrue(d is not None)
+        self.assertEqual(len(d.part_offsets), 5)
+        self.assertEqual(six.b('').join(d.generate_blocks()),six.b('').join(members))
+
+        self.cleanup(tmpfile)
+
+    def test_multi_member_gzip_file_is_loaded_with_parallel_decompression(self):
+        gz_filename = self._create_multi_member_gzip_file(30,2000)
+        query = 'select count(*),sum(a),max(c),min(rowid),max(rowid) from %s where b = 3' % gz_filename
+
+        original_part_size = bin.q.PARALLEL_GZIP_PART_SIZE
+        bin.q.PARALLEL_GZIP_PART_SIZE = 20000
+        try:
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',parallel_load=2))
+            r = q.execute(query)
+            q.done()
+        finally:
+            bin.q.PARALLEL_GZIP_PART_SIZE = original_part_size
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=','))
+        expected = q.execute(query)
+        q.done()
+
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(r.data,expected.data)
+        self.assertEqual(r.data[0][0],3530)
+
+        os.remove(gz_filename)
+
+
+    def _create_compressed_copies(self, data):
+        import gzip, bz2, lzma
+        tmpfolder = self.create_folder_with_files({
+            'data.csv.gz': gzip.compress(data),
+            'data-gz-without-suffix': gzip.compress(data[:20]) + gzip.compress(data[20:]),
+            'data.csv.bz2': bz2.compress(data[:20]) + bz2.compress(data[20:]),
+            'data.csv.xz': lzma.compress(data)
+        },'compressed','q-compression')
+        return tmpfolder, ['data.csv.gz','data-gz-without-suffix','data.csv.bz2','data.csv.xz']
+
+    def test_detect_compression(self):
+        import gzip, bz2, lzma
+        self.assertEqual(detect_compression(gzip.compress(six.b('a'))[:10]),'gzip')
+        self.assertEqual(detect_compression(bz2.compress(six.b('a'))[:10]),'bz2')
+        self.assertEqual(detect_compression(bz2.compress(six.b(''))[:10]),'bz2')
+        self.assertEqual(detect_compression(lzma.compress(six.b('a'))[:10]),'xz')
+        self.assertEqual(detect_compression(six.b('\x28\xb5\x2f\xfd\x00\x58')),'zstd')
+        self.assertEqual(detect_compression(six.b('BZh9,1,2\n')),None)
+        self.assertEqual(detect_compression(six.b('a,b\n')),None)
+        self.assertEqual(detect_compression(six.b('')),None)
+
+    def test_compressed_files_are_detected(self):
+        data = six.b('a,b\n' + ''.join(['%s,%s\n' % (i,i * 2) for i in range(1000)]))
+        tmpfolder, filenames = self._create_compressed_copies(data)
+
+        for filename in filenames:
+            cmd = Q_EXECUTABLE + ' -d , -H "select count(*),sum(a),sum(b) from %s/%s"' % (tmpfolder,filename)
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode,0,filename)
+            self.assertEqual(o,[six.b('1000,499500,999000')],filename)
+
+        cmd = Q_EXECUTABLE + ' -d , -H "select count(*),sum(a) from %s/*"' % tmpfolder
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('4000,1998000')])
+
+        self.cleanup_folder(tmpfolder)
+
+    def test_compressed_stdin_is_detected(self):
+        data = six.b('a,b\n' + ''.join(['%s,%s\n' % (i,i * 2) for i in range(1000)]))
+        tmpfolder, filenames = self._create_compressed_copies(data)
+
+        for filename in filenames:
+            cmd = 'cat %s/%s | ' % (tmpfolder,filename) + Q_EXECUTABLE + ' -d , -H "select count(*),sum(a),sum(b) from -"'
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode,0,filename)
+            self.assertEqual(o,[six.b('1000,499500,999000')],filename)
+
+        # Text which starts with the bz2 magic bytes is not compressed data
+        cmd = 'printf "BZh9,1\\nBZh1,2\\n" | ' + Q_EXECUTABLE + ' -d , "select c1,c2 from -"'
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('BZh9,1'),six.b('BZh1,2')])
+
+        self.cleanup_folder(tmpfolder)
+
+    def test_zstd_compressed_input(self):
+        try:
+            import zstandard
+        except ImportError:
+            zstandard = None
+
+        if zstandard is None:
+            cmd = 'printf "\\050\\265\\057\\375\\000\\000" | ' + Q_EXECUTABLE + ' "select * from -"'
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode,37)
+            self.assertEqual(e,[six.b("Reading zstd compressed data requires the zstandard python module. Install it using 'pip install zstandard'")])
+        else:
+            tmpfile = self.create_file_with_data(zstandard.ZstdCompressor().compress(six.b('1\n2\n3\n')))
+            cmd = Q_EXECUTABLE + ' "select sum(c1) from %s"' % tmpfile.name
+            retcode, o, e = run_command(cmd)
+            self.assertEqual(retcode,0)
+            self.assertEqual(o,[six.b('6')])
+            self.cleanup(tmpfile)
+
+
+    def _create_gzip_file_for_indexing(self, row_count, quoted=False):
+        import gzip
+        data = six.b('a,b\n' + ''.join([('%s,"%s"\n' if quoted and i % 1000 == 999 else '%s,%s\n') % (i,hashlib.sha1(six.b(str(i))).hexdigest()) for i in range(row_count)]))
+        tmpfile = self.create_file_with_data(gzip.compress(data))
+        return tmpfile, data
+
+    def _build_gzip_index(self, filename, span):
+        builder = GzipIndexBuilder(filename,span=span)
+        data = builder.read()
+        builder.close()
+        return data
+
+    def test_gzip_index_access_points(self):
+        tmpfile, data = self._create_gzip_file_for_indexing(20000)
+
+        self.assertEqual(self._build_gzip_index(tmpfile.name,50000),data)
+        gzip_index = GzipIndex.load(tmpfile.name)
+        self.assertTrue(len(gzip_index.points) > 5)
+        self.assertEqual(gzip_index.uncompressed_size,len(data))
+        for point in gzip_index.points:
+            self.assertEqual(six.b('').join(generate_gzip_index_point_blocks(tmpfile.name,point)),data[point['out_offset']:])
+
+        # Regions contain whole lines, and together they contain all the lines exactly once
+        end_offsets = [point['out_offset'] for point in gzip_index.points[1:]] + [None]
+        regions = [read_gzip_index_region(tmpfile.name,point,end_offset) for point, end_offset in zip(gzip_index.points,end_offsets)]
+        self.assertEqual(six.b('').join(regions),data)
+        self.assertTrue(all([region.endswith(six.b('\n')) for region in regions]))
+
+        # Indices of modified files are ignored
+        os.utime(tmpfile.name,None)
+        self.assertTrue(GzipIndex.load(tmpfile.name) is None)
+
+        os.remove(GzipIndex.get_index_filename(tmpfile.name))
+        self.cleanup(tmpfile)
+
+    def test_multi_member_gzip_files_are_not_indexed(self):
+        gz_filename = self._create_multi_member_gzip_file(3,1000)
+        import gzip
+        with gzip.open(gz_filename,'rb') as f:
+            expected = f.read()
+
+        self.assertEqual(self._build_gzip_index(gz_filename,1000),expected)
+        self.assertFalse(os.path.exists(GzipIndex.get_index_filename(gz_filename)))
+
+        os.remove(gz_filename)
+
+    def test_parallel_load_of_indexed_gzip_file(self):
+        for quoted in [False, True]:
+            tmpfile, data = self._create_gzip_file_for_indexing(60000,quoted=quoted)
+            query = 'select count(*),sum(a),max(b),min(rowid),max(rowid) from %s' % tmpfile.name
+
+            original_span = bin.q.GZIP_INDEX_SPAN
+            bin.q.GZIP_INDEX_SPAN = 100000
+            try:
+                q = QTextAsData(QInputParams(skip_header=True,delimiter=',',build_gzip_index=True))
+                expected = q.execute(query)
+                q.done()
+            finally:
+                bin.q.GZIP_INDEX_SPAN = original_span
+            self.assertTrue(len(GzipIndex.load(tmpfile.name).points) > 2)
+
+            # Quoted values make the workers fall back to a serial load
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',parallel_load=2))
+            r = q.execute(query)
+            q.done()
+
+            self.assertEqual(r.status,'ok')
+            self.assertEqual(r.data,expected.data)
+            self.assertEqual(r.data[0][:2],(60000,sum(range(60000))))
+
+            os.remove(GzipIndex.get_index_filename(tmpfile.name))
+            self.cleanup(tmpfile)
+
+    def test_build_gzip_index_command_line_option(self):
+        tmpfile, data = self._create_gzip_file_for_indexing(1000)
+
+        cmd = Q_EXECUTABLE + ' -d , -H "select count(*) from %s"' % tmpfile.name
+        retcode, o, e = run_command(cmd)
+        self.assertEqual(retcode,0)
+        self.assertFalse(os.path.exists(GzipIndex.get_index_filename(tmpfile.name)))
+
+        retcode, o, e = run_command(cmd + ' --build-gzip-index')
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('1000')])
+        self.assertEqual(len(GzipIndex.load(tmpfile.name).points),1)
+
+        os.remove(GzipIndex.get_index_filename(tmpfile.name))
+        self.cleanup(tmpfile)
+
+
+    def _create_quoted_multiline_file(self, row_count):
+        return self.create_file_with_data(six.b('a,b,c\n' + ''.join(['%s,"x%s\ny",%s\n' % (i,i,'"z,""w"""' if i % 3 == 0 else 'q') for i in range(row_count)])))
+
+    def test_record_offset_index(self):
+        import csv
+        tmpfile = self._create_quoted_multiline_file(1000)
+        dialect_params = {'delimiter': ',', 'quotechar': '"', 'escapechar': None, 'doublequote': True, 'skipinitialspace': True,
+                          'quoting': csv.QUOTE_MINIMAL, 'lineterminator': '\r\n', 'strict': False}
+        input_params = QInputParams(delimiter=',')
+
+        record_offset_index = RecordOffsetIndex.build(tmpfile.name,input_params,dialect_params,interval=64)
+        self.assertEqual(record_offset_index.record_count,1001)
+        self.assertEqual(len(record_offset_index.offsets),16)
+
+        # Each offset is the start of the indexed record
+        with open(tmpfile.name,'rb') as f:
+            data = f.read()
+        records = list(csv.reader(io.StringIO(data.decode('utf-8'),newline=None),**dialect_params))
+        for i, offset in enumerate(record_offset_index.offsets):
+            rest = list(csv.reader(io.StringIO(data[offset:].decode('utf-8'),newline=None),**dialect_params))
+            self.assertEqual(rest,records[i * 64:])
+
+        record_offset_index.save(tmpfile.name)
+        self.assertEqual(RecordOffsetIndex.load(tmpfile.name,input_params,dialect_params).offsets,record_offset_index.offsets)
+        # Indices are used only with the same dialect, and only while the file is unchanged
+        self.assertTrue(RecordOffsetIndex.load(tmpfile.name,input_params,dict(dialect_params,delimiter=';')) is None)
+        with open(tmpfile.name,'ab') as f:
+            f.write(six.b('1,2,3\n'))
+        self.assertTrue(RecordOffsetIndex.load(tmpfile.name,input_params,dialect_params) is None)
+
+        os.remove(RecordOffsetIndex.get_index_filename(tmpfile.name))
+        self.cleanup(tmpfile)
+
+    def test_record_offset_index_cannot_be_built_for_unsupported_files(self):
+        import csv
+        dialect_params = {'delimiter': ',', 'quotechar': '"', 'escapechar': None, 'doublequote': True, 'skipinitialspace': True,
+                          'quoting': csv.QUOTE_MINIMAL, 'lineterminator': '\r\n', 'strict': False}
+        for data in [six.b('a,b\r1,2\n'), six.b('a,\xff\n')]:
+            tmpfile = self.create_file_with_data(data)
+            self.assertRaises(RecordIndexException,RecordOffsetIndex.build,tmpfile.name,QInputParams(delimiter=','),dialect_params)
+            self.cleanup(tmpfile)
+
+    def test_build_index_command_line_option(self):
+        tmpfile = self._create_quoted_multiline_file(30000)
+        queries = ['select count(*) from %s' % tmpfile.name,
+                   'select count(*),sum(a),max(b),min(rowid),max(rowid) from %s' % tmpfile.name]
+        expected = [run_command(Q_EXECUTABLE + ' -d , -H "%s"' % query)[1] for query in queries]
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , --build-index %s' % tmpfile.name)
+        self.assertEqual(retcode,0)
+        self.assertEqual(o,[six.b('Built record index %s: 30001 records, 4 offsets' % RecordOffsetIndex.get_index_filename(tmpfile.name))])
+
+        for query, expected_output in zip(queries,expected):
+            for flags in ['-d , -H','-d , -H --parallel-load 2']:
+                retcode, o, e = run_command(Q_EXECUTABLE + ' %s "%s"' % (flags,query))
+                self.assertEqual(retcode,0)
+                self.assertEqual(o,expected_output)
+        self.assertEqual(expected[0],[six.b('30000')])
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , --build-index %s-non-existent' % tmpfile.name)
+        self.assertEqual(retcode,122)
+        self.assertEqual(e,[six.b("No files matching '%s-non-existent' have been found" % tmpfile.name)])
+
+        os.remove(RecordOffsetIndex.get_index_filename(tmpfile.name))
+        self.cleanup(tmpfile)
+
+    def _create_file_for_sampling(self, row_count, quoted=False):
+        # Values of b are derived from a, so misaligned records would be noticed
+        return self.create_file_with_data(six.b('a,b\n' + ''.join(['%s,%s\n' % (i, '"v%s"' % i if quoted else 'v%s' % (i * 7)) for i in range(row_count)])))
+
+    def _assert_valid_sample(self, rows, row_count, quoted=False):
+        self.assertEqual(len(set([a for a, _ in rows])),len(rows))
+        for a, b in rows:
+            self.assertTrue(0 <= a < row_count)
+            self.assertEqual(b,'v%s' % (a if quoted else a * 7))
+
+    def test_row_sampler(self):
+        for sample, expected_row_count in [(100, 100), (5000, 1000)]:
+            row_sampler = RowSampler(sample,random.Random(5))
+            self.assertEqual([row_sampler.add(i) for i in range(1000)],[False] * 1000)
+            rows = row_sampler.get_rows()
+            self.assertEqual(len(rows),expected_row_count)
+            self.assertEqual(rows,sorted(set(rows)))
+
+        row_sampler = RowSampler(0.1,random.Random(5))
+        selected = [i for i in range(100000) if row_sampler.add(i)]
+        self.assertTrue(9000 < len(selected) < 11000)
+        self.assertEqual(row_sampler.get_sampled_row_count(),len(selected))
+        self.assertEqual(row_sampler.get_rows(),[])
+
+        self.assertEqual(parse_sample_size('1000'),1000)
+        self.assertEqual(parse_sample_size('0.25'),0.25)
+        self.assertEqual(parse_sample_size('1.0'),1.0)
+        for s in ['0', '1.5', '-0.1', 'abc']:
+            self.assertRaises(ValueError,parse_sample_size,s)
+
+    def test_sample_of_file_and_stdin(self):
+        tmpfile = self._create_file_for_sampling(10000)
+
+        for source, redirection in [(tmpfile.name, ''), ('-', '< %s' % tmpfile.name)]:
+            for seed in ['', '--sample-seed 7']:
+                cmd = Q_EXECUTABLE + ' -d , -H -O --sample 100 %s "select a,b from %s" %s' % (seed,source,redirection)
+                retcode, o, e = run_command(cmd)
+                self.assertEqual(retcode,0)
+                self.assertEqual(len(e),0)
+                self.assertEqual(o[0],six.b('a,b'))
+                rows = [(int(a),b.decode('utf-8')) for a, b in [line.split(six.b(',')) for line in o[1:]]]
+                self.assertEqual(len(rows),100)
+                self._assert_valid_sample(rows,10000)
+                self.assertEqual(rows,sorted(rows))
+                if seed != '':
+                    self.assertEqual(run_command(cmd)[1],o)
+
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H --sample 0.1 "select count(*),count(distinct a) from %s" %s' % (source,redirection))
+            self.assertEqual(retcode,0)
+            sampled_row_count, distinct_count = [int(x) for x in o[0].split(six.b(','))]
+            self.assertTrue(800 < sampled_row_count < 1200)
+            self.assertEqual(distinct_count,sampled_row_count)
+
+        self.cleanup(tmpfile)
+
+    def test_sample_by_seeking(self):
+        original_window_size = bin.q.SAMPLE_PROBE_WINDOW_SIZE
+        original_pilot_size = bin.q.SAMPLE_PILOT_SIZE
+        bin.q.SAMPLE_PROBE_WINDOW_SIZE = 128
+        bin.q.SAMPLE_PILOT_SIZE = 1024
+        try:
+            for quoted, expected_method in [(False, 'random seeks'), (True, 'reading all rows')]:
+                tmpfile = self._create_file_for_sampling(20000,quoted=quoted)
+                q = QTextAsData(QInputParams(skip_header=True,delimiter=',',sample=200,sample_seed=3))
+                r = q.execute('select a,b from %s' % tmpfile.name)
+                q.done()
+
+                self.assertEqual(r.status,'ok')
+                self.assertEqual(len(r.data),200)
+                self._assert_valid_sample(r.data,20000,quoted=quoted)
+                sampling = r.metadata.new_table_structures[tmpfile.name].sampling
+                self.assertTrue(sampling.startswith('200 rows, %s, seed 3 - 200 rows sampled out of ' % expected_method))
+                self.cleanup(tmpfile)
+        finally:
+            bin.q.SAMPLE_PROBE_WINDOW_SIZE = original_window_size
+            bin.q.SAMPLE_PILOT_SIZE = original_pilot_size
+
+    def test_sample_using_record_index(self):
+        tmpfile = self._create_file_for_sampling(20000,quoted=True)
+        input_params = QInputParams(skip_header=True,delimiter=',')
+
+        original_interval = bin.q.RECORD_INDEX_INTERVAL
+        bin.q.RECORD_INDEX_INTERVAL = 100
+        try:
+            q = QTextAsData(input_params)
+            q.build_record_indices(tmpfile.name)
+            q.done()
+        finally:
+            bin.q.RECORD_INDEX_INTERVAL = original_interval
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=',',sample=0.01))
+        r = q.execute('select a,b from %s' % tmpfile.name)
+        q.done()
+
+        self.assertEqual(r.status,'ok')
+        self.assertEqual(len(r.data),200)
+        self._assert_valid_sample(r.data,20000,quoted=True)
+        self.assertEqual(r.metadata.new_table_structures[tmpfile.name].sampling,
+                         'fraction 0.01, random seeks using the record index - 200 rows sampled out of 20000 rows')
+
+        os.remove(RecordOffsetIndex.get_index_filename(tmpfile.name))
+        self.cleanup(tmpfile)
+
+    def test_sample_analysis_and_invalid_sample_sizes(self):
+        tmpfile = self._create_file_for_sampling(100)
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H --sample 10 --sample-seed 3 -A "select * from %s"' % tmpfile.name)
+        self.assertEqual(retcode,0)
+        self.assertEqual(len(e),0)
+        self.assertEqual(o[3],six.b('  Sampling: 10 rows, random seeks if possible, seed 3'))
+        self.assertEqual(o[4],six.b('  Fields:'))
+
+        for sample in ['0', '1.5', 'abc']:
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H --sample %s "select * from %s"' % (sample,tmpfile.name))
+            self.assertEqual(retcode,123)
+            self.assertEqual(len(o),0)
+            self.assertTrue(e[0].startswith(six.b('Sample must be either a fraction')))
+
+        self.cleanup(tmpfile)
+
+    def test_byte_ranges_split_a_file(self):
+        plain_file = self.create_file_with_data(six.b('a,b\n' + ''.join(['%s,v%s\n' % (i, i * 7) for i in range(3000)])))
+        quoted_file = self._create_quoted_multiline_file(3000)
+
+        for tmpfile, build_index in [(plain_file, False), (quoted_file, False), (quoted_file, True)]:
+            if build_index:
+                q = QTextAsData(QInputParams(delimiter=','))
+                q.build_record_indices(tmpfile.name)
+                q.done()
+            file_size = os.path.getsize(tmpfile.name)
+            expected = run_command(Q_EXECUTABLE + ' -d , -H "select * from %s"' % tmpfile.name)[1]
+
+            boundaries = [0, 1, 17, file_size // 3, file_size // 3 + 1, file_size - 5, file_size]
+            o = []
+            for start_offset, end_offset in zip(boundaries[:-1], boundaries[1:]):
+                retcode, part_o, e = run_command(Q_EXECUTABLE + ' -d , -H "select * from %s" --byte-range %s:%s' % (tmpfile.name,start_offset,end_offset))
+                self.assertEqual(retcode,0)
+                o += part_o
+            self.assertEqual(o,expected)
+
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H -O "select * from %s" --byte-range %s:' % (tmpfile.name,file_size // 2))
+            self.assertEqual(retcode,0)
+            self.assertEqual(o[0],six.b('a,b') if tmpfile is plain_file else six.b('a,b,c'))
+            self.assertEqual(o[-1],expected[-1])
+
+        os.remove(RecordOffsetIndex.get_index_filename(quoted_file.name))
+        self.cleanup(plain_file)
+        self.cleanup(quoted_file)
+
+    def test_record_ranges(self):
+        import gzip
+        tmpfile = self._create_quoted_multiline_file(3000)
+        gz_filename = '%s.gz' % tmpfile.name
+        with open(tmpfile.name,'rb') as f:
+            data = f.read()
+        with gzip.open(gz_filename,'wb') as f:
+            f.write(data)
+        query = 'select count(*),min(a),max(a),sum(a) from %s'
+
+        for record_range, expected in [('10:20', (10,10,19,145)), (':5', (5,0,4,10)), ('2990:', (10,2990,2999,29945)), ('2995:5000', (5,2995,2999,14985))]:
+            for source, redirection in [(tmpfile.name, ''), (gz_filename, ''), ('-', '< %s' % tmpfile.name)]:
+                retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H "%s" --record-range %s %s' % (query % source,record_range,redirection))
+                self.assertEqual(retcode,0)
+                self.assertEqual(o,[six.b(','.join(map(str,expected)))])
+
+        # Reading starts at the indexed record which precedes the range
+        original_interval = bin.q.RECORD_INDEX_INTERVAL
+        bin.q.RECORD_INDEX_INTERVAL = 64
+        try:
+            q = QTextAsData(QInputParams(delimiter=','))
+            q.build_record_indices(tmpfile.name)
+            q.done()
+        finally:
+            bin.q.RECORD_INDEX_INTERVAL = original_interval
+        for first_record, end_record in [(0, 1), (63, 64), (63, 200), (1000, None), (2999, 3000), (3000, None)]:
+            q = QTextAsData(QInputParams(skip_header=True,delimiter=',',record_range=(first_record,end_record)))
+            r = q.execute('select a,b from %s' % tmpfile.name)
+            q.done()
+            self.assertEqual(r.status,'ok')
+            self.assertEqual(r.data,[(i,'x%s\ny' % i) for i in range(first_record,end_record if end_record is not None else 3000)])
+
+        os.remove(RecordOffsetIndex.get_index_filename(tmpfile.name))
+        os.remove(gz_filename)
+        self.cleanup(tmpfile)
+
+    def test_range_reads_are_cached_separately(self):
+        tmpfile = self.create_file_with_data(six.b('a\n' + ''.join(['%s\n' % i for i in range(1000)])))
+        range_qsql_filename = '%s.records-0-10.qsql' % tmpfile.name
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -H -C readwrite "select count(*) from %s" --record-range 0:10' % tmpfile.name)
+        self.assertEqual(o,[six.b('10')])
+        self.assertTrue(os.path.exists(range_qsql_filename))
+        self.assertFalse(os.path.exists('%s.qsql' % tmpfile.name))
+
+        for flags, expected in [('', '1000'), ('--record-range 0:10', '10'), ('--record-range 0:20', '20'), ('--byte-range 0:10', '4')]:
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -H -C read "select count(*) from %s" %s' % (tmpfile.name,flags))
+            self.assertEqual(retcode,0)
+            self.assertEqual(o,[six.b(expected)])
+
+        os.remove(range_qsql_filename)
+        self.cleanup(tmpfile)
+
+    def test_invalid_ranges(self):
+        import gzip
+        tmpfile = self.create_file_with_data(six.b('a\n1\n2\n'))
+        gz_filename = '%s.gz' % tmpfile.name
+        with gzip.open(gz_filename,'wb') as f:
+            f.write(six.b('a\n1\n2\n'))
+
+        for flags in ['--byte-range 5:3', '--record-range 1', '--record-range x:5', '--byte-range=-1:', '--byte-range 0:1 --record-range 0:1']:
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -H "select * from %s" %s' % (tmpfile.name,flags))
+            self.assertEqual(retcode,124)
+            self.assertEqual(len(o),0)
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -H "select * from %s" --byte-range 0:3' % gz_filename)
+        self.assertEqual(retcode,38)
+        self.assertEqual(e,[six.b('Byte ranges can only be read from uncompressed files, without universal newlines (%s)' % gz_filename)])
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -H "select * from -" --byte-range 0:3 < %s' % tmpfile.name)
+        self.assertEqual(retcode,38)
+        self.assertEqual(e,[six.b('Byte ranges cannot be read from data streams (stdin)')])
+
+        os.remove(gz_filename)
+        self.cleanup(tmpfile)
+
+
+    def test_type_inference_of_value_lists(self):
+        column_inferer = TableColumnInferer(QInputParams())
+        for value_list, expected_type in [
+                (['1', ' -2 ', '+30', None, ''], int),
+                (['1', '2.5', '1e3', '.5', None], float),
+                (['1.', '-1E-3', 'nan', 'inf'], float),
+                (['1_000', six.u('\u0661\u0662')], int),
+                (['1', '2', 'x'], str),
+                (['1', '0x10'], str),
+                ([None, '', '  '], None),
+                ([], str)]:
+            self.assertEqual(column_inferer.determine_type_of_value_list(value_list),expected_type)
+
+        self.assertEqual(TableColumnInferer(QInputParams(disable_column_type_detection=True)).determine_type_of_value_list(['1', '2']),str)
+
+    def test_type_inference_rows(self):
+        tmpfile = self.create_file_with_data(six.b('a,b\n' + ''.join(['%s,%s\n' % (i, i) for i in range(150)]) + 'x,1.5\n'))
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H -A "select * from %s"' % tmpfile.name)
+        self.assertEqual(retcode,0)
+        self.assertTrue(six.b('    `a` - int') in o)
+        self.assertTrue(six.b('    `b` - int') in o)
+
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H -A --type-inference-rows 200 "select * from %s"' % tmpfile.name)
+        self.assertEqual(retcode,0)
+        self.assertTrue(six.b('    `a` - text') in o)
+        self.assertTrue(six.b('    `b` - real') in o)
+
+        for flags in ['--type-inference-rows 0', '--type-inference-sample-rows -1']:
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H "select * from %s" %s' % (tmpfile.name,flags))
+            self.assertEqual(retcode,125)
+            self.assertEqual(len(o),0)
+
+        self.cleanup(tmpfile)
+
+    def test_type_inference_sample_rows(self):
+        import gzip
+        # The only decimal value is far beyond the first rows
+        data = six.b('a,b\n' + ''.join(['%s,v%s\n' % (i, i) for i in range(1000)]) + '0.5,v\n' + ''.join(['%s,v%s\n' % (i, i) for i in range(1000)]))
+        tmpfile = self.create_file_with_data(data)
+        gz_filename = '%s.gz' % tmpfile.name
+        with gzip.open(gz_filename,'wb') as f:
+            f.write(data)
+
+        for filename in [tmpfile.name, gz_filename]:
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H -A "select * from %s"' % filename)
+            self.assertEqual(retcode,0)
+            self.assertTrue(six.b('    `a` - int') in o)
+
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H -A --type-inference-sample-rows 3000 "select * from %s"' % filename)
+            self.assertEqual(retcode,0)
+            self.assertTrue(six.b('    `a` - real') in o)
+
+            retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H -O --type-inference-sample-rows 3000 "select count(*),sum(a) from %s"' % filename)
+            self.assertEqual(retcode,0)
+            self.assertEqual(o,[six.b('count(*),sum(a)'),six.b('2001,999000.5')])
+
+        # Data streams are not sampled
+        retcode, o, e = run_command(Q_EXECUTABLE + ' -d , -H -A --type-inference-sample-rows 3000 "select * from -" < %s' % tmpfile.name)
+        self.assertEqual(retcode,0)
+        self.assertTrue(six.b('    `a` - int') in o)
+
+        os.remove(gz_filename)
+        self.cleanup(tmpfile)
+
+    def test_type_inference_sample_rows_by_seeking(self):
+        original_window_size = bin.q.SAMPLE_PROBE_WINDOW_SIZE
+        original_pilot_size = bin.q.SAMPLE_PILOT_SIZE
+        bin.q.SAMPLE_PROBE_WINDOW_SIZE = 128
+        bin.q.SAMPLE_PILOT_SIZE = 1024
+        try:
+            # Every tenth value of a is decimal, starting after the first rows
+            tmpfile = self.create_file_with_data(six.b('a,b\n' + ''.join(['%s,v%s\n' % (i + 0.5 if i > 200 and i % 10 == 0 else i, i) for i in range(20000)])))
+            for type_inference_sample_rows, expected_type in [(0, int), (200, float)]:
+                q = QTextAsData(QInputParams(skip_header=True,delimiter=',',type_inference_sample_rows=type_inference_sample_rows))
+                r = q.execute('select count(*) from %s' % tmpfile.name)
+                q.done()
+
+                self.assertEqual(r.status,'ok')
+                self.assertEqual(r.data,[(20000,)])
+                self.assertEqual(r.metadata.new_table_structures[tmpfile.name].python_column_types,[expected_type,str])
+            self.cleanup(tmpfile)
+        finally:
+            bin.q.SAMPLE_PROBE_WINDOW_SIZE = original_window_size
+            bin.q.SAMPLE_PILOT_SIZE = original_pilot_size
+
+
+class BasicModuleTests(AbstractQTestCase):
+
+    def test_engine_isolation(self):
+        tmpfile1 = self.create_file_with_data(six.b("a b c\n1 2 3\n4 5 6"))
+        tmpfile2 = self.create_file_with_data(six.b("d e f\n10 20 30\n40 50 60"))
+
+        # Run file 1 on engine 1
+        q1 = QTextAsData(QInputParams(skip_header=True,delimiter=' '))
+        r = q1.execute('select * from %s' % tmpfile1.name)
+        print("QueryQuery",file=sys.stdout)
+
+        self.assertTrue(r.status == 'ok')
+        self.assertEqual(len(r.warnings),0)
+        self.assertEqual(len(r.data),2)
+        self.assertEqual(r.metadata.output_column_name_list,['a','b','c'])
+        self.assertEqual(r.data,[(1,2,3),(4,5,6)])
+        self.assertTrue(tmpfile1.name in r.metadata.table_structures)
+        self.assertTrue(tmpfile1.name in r.metadata.new_table_structures)
+        self.assertEqual(r.metadata.table_structures[tmpfile1.name].atomic_fns,[tmpfile1.name])
+        self.assertEqual(r.metadata.table_structures[tmpfile1.name].source_type,'file')
+        self.assertEqual(r.metadata.table_structures[tmpfile1.name].source,tmpfile1.name)
+
+        # run file 1 on engine 2
+        q2 = QTextAsData(QInputParams(skip_header=True,delimiter=' '))
+        r2 = q2.execute('select * from %s' % tmpfile1.name)
+        print("QueryQuery",file=sys.stdout)
+
+        self.assertTrue(r2.status == 'ok')
+        self.assertEqual(len(r2.warnings),0)
+        self.assertEqual(len(r2.data),2)
+        self.assertEqual(r2.metadata.output_column_name_list,['a','b','c'])
+        self.assertEqual(r2.data,[(1,2,3),(4,5,6)])
+        self.assertTrue(tmpfile1.name in r2.metadata.table_structures)
+        self.assertTrue(tmpfile1.name in r2.metadata.new_table_structures)
+        self.assertEqual(r2.metadata.table_structures[tmpfile1.name].atomic_fns,[tmpfile1.name])
+        self.assertEqual(r2.metadata.table_structures[tmpfile1.name].source_type,'file')
+        self.assertEqual(r2.metadata.table_structures[tmpfile1.name].source,tmpfile1.name)
+
+        # run file 2 on engine 1
+        r3 = q1.execute('select * from %s' % tmpfile2.name)
+        print("QueryQuery",file=sys.stdout)
+
+        print(r3)
+        self.assertTrue(r3.status == 'ok')
+        self.assertEqual(len(r3.warnings),0)
+        self.assertEqual(len(r3.data),2)
+        self.assertEqual(r3.metadata.output_column_name_list,['d','e','f'])
+        self.assertEqual(r3.data,[(10,20,30),(40,50,60)])
+        self.assertTrue(tmpfile2.name in r3.metadata.table_structures)
+        self.assertTrue(tmpfile2.name in r3.metadata.new_table_structures)
+        self.assertEqual(r3.metadata.table_structures[tmpfile2.name].atomic_fns,[tmpfile2.name])
+        self.assertEqual(r3.metadata.table_structures[tmpfile2.name].source,tmpfile2.name)
+        self.assertEqual(r3.metadata.table_structures[tmpfile2.name].source_type,'file')
+
+        q1.done()
+        q2.done()
+
+        self.cleanup(tmpfile1)
+        self.cleanup(tmpfile2)
+
+    def test_simple_query(self):
+        tmpfile = self.create_file_with_data(six.b("a b c\n1 2 3\n4 5 6"))
+
+        q = QTextAsData(QInputParams(skip_header=True,delimiter=' '))
+        r = q.execute('select * from %s' % tmpfile.name)
+
+        self.assertTrue(r.status == 'ok')
+        self.assertEqual(len(r.warnings),0)
         self.assertEqual(len(r.data),2)
         self.assertEqual(r.metadata.output_column_name_list,['a','b','c'])
         self.assertEqual(r.data,[(1,2,3),(4,5,6)])
@@ -5690,6 +7697,72 @@ class BenchmarkTests(AbstractQTestCase):
             return '{} -d , {} "select count(*) from {}"'.format(Q_EXECUTABLE,additional_params, data_filename)
         self._perform_test_performance_matrix(Q_BENCHMARK_NAME,generate_q_cmd)
 
+    def test_row_normalizer_throughput(self):
+        # Compares the rows/sec of the per-table row normalizer with the generic per-row normalization which was
+        # used before, on the column counts of the benchmark matrix
+        def generic_normalize_col_vals(col_vals, mode, expected_col_count, numeric_column_indices, input_delimiter):
+            new_vals = col_vals[:]
+            for i in numeric_column_indices:
+                if i < len(col_vals) and col_vals[i] == '':
+                    new_vals[i] = None
+            col_vals = new_vals
+            actual_col_count = len(col_vals)
+            if mode == 'strict':
+                if actual_col_count != expected_col_count:
+                    raise ValueError(actual_col_count)
+                return col_vals
+            if actual_col_count < expected_col_count:
+                col_vals = col_vals + [None for x in range(expected_col_count - actual_col_count)]
+            if mode == 'relaxed':
+                if actual_col_count > expected_col_count:
+                    return col_vals[:expected_col_count - 1] + \
+                        [input_delimiter.join([v if v is not None else '' for v in col_vals[expected_col_count - 1:]])]
+                return col_vals
+
+        row_count = 100000
+        for columns in [1, 5, 10, 20, 50, 100]:
+            numeric_column_indices = [i for i in range(columns) if i % 2 == 0]
+            rows = [[str(r * i) if (r + i) % 10 != 0 else '' for i in range(columns)] for r in range(row_count)]
+            for mode in ['relaxed', 'strict']:
+                t0 = time.time()
+                expected = [generic_normalize_col_vals(row, mode, columns, numeric_column_indices, ',') for row in rows]
+                generic_duration = time.time() - t0
+
+                normalize_row = create_row_normalizer(mode, columns, numeric_column_indices, ',', None, None)
+                row_copies = [row[:] for row in rows]
+                t0 = time.time()
+                actual = [normalize_row(row) for row in row_copies]
+                specialized_duration = time.time() - t0
+
+                self.assertEqual(actual, expected)
+                print("columns=%s mode=%s: generic %d rows/sec, specialized %d rows/sec" %
+                      (columns, mode, row_count / generic_duration, row_count / specialized_duration))
+
+    def test_split_tokenizer_throughput(self):
+        # Compares the rows/sec of csv.reader with generate_split_tokenized_records over the lines of files of the benchmark
+        # matrix column counts, using q's default dialect for comma delimited files
+        dialect_params = {'delimiter': ',', 'quotechar': '"', 'escapechar': '\\', 'doublequote': True, 'skipinitialspace': True,
+                          'quoting': csv.QUOTE_MINIMAL, 'lineterminator': '\r\n', 'strict': False}
+        for columns in [1, 5, 10, 20, 50, 100]:
+            for row_count in [50000, 200000]:
+                tmpfile = self.create_file_with_data(six.b(''.join([','.join([str(r * i) if i % 3 != 0 else 'v%s' % r for i in range(columns)]) + '\n' for r in range(row_count)])))
+                lines = list(generate_mmap_file_lines(tmpfile.name,'utf-8'))
+
+                t0 = time.time()
+                expected = sum(1 for _ in csv.reader(lines, **dialect_params))
+                csv_reader_duration = time.time() - t0
+
+                t0 = time.time()
+                actual = sum(1 for _ in generate_split_tokenized_records(lines, dialect_params, min_column_count=0))
+                split_duration = time.time() - t0
+
+                self.assertEqual(actual, expected)
+                self.assertEqual(list(generate_split_tokenized_records(lines[:1000], dialect_params, min_column_count=0)),
+                                 list(csv.reader(lines[:1000], **dialect_params)))
+                print("columns=%s rows=%s: csv.reader %d rows/sec, split tokenizer %d rows/sec" %
+                      (columns, row_count, row_count / csv_reader_duration, row_count / split_duration))
+                self.cleanup(tmpfile)
+
     def _get_textql_version(self):
         r,o,e = run_command("textql --version")
         if r != 0: